@@ -8,7 +8,6 @@ import argparse
 import calendar
 import collections
 import datetime
-import gzip
 import itertools
 import logging
 import os
@@ -109,104 +108,114 @@ class SectionSizeKnobs(object):
 
     self.src_root = path_util.SRC_ROOT
 
+    # Path to a database of per-object-file nm / llvm-bcanalyzer results, used
+    # to skip analyzing objects that have not changed since the last run.
+    self.object_cache_path = None
+    # Whether to compare object file contents (rather than mtimes) when
+    # validating |object_cache_path| entries.
+    self.hash_object_files = False
 
-def _OpenMaybeGz(path):
-  """Calls `gzip.open()` if |path| ends in ".gz", otherwise calls `open()`."""
-  if path.endswith('.gz'):
-    return gzip.open(path, 'rb')
-  return open(path, 'rb')
 
-
-def _NormalizeNames(raw_symbols):
-  """Ensures that all names are formatted in a useful way.
+def _NormalizeName(symbol, found_prefixes=None):
+  """Ensures that the symbol's names are formatted in a useful way.
 
   This includes:
     - Deriving |name| and |template_name| from |full_name|.
     - Stripping of return types (for functions).
     - Moving "vtable for" and the like to be suffixes rather than prefixes.
-  """
-  found_prefixes = set()
-  for symbol in raw_symbols:
-    full_name = symbol.full_name
 
-    # See comment in _CalculatePadding() about when this can happen. Don't
-    # process names for non-native sections.
-    if symbol.IsPak():
-      # full_name: "about_ui_resources.grdp: IDR_ABOUT_UI_CREDITS_HTML".
-      space_idx = full_name.rindex(' ')
-      name = full_name[space_idx + 1:]
-      symbol.template_name = name
-      symbol.name = name
-    elif (full_name.startswith('*') or
-        symbol.IsOverhead() or
-        symbol.IsOther()):
-      symbol.template_name = full_name
-      symbol.name = full_name
-    elif symbol.IsDex():
-      symbol.full_name, symbol.template_name, symbol.name = (
-          function_signature.ParseJava(full_name))
-    elif symbol.IsNative():
-      # Remove [clone] suffix, and set flag accordingly.
-      # Search from left-to-right, as multiple [clone]s can exist.
-      # Example name suffixes:
-      #     [clone .part.322]  # GCC
-      #     [clone .isra.322]  # GCC
-      #     [clone .constprop.1064]  # GCC
-      #     [clone .11064]  # clang
-      # http://unix.stackexchange.com/questions/223013/function-symbol-gets-part-suffix-after-compilation
-      idx = full_name.find(' [clone ')
-      if idx != -1:
-        full_name = full_name[:idx]
-        symbol.flags |= models.FLAG_CLONE
-
-      # Clones for C symbols.
-      if symbol.section == 't':
-        idx = full_name.rfind('.')
-        if idx != -1 and full_name[idx + 1:].isdigit():
-          new_name = full_name[:idx]
-          # Generated symbols that end with .123 but are not clones.
-          # Find these via:
-          # size_info.symbols.WhereInSection('t').WhereIsGroup().SortedByCount()
-          if new_name not in ('__tcf_0', 'startup'):
-            full_name = new_name
-            symbol.flags |= models.FLAG_CLONE
-            # Remove .part / .isra / .constprop.
-            idx = full_name.rfind('.', 0, idx)
-            if idx != -1:
-              full_name = full_name[:idx]
-
-      # E.g.: vtable for FOO
-      idx = full_name.find(' for ', 0, 30)
-      if idx != -1:
+  Args:
+    symbol: The Symbol to update.
+    found_prefixes: When not None, prefixes like "vtable for" are added to it.
+  """
+  full_name = symbol.full_name
+
+  # See comment in _CalculatePadding() about when this can happen. Don't
+  # process names for non-native sections.
+  if symbol.IsPak():
+    # full_name: "about_ui_resources.grdp: IDR_ABOUT_UI_CREDITS_HTML".
+    space_idx = full_name.rindex(' ')
+    name = full_name[space_idx + 1:]
+    symbol.template_name = name
+    symbol.name = name
+  elif (full_name.startswith('*') or
+      symbol.IsOverhead() or
+      symbol.IsOther()):
+    symbol.template_name = full_name
+    symbol.name = full_name
+  elif symbol.IsDex():
+    symbol.full_name, symbol.template_name, symbol.name = (
+        function_signature.ParseJava(full_name))
+  elif symbol.IsNative():
+    # Remove [clone] suffix, and set flag accordingly.
+    # Search from left-to-right, as multiple [clone]s can exist.
+    # Example name suffixes:
+    #     [clone .part.322]  # GCC
+    #     [clone .isra.322]  # GCC
+    #     [clone .constprop.1064]  # GCC
+    #     [clone .11064]  # clang
+    # http://unix.stackexchange.com/questions/223013/function-symbol-gets-part-suffix-after-compilation
+    idx = full_name.find(' [clone ')
+    if idx != -1:
+      full_name = full_name[:idx]
+      symbol.flags |= models.FLAG_CLONE
+
+    # Clones for C symbols.
+    if symbol.section == 't':
+      idx = full_name.rfind('.')
+      if idx != -1 and full_name[idx + 1:].isdigit():
+        new_name = full_name[:idx]
+        # Generated symbols that end with .123 but are not clones.
+        # Find these via:
+        # size_info.symbols.WhereInSection('t').WhereIsGroup().SortedByCount()
+        if new_name not in ('__tcf_0', 'startup'):
+          full_name = new_name
+          symbol.flags |= models.FLAG_CLONE
+          # Remove .part / .isra / .constprop.
+          idx = full_name.rfind('.', 0, idx)
+          if idx != -1:
+            full_name = full_name[:idx]
+
+    # E.g.: vtable for FOO
+    idx = full_name.find(' for ', 0, 30)
+    if idx != -1:
+      if found_prefixes is not None:
         found_prefixes.add(full_name[:idx + 4])
-        full_name = '{} [{}]'.format(full_name[idx + 5:], full_name[:idx])
+      full_name = '{} [{}]'.format(full_name[idx + 5:], full_name[:idx])
 
-      # E.g.: virtual thunk to FOO
-      idx = full_name.find(' to ', 0, 30)
-      if idx != -1:
+    # E.g.: virtual thunk to FOO
+    idx = full_name.find(' to ', 0, 30)
+    if idx != -1:
+      if found_prefixes is not None:
         found_prefixes.add(full_name[:idx + 3])
-        full_name = '{} [{}]'.format(full_name[idx + 4:], full_name[:idx])
-
-      # Strip out return type, and split out name, template_name.
-      # Function parsing also applies to non-text symbols.
-      # E.g. Function statics.
-      symbol.full_name, symbol.template_name, symbol.name = (
-          function_signature.Parse(full_name))
-
-      # Remove anonymous namespaces (they just harm clustering).
-      symbol.template_name = symbol.template_name.replace(
-          '(anonymous namespace)::', '')
-      symbol.full_name = symbol.full_name.replace(
-          '(anonymous namespace)::', '')
-      non_anonymous_name = symbol.name.replace('(anonymous namespace)::', '')
-      if symbol.name != non_anonymous_name:
-        symbol.flags |= models.FLAG_ANONYMOUS
-        symbol.name = non_anonymous_name
-
-    # Allow using "is" to compare names (and should help with RAM). This applies
-    # to all symbols.
-    function_signature.InternSameNames(symbol)
+      full_name = '{} [{}]'.format(full_name[idx + 4:], full_name[:idx])
+
+    # Strip out return type, and split out name, template_name.
+    # Function parsing also applies to non-text symbols.
+    # E.g. Function statics.
+    symbol.full_name, symbol.template_name, symbol.name = (
+        function_signature.Parse(full_name))
+
+    # Remove anonymous namespaces (they just harm clustering).
+    symbol.template_name = symbol.template_name.replace(
+        '(anonymous namespace)::', '')
+    symbol.full_name = symbol.full_name.replace(
+        '(anonymous namespace)::', '')
+    non_anonymous_name = symbol.name.replace('(anonymous namespace)::', '')
+    if symbol.name != non_anonymous_name:
+      symbol.flags |= models.FLAG_ANONYMOUS
+      symbol.name = non_anonymous_name
+
+  # Allow using "is" to compare names (and should help with RAM). This applies
+  # to all symbols.
+  function_signature.InternSameNames(symbol)
+
 
+def _NormalizeNames(raw_symbols):
+  """Calls _NormalizeName() on each of |raw_symbols|."""
+  found_prefixes = set()
+  for symbol in raw_symbols:
+    _NormalizeName(symbol, found_prefixes)
   logging.debug('Found name prefixes of: %r', found_prefixes)
 
 
@@ -544,6 +553,64 @@ def _CalculatePadding(raw_symbols):
         '%r\nprev symbol: %r' % (symbol, prev_symbol))
 
 
+def _CalculateColumnarPadding(columns):
+  """Same as _CalculatePadding(), but for models.SymbolColumns.
+
+  Avoids creating Symbol objects (except for logging large paddings).
+  """
+  addresses = columns.addresses
+  sizes = columns.sizes
+  paddings = columns.paddings
+  full_names = columns.full_names
+  alias_starts = columns.alias_starts
+  large_paddings = []
+  for section_name, start, end in columns.section_ranges:
+    section = models.SECTION_NAME_TO_SECTION[section_name]
+    is_native = section_name in models.NATIVE_SECTIONS
+    for i in xrange(max(start, 1), end):
+      full_name = full_names[i]
+      if full_name.startswith('Overhead: '):
+        # Overhead symbols are not actionable so should be padding-only.
+        paddings[i] = sizes[i]
+      if i == start or not is_native:
+        continue
+      address = addresses[i]
+      prev_address = addresses[i - 1]
+      if address <= 0 or prev_address <= 0:
+        continue
+
+      prev_size_without_padding = sizes[i - 1] - paddings[i - 1]
+      if address == prev_address:
+        if alias_starts[i] == alias_starts[i - 1]:
+          paddings[i] = paddings[i - 1]
+          sizes[i] = sizes[i - 1]
+          continue
+        # Padding-only symbols happen for ** symbol gaps.
+        assert prev_size_without_padding == 0, (
+            'Found duplicate symbols:\n%r\n%r' % (
+                columns.GetSymbol(i - 1), columns.GetSymbol(i)))
+
+      padding = address - (prev_address + prev_size_without_padding)
+      if (not full_name.startswith('*') and
+          full_name != models.STRING_LITERAL_NAME and (
+          section in 'rd' and padding >= 256 or
+          section in 't' and padding >= 64)):
+        large_paddings.append(i)
+      paddings[i] = padding
+      sizes[i] += padding
+      assert sizes[i] >= 0, (
+          'Symbol has negative size (likely not sorted propertly): '
+          '%r\nprev symbol: %r' % (
+              columns.GetSymbol(i), columns.GetSymbol(i - 1)))
+
+  # Symbols are created only once padding is known, since they are cached.
+  for i in large_paddings:
+    # Should not happen.
+    logging.warning('Large padding of %d between:\n  A) %r\n  B) %r' % (
+                    paddings[i], columns.GetSymbol(i - 1),
+                    columns.GetSymbol(i)))
+
+
 def _ParseComponentFromOwners(filename):
   """Searches an OWNERS file for lines that start with `# COMPONENT:`.
 
@@ -700,10 +767,11 @@ def LoadAndPostProcessSizeInfo(path, file_obj=None):
   """Returns a SizeInfo for the given |path|."""
   logging.debug('Loading results from: %s', path)
   size_info = file_format.LoadSizeInfo(path, file_obj=file_obj)
-  logging.info('Normalizing symbol names')
-  _NormalizeNames(size_info.raw_symbols)
+  columns = size_info.raw_symbols.columns
+  # Symbols are created lazily, so normalize names as they are created.
+  columns.postprocess_func = _NormalizeName
   logging.info('Calculating padding')
-  _CalculatePadding(size_info.raw_symbols)
+  _CalculateColumnarPadding(columns)
   logging.info('Loaded %d symbols', len(size_info.raw_symbols))
   return size_info
 
@@ -832,7 +900,7 @@ def _DeduceObjectPathForSwitchTables(raw_symbols, object_paths_by_name):
 
 
 def _ParseElfInfo(map_path, elf_path, tool_prefix, track_string_literals,
-                  outdir_context=None, linker_name=None):
+                  outdir_context=None, linker_name=None, knobs=None):
   """Adds ELF section sizes and symbols."""
   if elf_path:
     # Run nm on the elf file to retrieve the list of symbol names per-address.
@@ -851,18 +919,20 @@ def _ParseElfInfo(map_path, elf_path, tool_prefix, track_string_literals,
     # Rather than record all paths for each symbol, set the paths to be the
     # common ancestor of all paths.
     if outdir_context:
+      knobs = knobs or SectionSizeKnobs()
       bulk_analyzer = obj_analyzer.BulkObjectFileAnalyzer(
           tool_prefix, outdir_context.output_directory,
-          track_string_literals=track_string_literals)
+          track_string_literals=track_string_literals,
+          cache_path=knobs.object_cache_path,
+          hash_objects=knobs.hash_object_files)
       bulk_analyzer.AnalyzePaths(outdir_context.elf_object_paths)
 
   logging.info('Parsing Linker Map')
-  with _OpenMaybeGz(map_path) as map_file:
-    section_sizes, raw_symbols, linker_map_extras = (
-        linker_map_parser.MapFileParser().Parse(linker_name, map_file))
+  section_sizes, raw_symbols, linker_map_extras = (
+      linker_map_parser.MapFileParser().ParseFile(linker_name, map_path))
 
-    if outdir_context and outdir_context.thin_archives:
-      _ResolveThinArchivePaths(raw_symbols, outdir_context.thin_archives)
+  if outdir_context and outdir_context.thin_archives:
+    _ResolveThinArchivePaths(raw_symbols, outdir_context.thin_archives)
 
   if elf_path:
     logging.debug('Validating section sizes')
@@ -1302,7 +1372,8 @@ def CreateSectionSizesAndSymbols(
        tool_prefix,
        track_string_literals,
        outdir_context=outdir_context,
-       linker_name=linker_name)
+       linker_name=linker_name,
+       knobs=knobs)
   elf_overhead_size = _CalculateElfOverhead(section_sizes, elf_path)
 
   pak_symbols_by_id = None
@@ -1446,8 +1517,8 @@ def _ParseGnArgs(args_path):
 
 
 def _DetectLinkerName(map_path):
-  with _OpenMaybeGz(map_path) as map_file:
-    return linker_map_parser.DetectLinkerNameFromMapFile(map_file)
+  return linker_map_parser.DetectLinkerNameFromMapFile(
+      linker_map_parser.IterMapFileLines(map_path))
 
 
 def _ElfInfoFromApk(apk_path, apk_so_path, tool_prefix):
@@ -1521,6 +1592,22 @@ def AddArguments(parser):
                            'granular symbols.')
   parser.add_argument('--source-directory',
                       help='Custom path to the root source directory.')
+  parser.add_argument('--columnar', action='store_true',
+                      help='Write an uncompressed, memory-mappable .size file '
+                           'that is larger, but much faster to load.')
+  parser.add_argument('--jobs', '-j', type=int,
+                      help='Maximum number of worker processes to run at once '
+                           '(per pool). Defaults to the number of CPUs.')
+  parser.add_argument('--demangle-cache',
+                      help='Path to an sqlite database of demangled names to '
+                           'reuse across runs. Disabled by default.')
+  parser.add_argument('--object-cache',
+                      help='Path to an sqlite database of per-object-file '
+                           'analysis results to reuse across runs. Disabled by '
+                           'default.')
+  parser.add_argument('--hash-object-files', action='store_true',
+                      help='Validate object cache entries by content hash '
+                           'rather than mtime.')
   AddMainPathsArguments(parser)
 
 
@@ -1599,6 +1686,10 @@ def _DeduceMainPaths(args, parser, extracted_minimal_apk_path=None):
 def Run(args, parser):
   if not args.size_file.endswith('.size'):
     parser.error('size_file must end with .size')
+  if args.jobs is not None:
+    if args.jobs < 1:
+      parser.error('--jobs must be at least 1')
+    concurrent.SetMaxJobs(args.jobs)
 
   if args.f is not None:
     if not _AutoIdentifyInputFile(args):
@@ -1627,6 +1718,8 @@ def _RunInternal(args, parser, extracted_minimal_apk_path):
    map_path, linker_name, size_info_prefix) = _DeduceMainPaths(
        args, parser, extracted_minimal_apk_path)
 
+  demangle.SetCachePath(args.demangle_cache)
+
   metadata = CreateMetadata(map_path, elf_path, args.apk_file,
                             args.minimal_apks_file, tool_prefix,
                             output_directory, linker_name)
@@ -1634,6 +1727,8 @@ def _RunInternal(args, parser, extracted_minimal_apk_path):
   knobs = SectionSizeKnobs(is_bundle=bool(extracted_minimal_apk_path))
   if args.source_directory:
     knobs.src_root = args.source_directory
+  knobs.object_cache_path = args.object_cache
+  knobs.hash_object_files = args.hash_object_files
 
   section_sizes, raw_symbols = CreateSectionSizesAndSymbols(
       map_path=map_path, tool_prefix=tool_prefix, elf_path=elf_path,
@@ -1653,6 +1748,6 @@ def _RunInternal(args, parser, extracted_minimal_apk_path):
   logging.info('Recording metadata: \n  %s',
                '\n  '.join(describe.DescribeMetadata(size_info.metadata)))
   logging.info('Saving result to %s', args.size_file)
-  file_format.SaveSizeInfo(size_info, args.size_file)
+  file_format.SaveSizeInfo(size_info, args.size_file, columnar=args.columnar)
   size_in_mb = os.path.getsize(args.size_file) / 1024.0 / 1024.0
   logging.info('Done. File size is %.2fMiB.', size_in_mb)
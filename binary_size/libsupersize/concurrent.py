@@ -13,6 +13,7 @@ import multiprocessing.dummy
 import os
 import sys
 import threading
+import time
 import traceback
 
 
@@ -23,6 +24,10 @@ if DISABLE_ASYNC:
 _all_pools = None
 _is_child_process = False
 _silence_exceptions = False
+# Upper bound on the number of worker processes (None means one per CPU).
+_max_jobs = None
+# How often WorkerPool.Map() checks whether it has been cancelled.
+_CANCEL_POLL_INTERVAL = 0.2
 
 # Used to pass parameters to forked processes without pickling.
 _fork_params = None
@@ -58,6 +63,22 @@ class _ExceptionWrapper(object):
           'Originally caused by: ' + self.msg)
 
 
+def _CallAndWrapExceptions(func, args, kwargs):
+  try:
+    return func(*args, **kwargs)
+  except Exception, e:
+    # Only keep the exception type for builtin exception types or else risk
+    # further marshalling exceptions.
+    exception_type = None
+    if type(e).__name__ in dir(__builtin__):
+      exception_type = type(e).__name__
+    # multiprocessing is supposed to catch and return exceptions automatically
+    # but it doesn't seem to work properly :(.
+    return _ExceptionWrapper(traceback.format_exc(), exception_type)
+  except:  # pylint: disable=bare-except
+    return _ExceptionWrapper(traceback.format_exc())
+
+
 class _FuncWrapper(object):
   """Runs on the fork()'ed side to catch exceptions and spread *args."""
   def __init__(self, func):
@@ -66,19 +87,18 @@ class _FuncWrapper(object):
     self._func = func
 
   def __call__(self, index, _=None):
-    try:
-      return self._func(*_fork_params[index], **_fork_kwargs)
-    except Exception, e:
-      # Only keep the exception type for builtin exception types or else risk
-      # further marshalling exceptions.
-      exception_type = None
-      if type(e).__name__ in dir(__builtin__):
-        exception_type = type(e).__name__
-      # multiprocessing is supposed to catch and return exceptions automatically
-      # but it doesn't seem to work properly :(.
-      return _ExceptionWrapper(traceback.format_exc(), exception_type)
-    except:  # pylint: disable=bare-except
-      return _ExceptionWrapper(traceback.format_exc())
+    return _CallAndWrapExceptions(
+        self._func, _fork_params[index], _fork_kwargs)
+
+
+def _TimedCall(task):
+  """Runs a WorkerPool task. Returns a tuple of (wall time, return value)."""
+  global _is_child_process
+  _is_child_process = True
+  func, args, kwargs = task
+  start_time = time.time()
+  value = _CallAndWrapExceptions(func, args, kwargs)
+  return time.time() - start_time, value
 
 
 class _WrappedResult(object):
@@ -152,22 +172,39 @@ def _CheckForException(value):
 
 
 def _MakeProcessPool(job_params, **job_kwargs):
-  global _all_pools
   global _fork_params
   global _fork_kwargs
   assert _fork_params is None
   assert _fork_kwargs is None
-  pool_size = min(len(job_params), multiprocessing.cpu_count())
+  pool_size = min(len(job_params), MaxJobs())
   _fork_params = job_params
   _fork_kwargs = job_kwargs
   ret = multiprocessing.Pool(pool_size)
   _fork_params = None
   _fork_kwargs = None
+  _RegisterPool(ret)
+  return ret
+
+
+def SetMaxJobs(num_jobs):
+  """Limits the number of worker processes used by each pool.
+
+  Must be called before fork()ing in order to apply to child processes.
+  """
+  global _max_jobs
+  _max_jobs = num_jobs
+
+
+def MaxJobs():
+  return _max_jobs or multiprocessing.cpu_count()
+
+
+def _RegisterPool(pool):
+  global _all_pools
   if _all_pools is None:
     _all_pools = []
     atexit.register(_TerminatePools)
-  _all_pools.append(ret)
-  return ret
+  _all_pools.append(pool)
 
 
 def ForkAndCall(func, args, decode_func=None):
@@ -213,6 +250,111 @@ def BulkForkAndCall(func, arg_tuples, **kwargs):
   _all_pools.remove(pool)
 
 
+class CancelledError(Exception):
+  """Raised by WorkerPool.Map() when the pool is cancelled."""
+
+
+class WorkerPool(object):
+  """A size-bounded pool of worker processes that is reused across calls.
+
+  BulkForkAndCall() fork()s a new pool for every call, which lets arguments be
+  inherited rather than pickled. WorkerPool instead fork()s its workers once
+  (on first use) and sends them work over pipes, so |func| must be a
+  module-level function and arguments must be picklable. Return values should
+  be small, or encoded with EncodeDictOfLists().
+
+  Attributes:
+    num_tasks: Number of tasks that have completed.
+    task_seconds: Sum of the wall time spent running each task.
+  """
+
+  def __init__(self, size=None, name='WorkerPool'):
+    self._size = size or MaxJobs()
+    self._name = name
+    self._pool = None
+    self._cancelled = False
+    self._start_time = None
+    self.num_tasks = 0
+    self.task_seconds = 0.0
+
+  def _GetPool(self):
+    if self._pool is None:
+      self._start_time = time.time()
+      self._pool = multiprocessing.Pool(self._size)
+      _RegisterPool(self._pool)
+    return self._pool
+
+  def _CheckCancelled(self):
+    if self._cancelled:
+      raise CancelledError('%s was cancelled.' % self._name)
+
+  def _AddTaskResult(self, elapsed, value):
+    _CheckForException(value)
+    self.num_tasks += 1
+    self.task_seconds += elapsed
+    return value
+
+  def Map(self, func, arg_tuples, **kwargs):
+    """Calls |func| in a worker process for each set of args in |arg_tuples|.
+
+    Args:
+      kwargs: Common key word arguments to be passed to |func|.
+
+    Yields the return values as they come in (in arbitrary order).
+    """
+    self._CheckCancelled()
+    tasks = [(func, args, kwargs) for args in arg_tuples]
+    if not tasks:
+      return
+
+    if DISABLE_ASYNC:
+      if self._start_time is None:
+        self._start_time = time.time()
+      for task in tasks:
+        self._CheckCancelled()
+        yield self._AddTaskResult(*_TimedCall(task))
+      return
+
+    result_iter = self._GetPool().imap_unordered(_TimedCall, tasks)
+    for _ in xrange(len(tasks)):
+      while True:
+        self._CheckCancelled()
+        try:
+          elapsed, value = result_iter.next(_CANCEL_POLL_INTERVAL)
+          break
+        except multiprocessing.TimeoutError:
+          pass
+      yield self._AddTaskResult(elapsed, value)
+
+  def Cancel(self):
+    """Terminates workers. In-progress and future Map() calls will raise.
+
+    Safe to call from any thread.
+    """
+    self._cancelled = True
+    pool = self._pool
+    if pool:
+      self._pool = None
+      # terminate() can block, so do not wait for it.
+      thread = threading.Thread(name=self._name + '-Terminate',
+                                target=pool.terminate)
+      thread.daemon = True
+      thread.start()
+      _all_pools.remove(pool)
+
+  def Close(self):
+    """Waits for workers to exit and logs the time spent on tasks."""
+    if self._pool:
+      self._pool.close()
+      self._pool.join()
+      _all_pools.remove(self._pool)
+      self._pool = None
+    if self.num_tasks:
+      logging.debug('%s: Ran %d tasks (%.1fs of task time in %.1fs using %d '
+                    'workers)', self._name, self.num_tasks, self.task_seconds,
+                    time.time() - self._start_time, self._size)
+
+
 def CallOnThread(func, *args, **kwargs):
   """Calls |func| on a new thread and returns a promise for its return value."""
   if DISABLE_ASYNC:
@@ -5,6 +5,7 @@
 
 import os
 import threading
+import time
 import unittest
 
 import concurrent
@@ -16,6 +17,15 @@ def _ForkTestHelper(arg1, arg2, pickle_me_not, test_instance, parent_pid):
   return arg1 + arg2
 
 
+def _PoolTestHelper(arg1, arg2, parent_pid):
+  assert os.getpid() != parent_pid
+  return arg1 + arg2, os.getpid()
+
+
+def _SleepTestHelper(seconds):
+  time.sleep(seconds)
+
+
 class Unpicklable(object):
   """Ensures that pickle() is not called on parameters."""
   def __getstate__(self):
@@ -144,5 +154,33 @@ class ConcurrentTest(unittest.TestCase):
         (1, 'a', self, parent_pid)])
     self.assertRaises(TypeError, results.next)
 
+  def testWorkerPool_reused(self):
+    parent_pid = os.getpid()
+    pool = concurrent.WorkerPool(size=2)
+    try:
+      results1 = list(pool.Map(
+          _PoolTestHelper, [(1, 2), (3, 4)], parent_pid=parent_pid))
+      results2 = list(pool.Map(
+          _PoolTestHelper, [(5, 6)] * 10, parent_pid=parent_pid))
+    finally:
+      pool.Close()
+    self.assertEquals({3, 7}, set(r[0] for r in results1))
+    self.assertEquals([11] * 10, [r[0] for r in results2])
+    # Workers are not re-fork()ed between calls.
+    pids = set(r[1] for r in results1 + results2)
+    self.assertLessEqual(len(pids), 2)
+    self.assertEquals(12, pool.num_tasks)
+
+  def testWorkerPool_cancel(self):
+    pool = concurrent.WorkerPool(size=1)
+    results = pool.Map(_SleepTestHelper, [(10,)] * 2)
+    threading.Timer(0.1, pool.Cancel).start()
+    start_time = time.time()
+    self.assertRaises(concurrent.CancelledError, results.next)
+    self.assertLess(time.time() - start_time, 5)
+    self.assertRaises(concurrent.CancelledError,
+                      lambda: list(pool.Map(_SleepTestHelper, [(0,)])))
+    pool.Close()
+
 if __name__ == '__main__':
   unittest.main()
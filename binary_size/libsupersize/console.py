@@ -86,6 +86,9 @@ class _Session(object):
     self._tool_prefix_finder = tool_prefix_finder
     self._size_infos = size_infos
     self._disassemble_prefix_len = None
+    # Queries are often repeated when exploring interactively.
+    for size_info in size_infos:
+      size_info.EnableMemoization()
 
     if len(size_infos) == 1:
       self._variables['size_info'] = size_infos[0]
@@ -283,7 +286,10 @@ class _Session(object):
 
   def _SizeInfoForSymbol(self, symbol):
     for size_info in self._size_infos:
-      if symbol in size_info.raw_symbols:
+      # Use the address index rather than scanning all symbols.
+      found = size_info.raw_symbols.IterSymbolsInRange(
+          symbol.address, section_name=symbol.section_name)
+      if any(s is symbol for s in found):
         return size_info
     assert False, 'Symbol does not belong to a size_info.'
 
@@ -368,6 +374,11 @@ class _Session(object):
         'print_syms = size_info.symbols.WhereMatches(r"{{_print_}}")',
         'Print(print_syms - print_syms.WherePathMatches(r"^components/"))',
         '',
+        '# Apply several filters in a single pass over all symbols:',
+        'q = size_info.symbols.Query(',
+        '    {"v8": r"^v8/", "big": lambda s: s.size > 4096})',
+        'Print(q["v8"].GroupedByPath(depth=2).Sorted())',
+        '',
         '# Diff two .size files and save result to a file:',
         'Print(Diff(size_info1, size_info2), to_file="output.txt")',
         '',
@@ -2,14 +2,22 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-"""Utilities for demangling C++ symbols."""
+"""Utilities for demangling C++ symbols.
+
+Demangled names can be stored in an on-disk cache (see SetCachePath()) so that
+only names not seen by previous runs are passed to c++filt.
+"""
 
 import collections
 import itertools
 import logging
+import os
 import re
+import sqlite3
 import subprocess
+import threading
 
+import concurrent
 import path_util
 
 _LOWER_HEX_PATTERN = re.compile(r'^[0-9a-f]*$')
@@ -17,6 +25,30 @@ _PROMOTED_GLOBAL_NAME_DEMANGLED_PATTERN = re.compile(
     r' \((\.\d+)?\.llvm\.\d+\)$')
 _PROMOTED_GLOBAL_NAME_RAW_PATTERN = re.compile(r'(\.\d+)?\.llvm\.\d+$')
 
+# Do not start another c++filt process for fewer names than this.
+_MIN_NAMES_PER_SHARD = 20000
+# SQLite limits the number of parameters per statement (to 999 by default).
+_CACHE_LOOKUP_CHUNK_SIZE = 900
+# Seconds to wait for other processes (e.g. nm workers) holding the cache lock.
+_CACHE_TIMEOUT = 60
+# The cache is cleared once more rows than this were added to it. Chrome has
+# about a million demangled names.
+_CACHE_MAX_ROWS = 5000000
+
+# Path to the sqlite database of demangled names, or None if disabled.
+_cache_path = None
+
+
+def SetCachePath(path):
+  """Sets the path of the on-disk demangle cache (None disables the cache).
+
+  Must be called before fork()ing worker processes in order for them to use the
+  cache as well.
+  """
+  global _cache_path
+  _cache_path = path
+
+
 def StripLlvmPromotedGlobalNames(name):
   """Strips LLVM promoted global names suffix, and returns the result.
 
@@ -66,16 +98,151 @@ def _PostProcessDemangledSymbol(old_name, new_name):
   return new_name
 
 
-def _DemangleNames(names, tool_prefix):
-  """Uses c++filt to demangle a list of names."""
+class _DemangleCache(object):
+  """Maps mangled names -> demangled names for a given c++filt.
+
+  Entries are keyed by the c++filt path and its mtime, so that toolchain rolls
+  do not return stale results. Entries of other c++filts are removed when the
+  cache is opened, and the cache is cleared when it grows too large.
+  """
+
+  def __init__(self, path, tool_prefix):
+    cppfilt_path = os.path.realpath(path_util.GetCppFiltPath(tool_prefix))
+    try:
+      mtime = int(os.path.getmtime(cppfilt_path))
+    except OSError:
+      mtime = 0
+    self._tool_key = '%s@%d' % (cppfilt_path, mtime)
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    self._conn = sqlite3.connect(path, timeout=_CACHE_TIMEOUT)
+    self._conn.text_factory = str
+    with self._conn:
+      self._conn.execute(
+          'CREATE TABLE IF NOT EXISTS demangled ('
+          'tool TEXT NOT NULL, mangled TEXT NOT NULL, demangled TEXT NOT NULL, '
+          'PRIMARY KEY (tool, mangled))')
+    self._Prune()
+
+  def _Prune(self):
+    key = self._tool_key
+    with self._conn:
+      # Uses the primary key index, so is cheap when there is nothing to prune.
+      has_other_tools = self._conn.execute(
+          'SELECT 1 FROM demangled WHERE tool < ? OR tool > ? LIMIT 1',
+          (key, key)).fetchone()
+      if has_other_tools:
+        logging.info('Removing entries of other c++filts from demangle cache')
+        self._conn.execute('DELETE FROM demangled WHERE tool != ?', (key,))
+      # Rowids grow with each insert (until the table is emptied), so the
+      # largest one bounds the number of rows without scanning them all.
+      max_rowid = self._conn.execute(
+          'SELECT MAX(rowid) FROM demangled').fetchone()[0]
+      too_large = (max_rowid or 0) > _CACHE_MAX_ROWS
+      if too_large:
+        logging.info('Clearing demangle cache (%d rows)', max_rowid)
+        self._conn.execute('DELETE FROM demangled')
+    if has_other_tools or too_large:
+      # Gives the disk space back.
+      self._conn.execute('VACUUM')
+
+  def Lookup(self, names):
+    """Returns a dict of name -> demangled name for names that are cached."""
+    ret = {}
+    try:
+      for i in xrange(0, len(names), _CACHE_LOOKUP_CHUNK_SIZE):
+        chunk = names[i:i + _CACHE_LOOKUP_CHUNK_SIZE]
+        query = ('SELECT mangled, demangled FROM demangled WHERE tool = ? AND '
+                 'mangled IN (%s)' % ','.join('?' * len(chunk)))
+        ret.update(self._conn.execute(query, [self._tool_key] + chunk))
+    except sqlite3.Error as e:
+      logging.warning('Failed to read demangle cache: %s', e)
+    return ret
+
+  def Store(self, name_pairs):
+    try:
+      with self._conn:
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO demangled VALUES (?, ?, ?)',
+            ((self._tool_key, n, d) for n, d in name_pairs))
+    except sqlite3.Error as e:
+      logging.warning('Failed to write demangle cache: %s', e)
+
+  def Close(self):
+    self._conn.close()
+
+
+def _OpenCache(tool_prefix):
+  if not _cache_path:
+    return None
+  try:
+    return _DemangleCache(_cache_path, tool_prefix)
+  except (OSError, sqlite3.Error) as e:
+    logging.warning('Not using demangle cache %s: %s', _cache_path, e)
+    return None
+
+
+def _RunCppFilt(names, tool_prefix):
+  """Uses a single c++filt process to demangle a list of names."""
   proc = subprocess.Popen([path_util.GetCppFiltPath(tool_prefix)],
                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
   stdout = proc.communicate('\n'.join(_ExtractDemanglablePart(names)))[0]
   assert proc.returncode == 0
-  ret = [
+  return [
       _PostProcessDemangledSymbol(old_name, new_name)
       for (old_name, new_name) in itertools.izip(names, stdout.splitlines())
   ]
+
+
+def _RunCppFiltSharded(names, tool_prefix):
+  """Demangles |names|, using several c++filt processes when there are many."""
+  num_shards = 1
+  if not concurrent.DISABLE_ASYNC:
+    num_shards = min(concurrent.MaxJobs(),
+                     len(names) // _MIN_NAMES_PER_SHARD)
+  if num_shards <= 1:
+    return _RunCppFilt(names, tool_prefix)
+
+  logging.debug('Running %d c++filt processes', num_shards)
+  shard_size = (len(names) + num_shards - 1) // num_shards
+  shards = [names[i:i + shard_size] for i in xrange(0, len(names), shard_size)]
+  results = [None] * len(shards)
+
+  def run_shard(i):
+    results[i] = _RunCppFilt(shards[i], tool_prefix)
+
+  # Threads suffice since the work happens in the c++filt processes.
+  threads = [threading.Thread(target=run_shard, args=(i,))
+             for i in xrange(len(shards))]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert all(r is not None for r in results), 'c++filt failed.'
+  return list(itertools.chain.from_iterable(results))
+
+
+def _DemangleNames(names, tool_prefix):
+  """Demangles a list of names, using the cache when enabled."""
+  cache = _OpenCache(tool_prefix)
+  if cache:
+    try:
+      unique_names = list(set(names))
+      demangled_by_name = cache.Lookup(unique_names)
+      misses = [n for n in unique_names if n not in demangled_by_name]
+      logging.info('* Demangle cache hits: %d/%d',
+                   len(unique_names) - len(misses), len(unique_names))
+      if misses:
+        new_pairs = zip(misses, _RunCppFiltSharded(misses, tool_prefix))
+        cache.Store(new_pairs)
+        demangled_by_name.update(new_pairs)
+      ret = [demangled_by_name[n] for n in names]
+    finally:
+      cache.Close()
+  else:
+    ret = _RunCppFiltSharded(names, tool_prefix)
+
   if logging.getLogger().isEnabledFor(logging.INFO):
     fail_count = sum(1 for s in ret if _CanDemangle(s))
     if fail_count:
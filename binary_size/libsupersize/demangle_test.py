@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import demangle
+
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_TEST_TOOL_PREFIX = os.path.join(
+    _SCRIPT_DIR, 'testdata', 'mock_toolchain', '')
+
+_MANGLED = '_ZN5blink23ContiguousContainerBase11shrinkToFitEv'
+_DEMANGLED = 'blink::ContiguousContainerBase::shrinkToFit()'
+
+
+class DemangleTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._orig_run_cpp_filt = demangle._RunCppFilt
+    self._cpp_filt_inputs = []
+
+    def run_cpp_filt(names, tool_prefix):
+      self._cpp_filt_inputs.append(sorted(names))
+      return self._orig_run_cpp_filt(names, tool_prefix)
+
+    demangle._RunCppFilt = run_cpp_filt
+
+  def tearDown(self):
+    demangle._RunCppFilt = self._orig_run_cpp_filt
+    demangle.SetCachePath(None)
+    shutil.rmtree(self._tmp_dir)
+
+  def testDemangleSetsInDicts_NoCache(self):
+    key_to_names = {1: set([_MANGLED, 'foo']), 2: set([_MANGLED])}
+    result = demangle.DemangleSetsInDicts(key_to_names, _TEST_TOOL_PREFIX)
+    self.assertEquals({1: set([_DEMANGLED, 'foo']), 2: set([_DEMANGLED])},
+                      result)
+    self.assertEquals([[_MANGLED, _MANGLED]], self._cpp_filt_inputs)
+
+  def testDemangleKeysAndMergeLists_Cache(self):
+    demangle.SetCachePath(os.path.join(self._tmp_dir, 'cache.db'))
+    name_to_list = {_MANGLED: ['a'], _MANGLED + '$' + 'f' * 32: ['b']}
+    expected = {_DEMANGLED: ['a', 'b']}
+
+    result = demangle.DemangleKeysAndMergeLists(name_to_list, _TEST_TOOL_PREFIX)
+    self.assertEquals(expected, {k: sorted(v) for k, v in result.iteritems()})
+    self.assertEquals(1, len(self._cpp_filt_inputs))
+
+    # A second run should be served entirely from the cache.
+    result = demangle.DemangleKeysAndMergeLists(name_to_list, _TEST_TOOL_PREFIX)
+    self.assertEquals(expected, {k: sorted(v) for k, v in result.iteritems()})
+    self.assertEquals(1, len(self._cpp_filt_inputs))
+
+    # Only new names should be passed to c++filt.
+    name_to_list['_ZL18extFromUUseMappingaji'] = ['c']
+    demangle.DemangleKeysAndMergeLists(name_to_list, _TEST_TOOL_PREFIX)
+    self.assertEquals(['_ZL18extFromUUseMappingaji'], self._cpp_filt_inputs[-1])
+
+  def testDemangleCache_Pruning(self):
+    cache_path = os.path.join(self._tmp_dir, 'cache.db')
+    demangle.SetCachePath(cache_path)
+
+    def cached_rows():
+      conn = sqlite3.connect(cache_path)
+      try:
+        return conn.execute(
+            'SELECT tool, mangled FROM demangled ORDER BY mangled').fetchall()
+      finally:
+        conn.close()
+
+    demangle._DemangleNames([_MANGLED], _TEST_TOOL_PREFIX)
+    (tool_key, _), = cached_rows()
+
+    # Entries of other c++filts are removed.
+    conn = sqlite3.connect(cache_path)
+    with conn:
+      conn.execute('INSERT INTO demangled VALUES (?, ?, ?)',
+                   ('other@1', _MANGLED, 'stale'))
+    conn.close()
+    demangle._DemangleNames([_MANGLED], _TEST_TOOL_PREFIX)
+    self.assertEquals([(tool_key, _MANGLED)], cached_rows())
+    self.assertEquals(1, len(self._cpp_filt_inputs))
+
+    # The cache is cleared once it grows too large.
+    orig_max_rows = demangle._CACHE_MAX_ROWS
+    demangle._CACHE_MAX_ROWS = 1
+    try:
+      demangle._DemangleNames(['_ZL18extFromUUseMappingaji'], _TEST_TOOL_PREFIX)
+      self.assertEquals(2, len(cached_rows()))
+      demangle._DemangleNames(['_ZL18extFromUUseMappingaji'], _TEST_TOOL_PREFIX)
+      self.assertEquals([(tool_key, '_ZL18extFromUUseMappingaji')],
+                        cached_rows())
+      self.assertEquals(3, len(self._cpp_filt_inputs))
+    finally:
+      demangle._CACHE_MAX_ROWS = orig_max_rows
+
+  def testDemangle_Sharded(self):
+    orig_min_names_per_shard = demangle._MIN_NAMES_PER_SHARD
+    demangle._MIN_NAMES_PER_SHARD = 1
+    try:
+      names = [_MANGLED, '_ZL18extFromUUseMapping2aji',
+               '_ZL18extFromUUseMappingaji'] * 3
+      result = demangle._DemangleNames(names, _TEST_TOOL_PREFIX)
+    finally:
+      demangle._MIN_NAMES_PER_SHARD = orig_min_names_per_shard
+    self.assertEquals(
+        [_DEMANGLED, 'extFromUUseMapping(aj, int)',
+         'extFromUUseMapping(signed char, unsigned int, int)'] * 3, result)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,6 +4,7 @@
 """Logic for diffing two SizeInfo objects."""
 
 import collections
+import itertools
 import logging
 import re
 
@@ -60,33 +61,98 @@ def _PoorMatchKey(symbol):
   return section, name
 
 
-def _MatchSymbols(before, after, key_func, padding_by_section_name):
-  logging.debug('%s: Building symbol index', key_func.__name__)
-  before_symbols_by_key = collections.defaultdict(list)
-  for s in before:
-    before_symbols_by_key[key_func(s)].append(s)
+_KEY_FUNCS = (_ExactMatchKey, _GoodMatchKey, _PoorMatchKey)
 
-  logging.debug('%s: Creating delta symbols', key_func.__name__)
-  unmatched_after = []
+
+def _AddToIndex(indices_by_key, key, idx):
+  prev = indices_by_key.setdefault(key, idx)
+  if prev != idx:
+    if prev.__class__ is int:
+      indices_by_key[key] = collections.deque((prev, idx))
+    else:
+      prev.append(idx)
+
+
+def _PopUnmatched(indices, is_matched):
+  """Removes and returns the first unmatched index from |indices| (or None).
+
+  Indices matched by earlier key funcs are skipped (and removed) lazily.
+  """
+  while indices:
+    idx = indices.popleft()
+    if not is_matched[idx]:
+      return idx
+  return None
+
+
+def _MatchSymbols(before, after, padding_by_section_name):
+  """Matches up |before| and |after| symbols using each of _KEY_FUNCS in turn.
+
+  Symbols that share a key are matched up in order of appearance. Runs in
+  linear time: keys are computed at most once per symbol and key func, and
+  each index entry is visited at most once.
+
+  Returns:
+    A tuple of (delta_symbols, unmatched_before, unmatched_after).
+  """
+  before = list(before)
+  is_matched = bytearray(len(before))
   delta_symbols = []
-  for after_sym in after:
-    before_sym = before_symbols_by_key.get(key_func(after_sym))
-    if before_sym:
-      before_sym = before_sym.pop(0)
+  unmatched_after = after
+  for key_func in _KEY_FUNCS:
+    if key_func is _ExactMatchKey:
+      logging.debug('Building symbol indices')
+      # Key -> index into |before|, or a deque of them when there are multiple
+      # (most keys are unique, and deques are large).
+      indices_by_key = {}
+      for i, before_sym in enumerate(before):
+        key = _ExactMatchKey(before_sym)
+        # Inlined fast path of _AddToIndex(), since this loop is hot.
+        if indices_by_key.setdefault(key, i) != i:
+          _AddToIndex(indices_by_key, key, i)
+    elif key_func is _GoodMatchKey:
+      # Usually >90% of symbols are exact matches, so index only the remaining
+      # ones. The poor index is built alongside since its keys are derived from
+      # the good ones.
+      indices_by_key = {}
+      poor_indices_by_key = {}
+      for i, before_sym in enumerate(before):
+        if not is_matched[i]:
+          good_key = _GoodMatchKey(before_sym)
+          _AddToIndex(indices_by_key, good_key, i)
+          _AddToIndex(poor_indices_by_key, (good_key[0], good_key[2]), i)
+    else:
+      indices_by_key = poor_indices_by_key
+
+    logging.debug('%s: Creating delta symbols', key_func.__name__)
+    num_to_match = len(unmatched_after)
+    remaining_after = []
+    for after_sym in unmatched_after:
+      key = key_func(after_sym)
+      # Inlined fast path of _PopUnmatched() for unique keys.
+      before_idx = indices_by_key.pop(key, None)
+      if before_idx.__class__ is int:
+        if is_matched[before_idx]:
+          before_idx = None
+      elif before_idx is not None:
+        indices_by_key[key] = before_idx
+        before_idx = _PopUnmatched(before_idx, is_matched)
+      if before_idx is None:
+        remaining_after.append(after_sym)
+        continue
+      is_matched[before_idx] = 1
+      before_sym = before[before_idx]
       # Padding tracked in aggregate, except for padding-only symbols.
       if before_sym.size_without_padding != 0:
         padding_by_section_name[before_sym.section_name] += (
             after_sym.padding_pss - before_sym.padding_pss)
       delta_symbols.append(models.DeltaSymbol(before_sym, after_sym))
-    else:
-      unmatched_after.append(after_sym)
-
-  logging.debug('%s: Matched %d of %d symbols', key_func.__name__,
-                len(delta_symbols), len(after))
+    logging.debug('%s: Matched %d of %d symbols', key_func.__name__,
+                  num_to_match - len(remaining_after), num_to_match)
+    unmatched_after = remaining_after
 
-  unmatched_before = []
-  for syms in before_symbols_by_key.itervalues():
-    unmatched_before.extend(syms)
+  unmatched_before = [
+      s for s, m in itertools.izip(before, is_matched) if not m]
   return delta_symbols, unmatched_before, unmatched_after
 
 
@@ -95,14 +161,10 @@ def _DiffSymbolGroups(before, after):
   # information entirely, store it in aggregate.
   padding_by_section_name = collections.defaultdict(int)
 
-  # Usually >90% of symbols are exact matches, so all of the time is spent in
-  # this first pass.
+  # Usually >90% of symbols are exact matches, so most of the time is spent in
+  # the first key func.
   all_deltas, before, after = _MatchSymbols(
-      before, after, _ExactMatchKey, padding_by_section_name)
-  for key_func in (_GoodMatchKey, _PoorMatchKey):
-    delta_syms, before, after = _MatchSymbols(
-        before, after, key_func, padding_by_section_name)
-    all_deltas.extend(delta_syms)
+      before, after, padding_by_section_name)
 
   logging.debug('Creating %d unmatched symbols', len(after) + len(before))
   for after_sym in after:
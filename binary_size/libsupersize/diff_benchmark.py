@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Times diff.Diff() on two large, synthetic SizeInfos.
+
+The SizeInfos contain many symbols that share match keys (string literals,
+"** merge strings", anonymous symbols), which is the worst case for matching.
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import diff
+import models
+
+
+def _CreateSymbols(num_symbols, rand):
+  raw_symbols = []
+  address = 0x1000
+  for i in xrange(num_symbols):
+    kind = i % 10
+    object_path = 'obj/dir%d/file%d.o' % (rand.randint(0, 50),
+                                          rand.randint(0, 200))
+    if kind < 5:
+      section_name = models.SECTION_TEXT
+      full_name = 'ns::Function%d()' % i
+    elif kind < 7:
+      section_name = models.SECTION_RODATA
+      full_name = models.STRING_LITERAL_NAME
+      object_path = 'obj/strings%d.o' % rand.randint(0, 10)
+    elif kind < 8:
+      section_name = models.SECTION_RODATA
+      full_name = '** merge strings'
+      object_path = ''
+    elif kind < 9:
+      section_name = models.SECTION_DATA
+      full_name = ''
+    else:
+      section_name = models.SECTION_TEXT
+      full_name = '.L__unnamed_%d' % i
+    size = rand.randint(1, 64)
+    raw_symbols.append(models.Symbol(
+        section_name, size, address=address, full_name=full_name,
+        template_name=full_name, name=full_name, object_path=object_path))
+    address += size
+  return raw_symbols
+
+
+def _CreateChangedSymbols(before_symbols, rand):
+  """Returns a copy of |before_symbols| with some symbols changed."""
+  ret = []
+  for sym in before_symbols:
+    change = rand.random()
+    if change < 0.01:
+      continue  # Removed.
+    size = sym.size
+    full_name = sym.full_name
+    if change < 0.05:
+      size += rand.randint(1, 16)
+    elif change < 0.07 and full_name.startswith('.L'):
+      # Renumbered.
+      full_name = '.L__unnamed_%d' % rand.randint(0, len(before_symbols))
+    ret.append(models.Symbol(
+        sym.section_name, size, address=sym.address, full_name=full_name,
+        template_name=full_name, name=full_name, object_path=sym.object_path))
+  return ret
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--num-symbols', type=int, default=1000000,
+                      help='Number of symbols in each SizeInfo.')
+  parser.add_argument('-v', '--verbose', action='store_true')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                      format='%(levelname).1s %(relativeCreated)6d %(message)s')
+
+  logging.info('Creating SizeInfos with %d symbols', args.num_symbols)
+  rand = random.Random(1)
+  before_symbols = _CreateSymbols(args.num_symbols, rand)
+  after_symbols = _CreateChangedSymbols(before_symbols, rand)
+  before = models.SizeInfo({}, before_symbols)
+  after = models.SizeInfo({}, after_symbols)
+
+  start_time = time.time()
+  delta_size_info = diff.Diff(before, after)
+  elapsed = time.time() - start_time
+  counts = delta_size_info.raw_symbols.CountsByDiffStatus()
+  logging.info('Diff took %.2fs (%d changed, %d added, %d removed)', elapsed,
+               counts[models.DIFF_STATUS_CHANGED],
+               counts[models.DIFF_STATUS_ADDED],
+               counts[models.DIFF_STATUS_REMOVED])
+
+
+if __name__ == '__main__':
+  main()
@@ -67,22 +67,69 @@ a single symbol. Values are tab seperated and follow this format:
 symbol.full_name, symbol.num_aliases, symbol.flags
 |num_aliases| will be omitted if the aliases of the symbol are the same as the
 previous line. |flags| will be omitted if there are no flags.
+
+Columnar format
+---------------
+An alternate, uncompressed format that can be memory-mapped and decoded in bulk
+using the array module. It is not gzipped, which is how LoadSizeInfo() tells
+the two formats apart.
+
+The header is the same as the text format, except that the version line is
+_COLUMNAR_SERIALIZATION_VERSION and the JSON also contains:
+  * section_names / section_counts: Same as the "Symbol counts" section.
+  * string_table_counts: Number of entries in the "paths" and "components"
+        string tables (an empty table cannot be told apart from a table
+        holding one empty string otherwise).
+  * blocks: A list of [name, item_size, item_count] for each block that
+        follows the header.
+
+Each block starts at an 8-byte aligned offset (relative to the start of the
+file) and holds |item_count| little-endian signed integers of |item_size|
+bytes. Blocks with an |item_size| of 1 are string tables, where entries are
+separated by a null byte. Blocks (in order):
+  * paths: String table of "object_path\tsource_path".
+  * components: String table of components.
+  * names: String table of symbol full_names.
+  * addresses, sizes, flags, num_aliases, path_indices, component_indices:
+        One entry per symbol, in the order of the symbols in each group. Values
+        are not delta-encoded. |num_aliases| uses the same convention as the
+        text format (0 when the symbol shares aliases with the previous one).
+  * name_offsets: Offset into |names| where each symbol's full_name ends.
 """
 
+import array
+import collections
 import cStringIO
 import contextlib
 import gzip
 import itertools
 import json
 import logging
+import mmap
 import os
 import shutil
+import sys
 
 import models
 
 
 # File format version for .size files.
 _SERIALIZATION_VERSION = 'Size File Format v1'
+_COLUMNAR_SERIALIZATION_VERSION = 'Size File Format v2 (columnar)'
+
+_GZIP_MAGIC = '\x1f\x8b'
+_COLUMNAR_ALIGNMENT = 8
+
+# (block name, item size) for the per-symbol numeric blocks of the columnar
+# format.
+_COLUMNAR_SYMBOL_BLOCKS = (
+    ('addresses', 8),
+    ('sizes', 4),
+    ('flags', 2),
+    ('num_aliases', 4),
+    ('path_indices', 4),
+    ('component_indices', 4),
+)
 
 
 def _LogSize(file_obj, desc):
@@ -116,15 +163,14 @@ def _SaveSizeInfoToFile(size_info, file_obj):
   _LogSize(file_obj, 'header')  # For libchrome: 570 bytes.
 
   # Store a single copy of all paths and have them referenced by index.
-  unique_path_tuples = sorted(set(
-      (s.object_path, s.source_path) for s in size_info.raw_symbols))
+  unique_path_tuples, unique_components = _PathsFromSymbols(
+      size_info.raw_symbols)
   path_tuples = {tup: i for i, tup in enumerate(unique_path_tuples)}
   file_obj.write('%d\n' % len(unique_path_tuples))
   file_obj.writelines('%s\t%s\n' % pair for pair in unique_path_tuples)
   _LogSize(file_obj, 'paths')  # For libchrome, adds 200kb.
 
   # Store a single copy of all components and have them referenced by index.
-  unique_components = sorted(set(s.component for s in size_info.raw_symbols))
   components = {comp: i for i, comp in enumerate(unique_components)}
   file_obj.write('%d\n' % len(unique_components))
   file_obj.writelines('%s\n' % comp for comp in unique_components)
@@ -274,70 +320,250 @@ def _LoadSizeInfoFromFile(file_obj, size_path):
   else:
     component_indices = [None] * len(section_names)
 
-  raw_symbols = [None] * sum(section_counts)
-  symbol_idx = 0
-  for (cur_section_name, cur_section_count, cur_addresses, cur_sizes,
-       cur_path_indicies, cur_component_indices) in itertools.izip(
-       section_names, section_counts, addresses, sizes, path_indices,
-       component_indices):
-    alias_counter = 0
-    for i in xrange(cur_section_count):
-      parts = _ReadValuesFromLine(lines, split='\t')
-      full_name = parts[0]
-      flags_part = None
-      aliases_part = None
-
-      # aliases_part or flags_part may have been omitted.
-      if len(parts) == 3:
-        # full_name  aliases_part  flags_part
+  if not has_components:
+    components = ['']
+    component_indices = [[0] * c for c in section_counts]
+
+  full_names = [None] * sum(section_counts)
+  flags = _MakeColumn(2, itertools.repeat(0, len(full_names)))
+  num_aliases = _MakeColumn(4, itertools.repeat(0, len(full_names)))
+  for symbol_idx in xrange(len(full_names)):
+    parts = _ReadValuesFromLine(lines, split='\t')
+    full_names[symbol_idx] = parts[0]
+    flags_part = None
+    aliases_part = None
+
+    # aliases_part or flags_part may have been omitted.
+    if len(parts) == 3:
+      # full_name  aliases_part  flags_part
+      aliases_part = parts[1]
+      flags_part = parts[2]
+    elif len(parts) == 2:
+      if parts[1][0] == '0':
+        # full_name  aliases_part
         aliases_part = parts[1]
-        flags_part = parts[2]
-      elif len(parts) == 2:
-        if parts[1][0] == '0':
-          # full_name  aliases_part
-          aliases_part = parts[1]
-        else:
-          # full_name  flags_part
-          flags_part = parts[1]
-
-      # Use a bit less RAM by using the same instance for this common string.
-      if full_name == models.STRING_LITERAL_NAME:
-        full_name = models.STRING_LITERAL_NAME
-      flags = int(flags_part, 16) if flags_part else 0
-      num_aliases = int(aliases_part, 16) if aliases_part else 0
-
-      # Skip the constructor to avoid default value checks
-      new_sym = models.Symbol.__new__(models.Symbol)
-      new_sym.section_name = cur_section_name
-      new_sym.full_name = full_name
-      new_sym.address = cur_addresses[i]
-      new_sym.size = cur_sizes[i]
-      paths = path_tuples[cur_path_indicies[i]]
-      new_sym.object_path, new_sym.source_path = paths
-      component = components[cur_component_indices[i]] if has_components else ''
-      new_sym.component = component
-      new_sym.flags = flags
-      # Derived
-      new_sym.padding = 0
-      new_sym.template_name = ''
-      new_sym.name = ''
-
-      if num_aliases:
-        assert alias_counter == 0
-        new_sym.aliases = [new_sym]
-        alias_counter = num_aliases - 1
-      elif alias_counter > 0:
-        new_sym.aliases = raw_symbols[symbol_idx - 1].aliases
-        new_sym.aliases.append(new_sym)
-        alias_counter -= 1
       else:
-        new_sym.aliases = None
+        # full_name  flags_part
+        flags_part = parts[1]
+
+    if flags_part:
+      flags[symbol_idx] = int(flags_part, 16)
+    if aliases_part:
+      num_aliases[symbol_idx] = int(aliases_part, 16)
+
+  flatten = itertools.chain.from_iterable
+  columns = models.SymbolColumns(
+      section_names, section_counts,
+      addresses=_MakeColumn(8, flatten(addresses)),
+      sizes=_MakeColumn(4, flatten(sizes)),
+      flags=flags,
+      num_aliases=num_aliases,
+      path_indices=_MakeColumn(4, flatten(path_indices)),
+      component_indices=_MakeColumn(4, flatten(component_indices)),
+      full_names=full_names,
+      path_tuples=path_tuples,
+      components=components)
+  return models.SizeInfo(section_sizes, columns.AllSymbols(),
+                         metadata=metadata, size_path=size_path)
+
+
+def _TypecodeForItemSize(item_size):
+  """Returns the array typecode for integers of |item_size| bytes.
+
+  Signed typecodes are used since Python 2 returns longs for unsigned ones.
+  """
+  for typecode in 'bhilq':
+    try:
+      if array.array(typecode).itemsize == item_size:
+        return typecode
+    except ValueError:
+      pass  # 'q' does not exist in Python 2.
+  raise Exception('No array typecode with an item size of %d' % item_size)
+
+
+def _MakeColumn(item_size, values=()):
+  return array.array(_TypecodeForItemSize(item_size), values)
 
-      raw_symbols[symbol_idx] = new_sym
-      symbol_idx += 1
 
-  return models.SizeInfo(section_sizes, raw_symbols, metadata=metadata,
-                         size_path=size_path)
+def _PathsFromSymbols(raw_symbols):
+  """Returns the (sorted unique path tuples, sorted unique components)."""
+  unique_path_tuples = sorted(set(
+      (s.object_path, s.source_path) for s in raw_symbols))
+  unique_components = sorted(set(s.component for s in raw_symbols))
+  return unique_path_tuples, unique_components
+
+
+def _SaveColumnarSizeInfoToFile(size_info, file_obj):
+  """Saves size info to a .size file using the columnar format.
+
+  Args:
+    size_info: Data to write to the file
+    file_object: File opened for writing
+  """
+  unique_path_tuples, unique_components = _PathsFromSymbols(
+      size_info.raw_symbols)
+  path_tuples = {tup: i for i, tup in enumerate(unique_path_tuples)}
+  components = {comp: i for i, comp in enumerate(unique_components)}
+  by_section = size_info.raw_symbols.GroupedBySectionName()
+
+  columns = collections.OrderedDict(
+      (name, _MakeColumn(item_size))
+      for name, item_size in _COLUMNAR_SYMBOL_BLOCKS)
+  addresses = columns['addresses']
+  sizes = columns['sizes']
+  flags = columns['flags']
+  num_aliases = columns['num_aliases']
+  path_indices = columns['path_indices']
+  component_indices = columns['component_indices']
+  name_offsets = _MakeColumn(4)
+  names = []
+  name_offset = 0
+  prev_aliases = None
+  for group in by_section:
+    for symbol in group:
+      addresses.append(symbol.address)
+      # Padding is recalculated from addresses on load (as for the text format).
+      sizes.append(
+          symbol.size if symbol.IsOverhead() else symbol.size_without_padding)
+      flags.append(symbol.flags)
+      if symbol.aliases and symbol.aliases is not prev_aliases:
+        num_aliases.append(symbol.num_aliases)
+      else:
+        num_aliases.append(0)
+      prev_aliases = symbol.aliases
+      path_indices.append(path_tuples[(symbol.object_path, symbol.source_path)])
+      component_indices.append(components[symbol.component])
+      names.append(symbol.full_name)
+      # +1 for the separator.
+      name_offset += len(symbol.full_name) + 1
+      name_offsets.append(name_offset - 1)
+  columns['name_offsets'] = name_offsets
+
+  blocks = [
+      ('paths', '\0'.join('%s\t%s' % pair for pair in unique_path_tuples)),
+      ('components', '\0'.join(unique_components)),
+      ('names', '\0'.join(names)),
+  ]
+  for name, column in columns.iteritems():
+    if sys.byteorder != 'little':
+      column.byteswap()
+    blocks.append((name, column))
+
+  headers = {
+      'metadata': size_info.metadata,
+      'section_sizes': size_info.section_sizes,
+      'section_names': [g.name for g in by_section],
+      'section_counts': [len(g) for g in by_section],
+      'string_table_counts': {
+          'paths': len(unique_path_tuples),
+          'components': len(unique_components),
+      },
+      'blocks': [
+          [name, getattr(data, 'itemsize', 1), len(data)]
+          for name, data in blocks],
+  }
+  metadata_str = json.dumps(headers, indent=2, sort_keys=True)
+  header = '# Created by //tools/binary_size\n%s\n%d\n%s\n' % (
+      _COLUMNAR_SERIALIZATION_VERSION, len(metadata_str), metadata_str)
+  file_obj.write(header)
+  offset = len(header)
+  for name, data in blocks:
+    padding = -offset % _COLUMNAR_ALIGNMENT
+    file_obj.write('\0' * padding)
+    if isinstance(data, array.array):
+      data = data.tostring()
+    file_obj.write(data)
+    offset += padding + len(data)
+    _LogSize(file_obj, name)
+
+
+def _ReadColumnarHeader(buf):
+  """Returns (headers, offset of the first block) for the columnar format."""
+  line_end = buf.find('\n')
+  version_end = buf.find('\n', line_end + 1)
+  actual_version = buf[line_end + 1:version_end]
+  assert actual_version == _COLUMNAR_SERIALIZATION_VERSION, (
+      'Not a .size file, or an unknown version: %r' % actual_version[:80])
+  json_len_end = buf.find('\n', version_end + 1)
+  json_len = int(buf[version_end + 1:json_len_end])
+  json_start = json_len_end + 1
+  headers = json.loads(buf[json_start:json_start + json_len])
+  # +1 for the trailing newline.
+  return headers, json_start + json_len + 1
+
+
+def _ReadColumnarBlocks(buf):
+  """Decodes all blocks of a columnar .size file.
+
+  Returns:
+    A tuple of (headers, dict of block name -> str or array.array).
+  """
+  headers, offset = _ReadColumnarHeader(buf)
+  blocks = {}
+  for name, item_size, count in headers['blocks']:
+    offset += -offset % _COLUMNAR_ALIGNMENT
+    end = offset + item_size * count
+    if item_size == 1:
+      blocks[name] = buf[offset:end]
+    else:
+      column = _MakeColumn(item_size)
+      column.fromstring(buf[offset:end])
+      if sys.byteorder != 'little':
+        column.byteswap()
+      blocks[name] = column
+    offset = end
+  return headers, blocks
+
+
+def _SplitStringTable(data, count):
+  ret = data.split('\0') if count else []
+  assert len(ret) == count, 'Expected %d strings, got %d' % (count, len(ret))
+  return ret
+
+
+class _StringTable(object):
+  """Sequence of strings that are sliced out of a string table on access."""
+  __slots__ = ('_data', '_end_offsets')
+
+  def __init__(self, data, end_offsets):
+    self._data = data
+    self._end_offsets = end_offsets
+
+  def __len__(self):
+    return len(self._end_offsets)
+
+  def __getitem__(self, idx):
+    start = self._end_offsets[idx - 1] + 1 if idx else 0
+    return self._data[start:self._end_offsets[idx]]
+
+
+def _LoadColumnarSizeInfoFromBuffer(buf, size_path):
+  """Loads a size_info from a columnar .size file.
+
+  See _SaveColumnarSizeInfoToFile for details on the format.
+
+  Args:
+    buf: A str or mmap holding the entire file.
+  """
+  headers, blocks = _ReadColumnarBlocks(buf)
+  string_table_counts = headers['string_table_counts']
+  path_tuples = [tuple(p.split('\t')) for p in
+                 _SplitStringTable(blocks['paths'],
+                                   string_table_counts['paths'])]
+  columns = models.SymbolColumns(
+      headers['section_names'], headers['section_counts'],
+      addresses=blocks['addresses'],
+      sizes=blocks['sizes'],
+      flags=blocks['flags'],
+      num_aliases=blocks['num_aliases'],
+      path_indices=blocks['path_indices'],
+      component_indices=blocks['component_indices'],
+      full_names=_StringTable(blocks['names'], blocks['name_offsets']),
+      path_tuples=path_tuples,
+      components=_SplitStringTable(blocks['components'],
+                                   string_table_counts['components']))
+  return models.SizeInfo(headers['section_sizes'], columns.AllSymbols(),
+                         metadata=headers.get('metadata'), size_path=size_path)
 
 
 @contextlib.contextmanager
@@ -352,9 +578,19 @@ def _OpenGzipForWrite(path, file_obj=None):
         yield fz
 
 
-def SaveSizeInfo(size_info, path, file_obj=None):
-  """Saves |size_info| to |path}."""
-  if os.environ.get('SUPERSIZE_MEASURE_GZIP') == '1':
+def SaveSizeInfo(size_info, path, file_obj=None, columnar=False):
+  """Saves |size_info| to |path}.
+
+  When |columnar| is True, writes the uncompressed columnar format, which is
+  larger on disk but much faster to load.
+  """
+  if columnar:
+    if file_obj:
+      _SaveColumnarSizeInfoToFile(size_info, file_obj)
+    else:
+      with open(path, 'wb') as f:
+        _SaveColumnarSizeInfoToFile(size_info, f)
+  elif os.environ.get('SUPERSIZE_MEASURE_GZIP') == '1':
     with _OpenGzipForWrite(path, file_obj=file_obj) as f:
       _SaveSizeInfoToFile(size_info, f)
   else:
@@ -369,6 +605,24 @@ def SaveSizeInfo(size_info, path, file_obj=None):
 
 
 def LoadSizeInfo(filename, file_obj=None):
-  """Returns a SizeInfo loaded from |filename|."""
+  """Returns a SizeInfo loaded from |filename|.
+
+  Detects whether the file uses the (gzipped) text format or the columnar one.
+  """
+  if file_obj:
+    pos = file_obj.tell()
+    is_gzip = file_obj.read(len(_GZIP_MAGIC)) == _GZIP_MAGIC
+    file_obj.seek(pos)
+    if not is_gzip:
+      return _LoadColumnarSizeInfoFromBuffer(file_obj.read(), filename)
+  else:
+    with open(filename, 'rb') as f:
+      if f.read(len(_GZIP_MAGIC)) != _GZIP_MAGIC:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+          return _LoadColumnarSizeInfoFromBuffer(buf, filename)
+        finally:
+          buf.close()
+
   with gzip.GzipFile(filename=filename, fileobj=file_obj) as f:
     return _LoadSizeInfoFromFile(f, filename)
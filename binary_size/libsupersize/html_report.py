@@ -6,6 +6,8 @@
 
 import codecs
 import collections
+import contextlib
+import gzip
 import itertools
 import json
 import logging
@@ -38,19 +40,6 @@ _MAX_OTHER_SYMBOL_COVERAGE = .05
 _MIN_OTHER_PSS = 1
 
 
-def _GetOrAddFileNode(path, component, file_nodes, components):
-  file_node = file_nodes.get(path)
-  if file_node is None:
-    component_index = components.GetOrAdd(component)
-    file_node = {
-      _COMPACT_FILE_PATH_KEY: path,
-      _COMPACT_FILE_COMPONENT_INDEX_KEY: component_index,
-      _COMPACT_FILE_SYMBOLS_KEY: [],
-    }
-    file_nodes[path] = file_node
-  return file_node
-
-
 class IndexedSet(object):
   """Set-like object where values are unique and indexed.
 
@@ -96,73 +85,53 @@ def _PartitionSymbols(symbols):
   return main_symbols, extra_symbols
 
 
-def _MakeTreeViewList(symbols, include_all_symbols):
-  """Builds JSON data of the symbols for the tree view HTML report.
+def _MakeSymbolEntry(symbol, default_symbol_count):
+  symbol_size = round(symbol.pss, 2)
+  if symbol_size.is_integer():
+    symbol_size = int(symbol_size)
+  symbol_count = default_symbol_count
+  if symbol.IsDelta():
+    symbol_count = models.DIFF_COUNT_DELTA[symbol.diff_status]
 
-  As the tree is built on the client-side, this function creates a flat list
-  of files, where each file object contains symbols that have the same path.
+  name = symbol.full_name if symbol.IsDex() else symbol.template_name
+  symbol_entry = {
+    _COMPACT_SYMBOL_BYTE_SIZE_KEY: symbol_size,
+    _COMPACT_SYMBOL_NAME_KEY: name,
+    _COMPACT_SYMBOL_TYPE_KEY: symbol.section,
+  }
+  if symbol.num_aliases != 1:
+    symbol_entry[_COMPACT_SYMBOL_NUM_ALIASES_KEY] = symbol.num_aliases
 
-  Args:
-    symbols: A SymbolGroup containing all symbols.
-    include_all_symbols: If true, include all symbols in the data file.
-  """
-  file_nodes = {}
-  components = IndexedSet()
-  # Dict of path -> type -> accumulated pss.
-  small_symbol_pss = collections.defaultdict(
-      lambda: collections.defaultdict(float))
+  # We use symbol count for the method count mode in the diff mode report.
+  # Negative values are used to indicate a symbol was removed, so it should
+  # count as -1 rather than the default, 1.
+  # We don't care about accurate counts for other symbol types currently,
+  # so this data is only included for methods.
+  is_dex_method = symbol.section_name == models.SECTION_DEX_METHOD
+  if is_dex_method and symbol_count != default_symbol_count:
+    symbol_entry[_COMPACT_SYMBOL_COUNT_KEY] = symbol_count
+  if symbol.flags:
+    symbol_entry[_COMPACT_SYMBOL_FLAGS_KEY] = symbol.flags
+  return symbol_entry
 
-  # For delta symbols, most counts should 0, so use that as default. Else use 1.
-  default_symbol_count = 0 if symbols.IsDelta() else 1
 
-  if include_all_symbols:
-    main_symbols, extra_symbols = symbols, []
-  else:
-    logging.info('Partitioning symbols...')
-    main_symbols, extra_symbols = _PartitionSymbols(symbols)
+def _SymbolPath(symbol):
+  return symbol.source_path or symbol.object_path
 
-  # Bundle symbols by the file they belong to.
-  # Add all the file buckets into file_nodes.
-  for symbol in main_symbols:
-    symbol_size = round(symbol.pss, 2)
-    if symbol_size.is_integer():
-      symbol_size = int(symbol_size)
-    symbol_count = default_symbol_count
-    if symbol.IsDelta():
-      symbol_count = models.DIFF_COUNT_DELTA[symbol.diff_status]
-
-    path = symbol.source_path or symbol.object_path
-    file_node = _GetOrAddFileNode(
-        path, symbol.component, file_nodes, components)
-
-    name = symbol.full_name if symbol.IsDex() else symbol.template_name
-    symbol_entry = {
-      _COMPACT_SYMBOL_BYTE_SIZE_KEY: symbol_size,
-      _COMPACT_SYMBOL_NAME_KEY: name,
-      _COMPACT_SYMBOL_TYPE_KEY: symbol.section,
-    }
-    if symbol.num_aliases != 1:
-      symbol_entry[_COMPACT_SYMBOL_NUM_ALIASES_KEY] = symbol.num_aliases
-
-    # We use symbol count for the method count mode in the diff mode report.
-    # Negative values are used to indicate a symbol was removed, so it should
-    # count as -1 rather than the default, 1.
-    # We don't care about accurate counts for other symbol types currently,
-    # so this data is only included for methods.
-    is_dex_method = symbol.section_name == models.SECTION_DEX_METHOD
-    if is_dex_method and symbol_count != default_symbol_count:
-      symbol_entry[_COMPACT_SYMBOL_COUNT_KEY] = symbol_count
-    if symbol.flags:
-      symbol_entry[_COMPACT_SYMBOL_FLAGS_KEY] = symbol.flags
-    file_node[_COMPACT_FILE_SYMBOLS_KEY].append(symbol_entry)
-
-  # Collect small symbols into a per-path dict.
+
+def _MakeOtherEntriesByPath(extra_symbols):
+  """Returns a dict of path -> (component, list of "other" symbol entries).
+
+  Small symbols are collected into one "other" symbol per path and section.
+  """
+  # Dict of (path, component) -> type -> accumulated pss.
+  small_symbol_pss = collections.defaultdict(
+      lambda: collections.defaultdict(float))
   for symbol in extra_symbols:
-    path = symbol.source_path or symbol.object_path
-    tup = (path, symbol.component)
+    tup = (_SymbolPath(symbol), symbol.component)
     small_symbol_pss[tup][symbol.section_name] += symbol.pss
 
-  # Insert small symbols.
+  ret = {}
   inserted_smalls_count = 0
   inserted_smalls_abs_pss = 0
   skipped_smalls_count = 0
@@ -176,8 +145,8 @@ def _MakeTreeViewList(symbols, include_all_symbols):
       else:
         inserted_smalls_count += 1
         inserted_smalls_abs_pss += abs(pss)
-        file_node = _GetOrAddFileNode(path, component, file_nodes, components)
-        file_node[_COMPACT_FILE_SYMBOLS_KEY].append({
+        entries = ret.setdefault(path, (component, []))[1]
+        entries.append({
           _COMPACT_SYMBOL_NAME_KEY: 'Other ' + section_name,
           _COMPACT_SYMBOL_TYPE_KEY:
               models.SECTION_NAME_TO_SECTION[section_name],
@@ -187,19 +156,95 @@ def _MakeTreeViewList(symbols, include_all_symbols):
       'Created %d "other" symbols with PSS=%.1f. Omitted %d with PSS=%.1f',
       inserted_smalls_count, inserted_smalls_abs_pss, skipped_smalls_count,
       skipped_smalls_abs_pss)
+  return ret
+
+
+def _MakeTreeViewList(symbols, include_all_symbols):
+  """Builds JSON data of the symbols for the tree view HTML report.
+
+  As the tree is built on the client-side, this function creates a flat list
+  of files, where each file object contains symbols that have the same path.
+
+  File objects are created lazily, in order of path, so that only one of them
+  needs to exist at a time.
+
+  Args:
+    symbols: A SymbolGroup containing all symbols.
+    include_all_symbols: If true, include all symbols in the data file.
+
+  Returns:
+    A tuple of (meta, file_nodes), where |file_nodes| is a generator.
+  """
+  # For delta symbols, most counts should 0, so use that as default. Else use 1.
+  default_symbol_count = 0 if symbols.IsDelta() else 1
+
+  if include_all_symbols:
+    main_symbols, extra_symbols = symbols, []
+  else:
+    logging.info('Partitioning symbols...')
+    main_symbols, extra_symbols = _PartitionSymbols(symbols)
+
+  # Bundle symbols by the file they belong to. Sorting is stable, so symbols
+  # within a file keep their order.
+  main_symbols = sorted(main_symbols, key=_SymbolPath)
+  other_entries_by_path = _MakeOtherEntriesByPath(extra_symbols)
+
+  # Components must be known up-front since they are part of |meta|. Files use
+  # the component of their first symbol.
+  components = IndexedSet()
+  component_index_by_path = {}
+  for path, group in itertools.groupby(main_symbols, key=_SymbolPath):
+    component_index_by_path[path] = components.GetOrAdd(next(group).component)
+  for path, (component, _) in sorted(other_entries_by_path.iteritems()):
+    if path not in component_index_by_path:
+      component_index_by_path[path] = components.GetOrAdd(component)
+
+  def file_nodes():
+    main_groups = itertools.groupby(main_symbols, key=_SymbolPath)
+    next_main_group = next(main_groups, None)
+    for path in sorted(component_index_by_path):
+      symbol_entries = []
+      if next_main_group and next_main_group[0] == path:
+        symbol_entries.extend(_MakeSymbolEntry(s, default_symbol_count)
+                              for s in next_main_group[1])
+        next_main_group = next(main_groups, None)
+      other_entries = other_entries_by_path.get(path)
+      if other_entries:
+        symbol_entries.extend(other_entries[1])
+      yield {
+        _COMPACT_FILE_PATH_KEY: path,
+        _COMPACT_FILE_COMPONENT_INDEX_KEY: component_index_by_path[path],
+        _COMPACT_FILE_SYMBOLS_KEY: symbol_entries,
+      }
 
   meta = {
     'components': components.value_list,
     'total': symbols.pss,
   }
-  return meta, file_nodes.values()
+  return meta, file_nodes()
+
+
+@contextlib.contextmanager
+def _OpenReportForWrite(path):
+  """Opens |path| for writing, gzipping when it ends with ".gz"."""
+  if path.endswith('.gz'):
+    with open(path, 'wb') as f:
+      # Open in a way that doesn't set any gzip header fields.
+      with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as fz:
+        yield fz
+  else:
+    with codecs.open(path, 'w', encoding='ascii') as f:
+      yield f
 
 
 def BuildReportFromSizeInfo(out_path, size_info, all_symbols=False):
   """Builds a .ndjson report for a .size file.
 
+  The report is written one file node at a time, so peak memory is bounded by
+  the largest file node rather than by the total number of symbols.
+
   Args:
-    out_path: Path to save JSON report to.
+    out_path: Path to save JSON report to. Gzipped when it ends with ".gz".
     size_info: A SizeInfo or DeltaSizeInfo to use for the report.
     all_symbols: If true, all symbols will be included in the report rather
       than truncated.
@@ -211,7 +256,6 @@ def BuildReportFromSizeInfo(out_path, size_info, all_symbols=False):
     symbols = symbols.WhereDiffStatusIs(models.DIFF_STATUS_UNCHANGED).Inverted()
 
   meta, tree_nodes = _MakeTreeViewList(symbols, all_symbols)
-  logging.info('Created %d tree nodes', len(tree_nodes))
   meta.update({
     'diff_mode': is_diff,
     'section_sizes': size_info.section_sizes,
@@ -233,13 +277,16 @@ def BuildReportFromSizeInfo(out_path, size_info, all_symbols=False):
     'check_circular': False,
   }
 
-  with codecs.open(out_path, 'w', encoding='ascii') as out_file:
+  num_tree_nodes = 0
+  with _OpenReportForWrite(out_path) as out_file:
     json.dump(meta, out_file, **json_dump_args)
     out_file.write('\n')
 
     for tree_node in tree_nodes:
       json.dump(tree_node, out_file, **json_dump_args)
       out_file.write('\n')
+      num_tree_nodes += 1
+  logging.info('Wrote %d tree nodes', num_tree_nodes)
 
 
 def _MakeDirIfDoesNotExist(rel_path):
@@ -257,7 +304,7 @@ def AddArguments(parser):
                       help='Path to input .size file.')
   parser.add_argument('output_report_file',
                       help='Write generated data to the specified '
-                           '.ndjson file.')
+                           '.ndjson file (or .ndjson.gz to gzip it).')
   parser.add_argument('--all-symbols', action='store_true',
                       help='Include all symbols. Will cause the data file to '
                            'take longer to load.')
@@ -270,8 +317,8 @@ def Run(args, parser):
     parser.error('Input must end with ".size"')
   if args.diff_with and not args.diff_with.endswith('.size'):
     parser.error('Diff input must end with ".size"')
-  if not args.output_report_file.endswith('.ndjson'):
-    parser.error('Output must end with ".ndjson"')
+  if not args.output_report_file.endswith(('.ndjson', '.ndjson.gz')):
+    parser.error('Output must end with ".ndjson" or ".ndjson.gz"')
 
   size_info = archive.LoadAndPostProcessSizeInfo(args.input_size_file)
   if args.diff_with:
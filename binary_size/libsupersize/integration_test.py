@@ -7,11 +7,14 @@ import cStringIO
 import contextlib
 import copy
 import glob
+import gzip
 import itertools
+import json
 import os
 import unittest
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
 import tempfile
@@ -21,6 +24,7 @@ import archive
 import describe
 import diff
 import file_format
+import html_report
 import models
 import test_util
 
@@ -216,12 +220,14 @@ class IntegrationTest(unittest.TestCase):
 
   def _DoArchive(self, archive_path, use_output_directory=True, use_elf=True,
                  use_apk=False, use_minimal_apks=False, use_pak=False,
-                 debug_measures=False):
+                 debug_measures=False, object_cache_path=None):
     args = [
       archive_path,
       '--map-file', _TEST_MAP_PATH,
       '--source-directory', _TEST_SOURCE_DIR,
     ]
+    if object_cache_path:
+      args += ['--object-cache', object_cache_path]
     if use_output_directory:
       # Let autodetection find output_directory when --elf-file is used.
       if not use_elf:
@@ -335,12 +341,136 @@ class IntegrationTest(unittest.TestCase):
         ret.extend(l.rstrip() for l in f)
       return ret
 
+  def test_HtmlReport(self):
+    size_info = self._CloneSizeInfo()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      ndjson_path = os.path.join(tmp_dir, 'report.ndjson')
+      html_report.BuildReportFromSizeInfo(ndjson_path, size_info,
+                                          all_symbols=True)
+      with open(ndjson_path) as f:
+        contents = f.read()
+      gz_path = ndjson_path + '.gz'
+      html_report.BuildReportFromSizeInfo(gz_path, size_info, all_symbols=True)
+      with gzip.open(gz_path) as f:
+        self.assertEquals(contents, f.read())
+    finally:
+      shutil.rmtree(tmp_dir)
+
+    lines = contents.splitlines()
+    meta = json.loads(lines[0])
+    file_nodes = [json.loads(l) for l in lines[1:]]
+    paths = [n['p'] for n in file_nodes]
+    # One node per path, emitted in sorted order.
+    self.assertEquals(sorted(set(paths)), paths)
+    self.assertEquals(len(size_info.raw_symbols),
+                      sum(len(n['s']) for n in file_nodes))
+    self.assertEquals(len(meta['components']),
+                      len(set(n['c'] for n in file_nodes)))
+
   @_CompareWithGolden()
   def test_Diff_NullDiff(self):
     with tempfile.NamedTemporaryFile(suffix='.size') as temp_file:
       file_format.SaveSizeInfo(self._CloneSizeInfo(), temp_file.name)
       return _RunApp('diff', [temp_file.name, temp_file.name])
 
+  def test_Columnar(self):
+    size_info = self._CloneSizeInfo()
+    stringio = cStringIO.StringIO()
+    file_format.SaveSizeInfo(size_info, 'path', file_obj=stringio)
+    stringio.seek(0)
+    expected = archive.LoadAndPostProcessSizeInfo('path', file_obj=stringio)
+    expected_lines = list(describe.GenerateLines(expected, verbose=True))
+    with tempfile.NamedTemporaryFile(suffix='.size') as temp_file:
+      file_format.SaveSizeInfo(size_info, temp_file.name, columnar=True)
+      actual_from_path = archive.LoadAndPostProcessSizeInfo(temp_file.name)
+      stringio = cStringIO.StringIO(temp_file.read())
+      actual_from_file_obj = archive.LoadAndPostProcessSizeInfo(
+          temp_file.name, file_obj=stringio)
+    for actual in (actual_from_path, actual_from_file_obj):
+      actual_lines = list(describe.GenerateLines(actual, verbose=True))
+      self.assertEquals(expected_lines, actual_lines)
+
+  def test_Columnar_EmptyStrings(self):
+    # Tables holding a single empty string must not load back as empty tables.
+    S = models.SECTION_TEXT
+    size_info = models.SizeInfo({S: 30}, [
+        models.Symbol(S, 10, address=0x100, full_name='foo'),
+        models.Symbol(S, 20, address=0x110, full_name='bar'),
+    ])
+    with tempfile.NamedTemporaryFile(suffix='.size') as temp_file:
+      file_format.SaveSizeInfo(size_info, temp_file.name, columnar=True)
+      loaded = file_format.LoadSizeInfo(temp_file.name)
+    self.assertEquals(
+        [('foo', 10, '', '', ''), ('bar', 20, '', '', '')],
+        [(s.full_name, s.size, s.component, s.object_path, s.source_path)
+         for s in loaded.raw_symbols])
+
+  def test_LazySymbols(self):
+    stringio = cStringIO.StringIO()
+    file_format.SaveSizeInfo(self._CloneSizeInfo(), 'path', file_obj=stringio)
+    stringio.seek(0)
+    lazy_syms = archive.LoadAndPostProcessSizeInfo(
+        'path', file_obj=stringio).raw_symbols
+    count_created = lambda: sum(
+        1 for s in lazy_syms.columns._symbols if s is not None)
+    # Symbols are created only for logging large paddings.
+    num_created_after_load = count_created()
+
+    def summarize(group):
+      return [(g.full_name, len(g), g.size, g.pss, g.padding) for g in group]
+
+    lazy_results = [
+        (lazy_syms.size, lazy_syms.pss, lazy_syms.padding),
+        summarize(lazy_syms.GroupedBySectionName()),
+        summarize([lazy_syms.WhereInSection('b'),
+                   lazy_syms.WhereInSection('tr').Inverted()]),
+        summarize(lazy_syms.GroupedByPath(depth=1)),
+        summarize(lazy_syms.WhereIsNative().GroupedByComponent()),
+    ]
+    # None of the above should have required creating Symbol objects.
+    self.assertEquals(num_created_after_load, count_created())
+
+    syms = models.SymbolGroup(list(lazy_syms))
+    expected_results = [
+        (syms.size, syms.pss, syms.padding),
+        summarize(syms.GroupedBySectionName()),
+        summarize([syms.WhereInSection('b'),
+                   syms.WhereInSection('tr').Inverted()]),
+        summarize(syms.GroupedByPath(depth=1)),
+        summarize(syms.WhereIsNative().GroupedByComponent()),
+    ]
+    self.assertEquals(expected_results, lazy_results)
+
+  def test_Archive_ObjectCache(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      size_path = os.path.join(tmp_dir, 'out.size')
+      self._DoArchive(size_path)
+      with open(size_path, 'rb') as f:
+        expected = f.read()
+      cache_path = os.path.join(tmp_dir, 'cache.db')
+      # Once to populate the cache, and once to read from it.
+      for _ in xrange(2):
+        self._DoArchive(size_path, object_cache_path=cache_path)
+        with open(size_path, 'rb') as f:
+          self.assertEquals(expected, f.read())
+      conn = sqlite3.connect(cache_path)
+      num_rows = conn.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+      self.assertGreater(num_rows, 0)
+
+      # Entries of objects that no longer exist are removed.
+      with conn:
+        conn.execute('INSERT INTO objects (path, kind) VALUES (?, ?)',
+                     ('obj/deleted.o', 'nm'))
+      self._DoArchive(size_path, object_cache_path=cache_path)
+      self.assertEquals(
+          num_rows,
+          conn.execute('SELECT COUNT(*) FROM objects').fetchone()[0])
+      conn.close()
+    finally:
+      shutil.rmtree(tmp_dir)
+
   # Runs archive 3 times, and asserts the contents are the same each time.
   def test_Idempotent(self):
     prev_contents = None
@@ -499,6 +629,22 @@ class IntegrationTest(unittest.TestCase):
                       0)
     self.assertEquals(d.symbols.size, 0)
 
+  def test_Diff_SharedKeys(self):
+    S = models.SECTION_RODATA
+    def make_size_info(sizes):
+      return models.SizeInfo({}, [
+          models.Symbol(S, size, address=0x100 * i,
+                        full_name=models.STRING_LITERAL_NAME, object_path='a')
+          for i, size in enumerate(sizes)])
+
+    d = diff.Diff(make_size_info([10, 20, 30, 30]),
+                  make_size_info([30, 40, 20, 50, 60]))
+    pairs = [(s.before_symbol and s.before_symbol.size,
+              s.after_symbol and s.after_symbol.size) for s in d.raw_symbols]
+    # Exact matches first, then the rest in order of appearance.
+    self.assertEquals(
+        [(30, 30), (20, 20), (10, 40), (30, 50), (None, 60)], pairs)
+
   @_CompareWithGolden()
   def test_FullDescription(self):
     size_info = self._CloneSizeInfo()
@@ -510,6 +656,90 @@ class IntegrationTest(unittest.TestCase):
                                verbose=True),
     )
 
+  def test_AddressIndex(self):
+    size_info = self._CloneSizeInfo()
+    with tempfile.NamedTemporaryFile(suffix='.size') as temp_file:
+      file_format.SaveSizeInfo(size_info, temp_file.name, columnar=True)
+      columnar_size_info = archive.LoadAndPostProcessSizeInfo(temp_file.name)
+
+    raw_symbols = size_info.raw_symbols
+    addresses = sorted(set(s.address for s in raw_symbols) |
+                       set(s.end_address - 1 for s in raw_symbols))
+    for info in (size_info, columnar_size_info):
+      syms = info.raw_symbols
+      for address in addresses:
+        expected = [s for s in syms
+                    if s.address <= address < s.address + max(
+                        s.size_without_padding, 1)]
+        self.assertEquals(expected, syms.FindSymbolsAt(address))
+        self.assertEquals(expected[0] if expected else None,
+                          info.FindSymbolAt(address))
+      for start, end in zip(addresses, addresses[5:]):
+        expected = [s for s in syms if start <= s.address < end]
+        found = syms.WhereAddressInRange(start, end)
+        self.assertEquals(expected, list(found))
+        self.assertEquals(expected, list(info.IterSymbolsInRange(start, end)))
+        self.assertEquals(len(syms) - len(expected), len(found.Inverted()))
+      text_syms = syms.WhereInSection(models.SECTION_TEXT)
+      start = text_syms[0].address
+      self.assertEquals(
+          [s for s in text_syms if s.address == start],
+          list(syms.IterSymbolsInRange('%x' % start,
+                                       section_name=models.SECTION_TEXT)))
+
+  def test_QueryAndMemoization(self):
+    size_info = self._CloneSizeInfo()
+    with tempfile.NamedTemporaryFile(suffix='.size') as temp_file:
+      file_format.SaveSizeInfo(size_info, temp_file.name, columnar=True)
+      columnar_size_info = archive.LoadAndPostProcessSizeInfo(temp_file.name)
+
+    for info in (size_info, columnar_size_info):
+      syms = info.raw_symbols
+      results = syms.Query({
+          'path': r'third_party',
+          'big': lambda s: s.size > 100,
+      })
+      self.assertEquals(list(syms.WhereMatches(r'third_party')),
+                        list(results['path']))
+      self.assertEquals(list(syms.WhereMatches(r'third_party').Inverted()),
+                        list(results['path'].Inverted()))
+      self.assertEquals(list(syms.WhereSizeBiggerThan(101)),
+                        list(results['big']))
+
+      # Column-based filters should agree with symbol-based ones.
+      for pattern in (r'third_party', r'^base/', r'\.o$'):
+        self.assertEquals(
+            [s for s in syms if re.search(pattern, s.object_path)],
+            list(syms.WhereObjectPathMatches(pattern)))
+        self.assertEquals(
+            [s for s in syms if re.search(pattern, s.source_path) or
+             re.search(pattern, s.object_path)],
+            list(syms.WherePathMatches(pattern)))
+      self.assertEquals(
+          [s for s in syms if 'Internal' in s.component],
+          list(syms.WhereComponentMatches('Internal')))
+
+      self.assertIsNot(syms.GroupedByPath(depth=1),
+                       syms.GroupedByPath(depth=1))
+      info.EnableMemoization()
+      by_path = info.symbols.GroupedByPath(depth=1)
+      expected_names = [g.full_name for g in by_path]
+      self.assertEquals(by_path, info.symbols.GroupedByPath(1))
+      self.assertEquals(1, len(info.symbols._memo))
+      self.assertNotEquals(by_path, info.symbols.GroupedByPath(depth=2))
+      self.assertEquals(2, len(info.symbols._memo))
+      by_component = syms.GroupedByComponent()
+      num_memoized = len(syms._memo)
+      self.assertEquals(by_component, syms.GroupedByComponent())
+      self.assertEquals(num_memoized, len(syms._memo))
+
+      # Modifying results does not affect later calls.
+      by_path.SetName('renamed')
+      by_path[0].SetName('renamed')
+      by_path = info.symbols.GroupedByPath(depth=1)
+      self.assertNotEquals('renamed', by_path.full_name)
+      self.assertEquals(expected_names, [g.full_name for g in by_path])
+
   @_CompareWithGolden()
   def test_SymbolGroupMethods(self):
     all_syms = self._CloneSizeInfo().symbols
@@ -23,12 +23,16 @@ from __future__ import print_function
 import argparse
 import code
 import collections
+import io
 import itertools
 import logging
+import marshal
 import os
 import re
 import readline
+import zlib
 
+import concurrent
 import demangle
 import models
 
@@ -39,6 +43,12 @@ import models
 #   whereas "nm" skips over these (they don't account for much though).
 # * The parse time for compressed linker maps is dominated by ungzipping.
 
+# Size of blocks to read (and ungzip) map files in.
+_READ_BLOCK_SIZE = 4 * 1024 * 1024
+# LLD map files are split into chunks of at least this many bytes, which are
+# parsed in parallel.
+_MIN_CHUNK_SIZE = 8 * 1024 * 1024
+
 _STRIP_NAME_PREFIX = {
     models.FLAG_STARTUP: 8,
     models.FLAG_UNLIKELY: 9,
@@ -324,6 +334,81 @@ class MapFileParserGold(object):
         raise
 
 
+def _IterFileBlocks(path):
+  """Yields the contents of |path| in large blocks, ungzipping if necessary."""
+  with open(path, 'rb') as f:
+    blocks = iter(lambda: f.read(_READ_BLOCK_SIZE), '')
+    if not path.endswith('.gz'):
+      for block in blocks:
+        yield block
+      return
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for block in blocks:
+      while block:
+        yield decompressor.decompress(block)
+        # Data past the end of a gzip member belongs to the next member.
+        block = decompressor.unused_data
+        if block:
+          decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+
+
+def ReadMapFile(path):
+  """Returns the contents of the linker map at |path| (which may be gzipped)."""
+  return ''.join(_IterFileBlocks(path))
+
+
+def IterMapFileLines(path):
+  """Yields lines from the linker map at |path| (which may be gzipped)."""
+  remainder = ''
+  for block in _IterFileBlocks(path):
+    block = remainder + block
+    end = block.rfind('\n') + 1
+    for line in io.BytesIO(block[:end]):
+      yield line
+    remainder = block[end:]
+  if remainder:
+    yield remainder
+
+
+def _LineEnd(data, pos):
+  """Returns the offset just past the end of the line at |pos|."""
+  end = data.find('\n', pos)
+  return len(data) if end == -1 else end + 1
+
+
+def _FindLldLevel1Lines(start, end, data=None, linker_name=None):
+  """Returns encoded [(offset, tok)] for Level 1 lines starting in [start, end).
+  """
+  parser = MapFileParserLld(linker_name)
+  candidate_pattern = parser._Level1CandidatePattern()
+  ret = []
+  for m in candidate_pattern.finditer(data, start, _LineEnd(data, end)):
+    pos = m.start()
+    if pos >= end:
+      break
+    level, tok = parser._TokenizeLineAt(data, pos)
+    if level == 1:
+      ret.append((pos, tok))
+  return marshal.dumps(ret)
+
+
+def _ParseLldChunk(chunk_idx, start, end, section, data=None,
+                   linker_name=None):
+  """Parses the lines of |data| in [start, end).
+
+  Returns an encoded tuple of (chunk_idx, section_sizes items, symbol tuples,
+  thin_map items, promoted_name_count).
+  """
+  parser = MapFileParserLld(linker_name)
+  syms, thin_map, promoted_name_count = parser._ParseLines(
+      io.BytesIO(data[start:end]), section)
+  sym_tuples = [(s.section_name, s.size, s.address, s.full_name,
+                 s.object_path, s.flags) for s in syms]
+  return marshal.dumps((chunk_idx, parser._section_sizes.items(), sym_tuples,
+                        thin_map.items(), promoted_name_count))
+
+
 class MapFileParserLld(object):
   """Parses a linker map file from LLD."""
   # Map file writer for LLD linker (for ELF):
@@ -332,6 +417,14 @@ class MapFileParserLld(object):
   _LINE_RE_V1 = re.compile(
       r'\s*[0-9a-f]+\s+([0-9a-f]+)\s+([0-9a-f]+)\s+(\d+) ( *)(.*)')
   _LINE_RE = [_LINE_RE_V0, _LINE_RE_V1]
+  # Matches a superset of lines that _LINE_RE matches as Level 1 (at most 7
+  # spaces of indent), but can be searched for across multiple lines.
+  _LEVEL1_CANDIDATE_RE_V0 = re.compile(
+      r'^[0-9a-f]+[^\S\n]+[0-9a-f]+[^\S\n]+\d+ {1,8}(?! )', re.M)
+  _LEVEL1_CANDIDATE_RE_V1 = re.compile(
+      r'^[^\S\n]*[0-9a-f]+[^\S\n]+[0-9a-f]+[^\S\n]+[0-9a-f]+[^\S\n]+'
+      r'\d+ {1,8}(?! )', re.M)
+  _LEVEL1_CANDIDATE_RE = [_LEVEL1_CANDIDATE_RE_V0, _LEVEL1_CANDIDATE_RE_V1]
 
   def __init__(self, linker_name):
     self._linker_name = linker_name
@@ -357,11 +450,24 @@ class MapFileParserLld(object):
       return True, None  # Is annotation, keep old |thumb2_mode| value.
     return False, None  # Not annotation, keep old |thumb2_mode| value.
 
+  def _MapFileVersion(self):
+    # Extract e.g., 'lld_v0' -> 0, or 'lld-lto_v1' -> 1.
+    return int(self._linker_name.split('_v')[1])
+
+  def _Level1CandidatePattern(self):
+    return MapFileParserLld._LEVEL1_CANDIDATE_RE[self._MapFileVersion()]
+
+  def _TokenizeLineAt(self, data, pos):
+    """Returns (level, tok) for the line of |data| at |pos|, or (None, None)."""
+    pattern = MapFileParserLld._LINE_RE[self._MapFileVersion()]
+    m = pattern.match(data, pos, _LineEnd(data, pos))
+    if m is None:
+      return None, None
+    return (len(m.group(4)) // 8) + 1, m.group(5)
+
   def Tokenize(self, lines):
     """Generator to filter and tokenize linker map lines."""
-    # Extract e.g., 'lld_v0' -> 0, or 'lld-lto_v1' -> 1.
-    map_file_version = int(self._linker_name.split('_v')[1])
-    pattern = MapFileParserLld._LINE_RE[map_file_version]
+    pattern = MapFileParserLld._LINE_RE[self._MapFileVersion()]
 
     # A Level 3 symbol can have |size == 0| in some situations (e.g., assembly
     # code symbols). To provided better size estimates in this case, the "span"
@@ -428,6 +534,124 @@ class MapFileParserLld(object):
     Returns:
       A tuple of (section_sizes, symbols).
     """
+    syms, thin_map, promoted_name_count = self._ParseLines(lines)
+    if promoted_name_count:
+      logging.info('Found %d promoted global names', promoted_name_count)
+    return self._section_sizes, syms, {'thin_map': thin_map}
+
+  def _FindChunks(self, data, start_pos, chunk_size):
+    """Splits |data| into chunks that can be parsed independently.
+
+    Chunks start at Level 1 lines, or at Level 2 lines within large sections.
+    Neither depends on the lines that precede it, aside from the name of the
+    containing section.
+
+    Returns:
+      A list of (start, end, section) tuples, where |section| is the name of
+      the section that the chunk starts within, or None if the chunk starts at
+      a Level 1 line.
+    """
+    range_starts = [start_pos]
+    while True:
+      pos = _LineEnd(data, range_starts[-1] + chunk_size - 1)
+      if pos >= len(data):
+        break
+      range_starts.append(pos)
+    range_ends = range_starts[1:] + [len(data)]
+    level1_lines = []
+    for encoded_lines in concurrent.BulkForkAndCall(
+        _FindLldLevel1Lines, zip(range_starts, range_ends), data=data,
+        linker_name=self._linker_name):
+      level1_lines.extend(marshal.loads(encoded_lines))
+    level1_lines.sort()
+
+    chunk_starts = [(start_pos, None)]
+    section_ends = [pos for pos, _ in level1_lines[1:]] + [len(data)]
+    for (section_start, section), section_end in zip(level1_lines,
+                                                     section_ends):
+      if section_start - chunk_starts[-1][0] >= chunk_size:
+        chunk_starts.append((section_start, None))
+      # Split large sections at Level 2 lines.
+      pos = chunk_starts[-1][0] + chunk_size
+      while pos < section_end:
+        pos = _LineEnd(data, pos - 1)
+        while pos < section_end and self._TokenizeLineAt(data, pos)[0] != 2:
+          pos = _LineEnd(data, pos)
+        if pos >= section_end:
+          break
+        chunk_starts.append((pos, section))
+        pos += chunk_size
+
+    chunk_ends = [pos for pos, _ in chunk_starts[1:]] + [len(data)]
+    return [(start, end, section)
+            for (start, section), end in zip(chunk_starts, chunk_ends)]
+
+  def ParseData(self, data, start_pos, chunk_size):
+    """Parses a linker map file by parsing chunks of it in parallel.
+
+    The result is identical to that of Parse().
+
+    Args:
+      data: Contents of the linker map file.
+      start_pos: Offset of the first line after the headers.
+      chunk_size: Approximate number of bytes to parse per job.
+
+    Returns:
+      A tuple of (section_sizes, symbols, extras).
+    """
+    chunks = self._FindChunks(data, start_pos, chunk_size)
+    logging.debug('Parsing linker map in %d chunks', len(chunks))
+    results = [None] * len(chunks)
+    arg_tuples = [(i,) + chunk for i, chunk in enumerate(chunks)]
+    for encoded_result in concurrent.BulkForkAndCall(
+        _ParseLldChunk, arg_tuples, data=data, linker_name=self._linker_name):
+      result = marshal.loads(encoded_result)
+      results[result[0]] = result[1:]
+
+    syms = []
+    thin_map = {}
+    promoted_name_count = 0
+    # Share strings between symbols as the sequential parser does.
+    strings = {}
+    for section_size_items, sym_tuples, thin_map_items, count in results:
+      self._section_sizes.update(section_size_items)
+      for (section_name, size, address, full_name, object_path,
+           flags) in sym_tuples:
+        section_name = strings.setdefault(section_name, section_name)
+        object_path = strings.setdefault(object_path, object_path)
+        syms.append(models.Symbol(section_name, size, address=address,
+                                  full_name=full_name, object_path=object_path,
+                                  flags=flags))
+      thin_map.update(thin_map_items)
+      promoted_name_count += count
+
+    if promoted_name_count:
+      logging.info('Found %d promoted global names', promoted_name_count)
+    return self._section_sizes, syms, {'thin_map': thin_map}
+
+  @staticmethod
+  def _SectionInfo(section):
+    """Returns a tuple of (mangled_start_idx, is_useful) for |section|."""
+    # E.g., Want to convert "(.text._name)" -> "_name" later.
+    mangled_start_idx = len(section) + 2
+    is_useful = (
+        section in (models.SECTION_BSS,
+                    models.SECTION_RODATA,
+                    models.SECTION_TEXT) or
+        section.startswith(models.SECTION_DATA))
+    return mangled_start_idx, is_useful
+
+  def _ParseLines(self, lines, cur_section=None):
+    """Parses linker map lines into symbols.
+
+    Args:
+      lines: Iterable of lines. The first line must be a Level 1 line unless
+          |cur_section| is given, in which case it must be a Level 2 line.
+      cur_section: Name of the section that |lines| start within.
+
+    Returns:
+      A tuple of (symbols, thin_map, promoted_name_count).
+    """
 # Newest format:
 #     VMA      LMA     Size Align Out     In      Symbol
 #     194      194       13     1 .interp
@@ -460,8 +684,9 @@ class MapFileParserLld(object):
 # 00000000002010ed 0000000000000071     1         a.o:(.text)
 # 00000000002010ed 0000000000000071     0                 main
     syms = []
-    cur_section = None
     cur_section_is_useful = False
+    if cur_section is not None:
+      mangled_start_idx, cur_section_is_useful = self._SectionInfo(cur_section)
     promoted_name_count = 0
     # |is_partial| indicates that an eligible Level 3 line should be used to
     # update |syms[-1].full_name| instead of creating a new symbol.
@@ -490,13 +715,7 @@ class MapFileParserLld(object):
         if not tok.startswith('PROVIDE_HIDDEN'):
           self._section_sizes[tok] = size
         cur_section = tok
-        # E.g., Want to convert "(.text._name)" -> "_name" later.
-        mangled_start_idx = len(cur_section) + 2
-        cur_section_is_useful = (
-            cur_section in (models.SECTION_BSS,
-                            models.SECTION_RODATA,
-                            models.SECTION_TEXT) or
-            cur_section.startswith(models.SECTION_DATA))
+        mangled_start_idx, cur_section_is_useful = self._SectionInfo(tok)
 
       elif cur_section_is_useful:
         # Level 2 data match the "In" column. They specify object paths and
@@ -593,9 +812,7 @@ class MapFileParserLld(object):
         else:
           logging.error('Problem line: %r', line)
 
-    if promoted_name_count:
-      logging.info('Found %d promoted global names', promoted_name_count)
-    return self._section_sizes, syms, {'thin_map': thin_map}
+    return syms, thin_map, promoted_name_count
 
 
 def _DetectLto(lines):
@@ -676,14 +893,47 @@ class MapFileParser(object):
       raise Exception('.map file is from a unsupported linker.')
 
     section_sizes, syms, extras = inner_parser.Parse(lines)
-    for sym in syms:
-      if sym.object_path and not sym.object_path.endswith(')'):
-        # Don't want '' to become '.'.
-        # Thin archives' paths will get fixed in |ar.CreateThinObjectPath|.
-        sym.object_path = os.path.normpath(sym.object_path)
+    _NormalizeObjectPaths(syms)
+    return (section_sizes, syms, extras)
+
+  def ParseFile(self, linker_name, path):
+    """Parses the linker map file at |path| (which may be gzipped).
+
+    Large LLD map files are parsed in parallel chunks (see
+    MapFileParserLld.ParseData()).
+
+    Args:
+      linker_name: Coded linker name to specify a linker.
+      path: Path to the linker map file.
+
+    Returns:
+      A tuple of (section_sizes, symbols, extras).
+    """
+    num_jobs = concurrent.MaxJobs()
+    if not linker_name.startswith('lld') or num_jobs < 2:
+      return self.Parse(linker_name, IterMapFileLines(path))
+
+    data = ReadMapFile(path)
+    start_pos = _LineEnd(data, 0)  # Skip the first line of headers.
+    if len(data) - start_pos < 2 * _MIN_CHUNK_SIZE:
+      return self.Parse(linker_name, io.BytesIO(data))
+
+    chunk_size = max(_MIN_CHUNK_SIZE, len(data) // (num_jobs * 4))
+    inner_parser = MapFileParserLld(linker_name)
+    section_sizes, syms, extras = inner_parser.ParseData(
+        data, start_pos, chunk_size)
+    _NormalizeObjectPaths(syms)
     return (section_sizes, syms, extras)
 
 
+def _NormalizeObjectPaths(syms):
+  for sym in syms:
+    if sym.object_path and not sym.object_path.endswith(')'):
+      # Don't want '' to become '.'.
+      # Thin archives' paths will get fixed in |ar.CreateThinObjectPath|.
+      sym.object_path = os.path.normpath(sym.object_path)
+
+
 def DeduceObjectPathsFromThinMap(raw_symbols, extras):
   """Uses Thin-LTO object paths to find object_paths of symbols. """
   thin_map = extras.get('thin_map', None)  # |address| -> |thin_obj|
@@ -753,12 +1003,11 @@ def main():
       level=logging.WARNING - args.verbose * 10,
       format='%(levelname).1s %(relativeCreated)6d %(message)s')
 
-  with open(args.linker_file, 'r') as map_file:
-    linker_name = DetectLinkerNameFromMapFile(map_file)
+  linker_name = DetectLinkerNameFromMapFile(IterMapFileLines(args.linker_file))
   print('Linker type: %s' % linker_name)
 
-  with open(args.linker_file, 'r') as map_file:
-    section_sizes, syms, extras = MapFileParser().Parse(linker_name, map_file)
+  section_sizes, syms, extras = MapFileParser().ParseFile(
+      linker_name, args.linker_file)
 
   if args.dump:
     print(section_sizes)
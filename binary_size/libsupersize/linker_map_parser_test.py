@@ -4,10 +4,14 @@
 # found in the LICENSE file.
 
 import glob
+import gzip
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
+import concurrent
 import linker_map_parser
 import test_util
 
@@ -103,6 +107,39 @@ class LinkerMapParserTest(unittest.TestCase):
                                          span is None else '%8X' % span, tok))
     return ret
 
+  def test_ParseFile_Parallel(self):
+    map_file = _ReadMapFile(_TEST_MAP_PATH)
+    linker_name = linker_map_parser.DetectLinkerNameFromMapFile(iter(map_file))
+    expected = linker_map_parser.MapFileParser().Parse(
+        linker_name, iter(map_file))
+
+    tmp_dir = tempfile.mkdtemp()
+    orig_min_chunk_size = linker_map_parser._MIN_CHUNK_SIZE
+    orig_read_block_size = linker_map_parser._READ_BLOCK_SIZE
+    try:
+      map_path = os.path.join(tmp_dir, 'test.map.gz')
+      with gzip.open(map_path, 'wb') as f:
+        f.writelines(map_file)
+      self.assertEquals(map_file,
+                        list(linker_map_parser.IterMapFileLines(map_path)))
+
+      # Use small chunks so that sections are split at Level 2 lines.
+      linker_map_parser._MIN_CHUNK_SIZE = 256
+      linker_map_parser._READ_BLOCK_SIZE = 100
+      concurrent.SetMaxJobs(4)
+      actual = linker_map_parser.MapFileParser().ParseFile(
+          linker_name, map_path)
+    finally:
+      linker_map_parser._MIN_CHUNK_SIZE = orig_min_chunk_size
+      linker_map_parser._READ_BLOCK_SIZE = orig_read_block_size
+      concurrent.SetMaxJobs(None)
+      shutil.rmtree(tmp_dir)
+
+    self.assertEquals(expected[0], actual[0])
+    self.assertEquals([repr(s) for s in expected[1]],
+                      [repr(s) for s in actual[1]])
+    self.assertEquals(expected[2], actual[2])
+
 
 def main():
   argv = sys.argv
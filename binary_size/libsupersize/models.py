@@ -28,7 +28,12 @@ Description of common properties:
         Never None, but will be '' when no component exists.
 """
 
+import array
+import bisect
 import collections
+import functools
+import inspect
+import itertools
 import logging
 import os
 import re
@@ -158,6 +163,84 @@ DIFF_COUNT_DELTA = [0, 0, 1, -1]
 STRING_LITERAL_NAME = 'string literal'
 
 
+# Maximum number of compiled Where*Matches() patterns to keep around.
+_MAX_COMPILED_PATTERNS = 100
+_compiled_patterns = {}
+
+
+def _CompilePattern(pattern):
+  """Returns the compiled regex for a Where*Matches() |pattern|."""
+  regex = _compiled_patterns.get(pattern)
+  if regex is None:
+    if len(_compiled_patterns) >= _MAX_COMPILED_PATTERNS:
+      _compiled_patterns.clear()
+    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
+    _compiled_patterns[pattern] = regex
+  return regex
+
+
+def _CachedSearch(regex):
+  """Returns a function that calls |regex|.search(), caching results by value.
+
+  Useful for attributes that are shared by many symbols (e.g. paths).
+  """
+  results = {}
+  def search(value):
+    ret = results.get(value)
+    if ret is None:
+      ret = bool(regex.search(value))
+      results[value] = ret
+    return ret
+  return search
+
+
+def _MatchesFunc(pattern):
+  """Returns a filter function that looks for |pattern| in paths & names."""
+  regex = _CompilePattern(pattern)
+  search_path = _CachedSearch(regex)
+  return lambda s: (
+      search_path(s.source_path) or
+      search_path(s.object_path) or
+      regex.search(s.full_name) or
+      s.full_name is not s.template_name and regex.search(s.template_name) or
+      s.full_name is not s.name and regex.search(s.name))
+
+
+def _CopyGroup(group):
+  """Returns a copy of |group| and its subgroups that shares their symbols."""
+  symbols = group._symbols
+  if isinstance(symbols, list):
+    symbols = [_CopyGroup(s) if s.IsGroup() else s for s in symbols]
+  return group._CreateTransformed(
+      symbols, filtered_symbols=group._filtered_symbols,
+      full_name=group.full_name, template_name=group.template_name,
+      name=group.name, section_name=group.section_name,
+      is_default_sorted=group.is_default_sorted)
+
+
+def _MemoizedGrouping(func):
+  """Decorator that caches the return value of a SymbolGroup.GroupedBy*().
+
+  Results are cached only for groups that have memoization enabled (see
+  BaseSizeInfo.EnableMemoization()). Callers get copies of the cached groups,
+  so that renaming them (e.g. with SetName()) does not affect later calls.
+  """
+  @functools.wraps(func)
+  def wrapper(self, *args, **kwargs):
+    memo = self._memo
+    if memo is None:
+      return func(self, *args, **kwargs)
+    call_args = inspect.getcallargs(func, self, *args, **kwargs)
+    del call_args['self']
+    key = (func.__name__, tuple(sorted(call_args.iteritems())))
+    ret = memo.get(key)
+    if ret is None:
+      ret = func(self, *args, **kwargs)
+      memo[key] = ret
+    return _CopyGroup(ret)
+  return wrapper
+
+
 class BaseSizeInfo(object):
   """Base class for SizeInfo and DeltaSizeInfo.
 
@@ -177,6 +260,7 @@ class BaseSizeInfo(object):
       '_symbols',
       '_native_symbols',
       '_pak_symbols',
+      '_memoize',
   )
 
   def __init__(self, section_sizes, raw_symbols, symbols=None):
@@ -187,33 +271,64 @@ class BaseSizeInfo(object):
     self._symbols = symbols
     self._native_symbols = None
     self._pak_symbols = None
+    self._memoize = False
+
+  def _MaybeMemoize(self, group):
+    if self._memoize:
+      group._EnableMemoization()
+    return group
 
   @property
   def symbols(self):
     if self._symbols is None:
       logging.debug('Clustering symbols')
-      self._symbols = self.raw_symbols._Clustered()
+      self._symbols = self._MaybeMemoize(self.raw_symbols._Clustered())
       logging.debug('Done clustering symbols')
     return self._symbols
 
   @symbols.setter
   def symbols(self, value):
-    self._symbols = value
+    self._symbols = self._MaybeMemoize(value)
 
   @property
   def native_symbols(self):
     if self._native_symbols is None:
       # Use self.symbols rather than raw_symbols here so that _Clustered()
       # is not performed twice (slow) if accessing both properties.
-      self._native_symbols = self.symbols.WhereIsNative()
+      self._native_symbols = self._MaybeMemoize(self.symbols.WhereIsNative())
     return self._native_symbols
 
   @property
   def pak_symbols(self):
     if self._pak_symbols is None:
-      self._pak_symbols = self.raw_symbols.WhereIsPak()
+      self._pak_symbols = self._MaybeMemoize(self.raw_symbols.WhereIsPak())
     return self._pak_symbols
 
+  def EnableMemoization(self):
+    """Caches groupings (e.g. GroupedByPath()) of this SizeInfo's symbols.
+
+    Applies to |raw_symbols|, |symbols|, |native_symbols| and |pak_symbols|.
+    Symbols must not be modified once this is called.
+    """
+    self._memoize = True
+    for group in (self.raw_symbols, self._symbols, self._native_symbols,
+                  self._pak_symbols):
+      if group is not None:
+        group._EnableMemoization()
+
+  def FindSymbolAt(self, address, section_name=None):
+    """Returns the first raw symbol that contains |address|, or None.
+
+    Uses an address index that is built on first use and kept for as long as
+    |raw_symbols| is not re-assigned.
+    """
+    return self.raw_symbols.FindSymbolAt(address, section_name=section_name)
+
+  def IterSymbolsInRange(self, start, end=None, section_name=None):
+    """Yields raw symbols with addresses in [start, end)."""
+    return self.raw_symbols.IterSymbolsInRange(
+        start, end=end, section_name=section_name)
+
 
 class SizeInfo(BaseSizeInfo):
   """Represents all size information for a single binary.
@@ -573,6 +688,8 @@ class SymbolGroup(BaseSymbol):
       '_pss',
       '_symbols',
       '_filtered_symbols',
+      '_address_index',
+      '_memo',
       'full_name',
       'template_name',
       'name',
@@ -589,6 +706,8 @@ class SymbolGroup(BaseSymbol):
     self._pss = None
     self._symbols = symbols
     self._filtered_symbols = filtered_symbols or []
+    self._address_index = None
+    self._memo = None
     self.full_name = full_name if full_name is not None else name
     self.template_name = template_name if template_name is not None else name
     self.name = name or ''
@@ -619,7 +738,7 @@ class SymbolGroup(BaseSymbol):
     if isinstance(key, slice):
       return self._CreateTransformed(self._symbols.__getitem__(key))
     if isinstance(key, basestring) or key > len(self._symbols):
-      found = self.WhereAddressInRange(key)
+      found = list(self.IterSymbolsInRange(key))
       if len(found) != 1:
         raise KeyError('%d symbols found at address %s.' % (len(found), key))
       return found[0]
@@ -818,43 +937,129 @@ class SymbolGroup(BaseSymbol):
     return self.Filter(lambda s: s.IsGeneratedByToolchain())
 
   def WhereFullNameMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
+    regex = _CompilePattern(pattern)
     return self.Filter(lambda s: regex.search(s.full_name))
 
   def WhereTemplateNameMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
+    regex = _CompilePattern(pattern)
     return self.Filter(lambda s: regex.search(s.template_name))
 
   def WhereNameMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
+    regex = _CompilePattern(pattern)
     return self.Filter(lambda s: regex.search(s.name))
 
   def WhereObjectPathMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
-    return self.Filter(lambda s: regex.search(s.object_path))
+    search = _CachedSearch(_CompilePattern(pattern))
+    return self.Filter(lambda s: search(s.object_path))
 
   def WhereSourcePathMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
-    return self.Filter(lambda s: regex.search(s.source_path))
+    search = _CachedSearch(_CompilePattern(pattern))
+    return self.Filter(lambda s: search(s.source_path))
 
   def WherePathMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
-    return self.Filter(lambda s: (regex.search(s.source_path) or
-                                  regex.search(s.object_path)))
+    search = _CachedSearch(_CompilePattern(pattern))
+    return self.Filter(lambda s: search(s.source_path) or search(s.object_path))
 
   def WhereComponentMatches(self, pattern):
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
-    return self.Filter(lambda s: regex.search(s.component))
+    search = _CachedSearch(_CompilePattern(pattern))
+    return self.Filter(lambda s: search(s.component))
 
   def WhereMatches(self, pattern):
     """Looks for |pattern| within all paths & names."""
-    regex = re.compile(match_util.ExpandRegexIdentifierPlaceholder(pattern))
-    return self.Filter(lambda s: (
-        regex.search(s.source_path) or
-        regex.search(s.object_path) or
-        regex.search(s.full_name) or
-        s.full_name is not s.template_name and regex.search(s.template_name) or
-        s.full_name is not s.name and regex.search(s.name)))
+    return self.Filter(_MatchesFunc(pattern))
+
+  def Query(self, filters):
+    """Applies several filters in a single pass over the symbols.
+
+    Example:
+        results = size_info.symbols.Query({
+            'blink': r'third_party/blink/',
+            'big': lambda s: s.size > 1024,
+        })
+        Print(results['blink'].Inverted())
+
+    Args:
+      filters: A dict of key -> filter, where a filter is either a function (as
+          for Filter()) or a pattern (as for WhereMatches()).
+
+    Returns:
+      A dict of key -> SymbolGroup, with each SymbolGroup being the same as
+      what Filter() or WhereMatches() would return.
+    """
+    keys = list(filters)
+    funcs = []
+    for key in keys:
+      func = filters[key]
+      if isinstance(func, basestring):
+        func = _MatchesFunc(func)
+      funcs.append(func)
+    results = [([], []) for _ in keys]
+    func_and_results = zip(funcs, results)
+    symbol = None
+    try:
+      for symbol in self:
+        for func, filtered_and_kept in func_and_results:
+          filtered_and_kept[int(bool(func(symbol)))].append(symbol)
+    except:
+      logging.warning('Query failed on symbol %r', symbol)
+      raise
+
+    return {
+        key: self._CreateTransformed(kept, filtered_symbols=filtered)
+        for key, (filtered, kept) in zip(keys, results)
+    }
+
+  def _GetAddressIndex(self):
+    if self._address_index is None:
+      symbols = self._symbols
+      self._address_index = _AddressIndex(
+          [s.section_name for s in symbols], [s.address for s in symbols],
+          [s.size_without_padding for s in symbols])
+    return self._address_index
+
+  def _CreateTransformedFromPositions(self, positions):
+    """Returns a group with the symbols at |positions| (ascending)."""
+    symbols = self._symbols
+    kept = [symbols[i] for i in positions]
+    kept_positions = set(positions)
+    filtered = [s for i, s in enumerate(symbols) if i not in kept_positions]
+    return self._CreateTransformed(kept, filtered_symbols=filtered)
+
+  def FindSymbolsAt(self, address, section_name=None):
+    """Returns the symbols whose [address, end_address) contains |address|.
+
+    Lookups use an index of symbols sorted by address, which is built on first
+    use. Symbols are assumed not to move after that.
+
+    Args:
+      address: An int or a hex string.
+      section_name: When set, only symbols within this section are considered.
+    """
+    if isinstance(address, basestring):
+      address = int(address, 16)
+    positions = self._GetAddressIndex().FindPositionsAt(address, section_name)
+    return [self._symbols[i] for i in positions]
+
+  def FindSymbolAt(self, address, section_name=None):
+    """Returns the first symbol that contains |address|, or None."""
+    found = self.FindSymbolsAt(address, section_name=section_name)
+    return found[0] if found else None
+
+  def IterSymbolsInRange(self, start, end=None, section_name=None):
+    """Yields symbols with addresses in [start, end), in group order.
+
+    Runs in O(log n + k) time (after the address index has been built).
+    Args may be ints or hex strings. Default value for |end| is |start| + 1.
+    """
+    if isinstance(start, basestring):
+      start = int(start, 16)
+    if isinstance(end, basestring):
+      end = int(end, 16)
+    if end is None:
+      end = start + 1
+    symbols = self._symbols
+    for i in self._GetAddressIndex().PositionsInRange(start, end, section_name):
+      yield symbols[i]
 
   def WhereAddressInRange(self, start, end=None):
     """Searches for addesses within [start, end).
@@ -863,9 +1068,12 @@ class SymbolGroup(BaseSymbol):
     """
     if isinstance(start, basestring):
       start = int(start, 16)
+    if isinstance(end, basestring):
+      end = int(end, 16)
     if end is None:
       end = start + 1
-    return self.Filter(lambda s: s.address >= start and s.address < end)
+    return self._CreateTransformedFromPositions(
+        self._GetAddressIndex().PositionsInRange(start, end))
 
   def WhereHasPath(self):
     return self.Filter(lambda s: s.source_path or s.object_path)
@@ -888,6 +1096,10 @@ class SymbolGroup(BaseSymbol):
         self._filtered_symbols, filtered_symbols=self._symbols,
         section_name=SECTION_MULTIPLE)
 
+  def _EnableMemoization(self):
+    if self._memo is None:
+      self._memo = {}
+
   def GroupedBy(self, func, min_count=0, group_factory=None):
     """Returns a SymbolGroup of SymbolGroups, indexed by |func|.
 
@@ -1028,12 +1240,15 @@ class SymbolGroup(BaseSymbol):
         lambda s: (same_name_only and s.full_name, id(s.aliases or s)),
         min_count=min_count, group_factory=group_factory)
 
+  @_MemoizedGrouping
   def GroupedBySectionName(self):
     return self.GroupedBy(lambda s: s.section_name)
 
+  @_MemoizedGrouping
   def GroupedByComponent(self):
     return self.GroupedBy(lambda s: s.component)
 
+  @_MemoizedGrouping
   def GroupedByFullName(self, min_count=2):
     """Groups by symbol.full_name.
 
@@ -1047,6 +1262,7 @@ class SymbolGroup(BaseSymbol):
     """
     return self.GroupedBy(lambda s: s.full_name, min_count=min_count)
 
+  @_MemoizedGrouping
   def GroupedByName(self, depth=0, min_count=0):
     """Groups by symbol.name, where |depth| controls how many ::s to include.
 
@@ -1072,6 +1288,7 @@ class SymbolGroup(BaseSymbol):
           lambda s: _ExtractSuffixAfterSeparator(s.name, '::', depth))
     return self.GroupedBy(extract_namespace, min_count=min_count)
 
+  @_MemoizedGrouping
   def GroupedByPath(self, depth=0, fallback='{no path}',
                     fallback_to_object_path=True, min_count=0):
     """Groups by source_path.
@@ -1106,6 +1323,518 @@ class SymbolGroup(BaseSymbol):
     return self.GroupedBy(extract_path, min_count=min_count)
 
 
+class _AddressIndex(object):
+  """Positions of symbols sorted by address, per section.
+
+  Supports bisect-based lookups in O(log n + k) time, where k is the number of
+  matches (provided that symbols within a section do not overlap much).
+  """
+  __slots__ = (
+      '_sections',
+  )
+
+  def __init__(self, section_names, addresses, sizes):
+    """Creates the index.
+
+    Args:
+      section_names, addresses, sizes: Per-symbol sequences. |sizes| do not
+          include padding.
+    """
+    positions_by_section = collections.defaultdict(list)
+    for i, section_name in enumerate(section_names):
+      positions_by_section[section_name].append(i)
+
+    # section_name -> (starts, ends, max_ends, positions), sorted by start
+    # address. max_ends[i] is the largest end address of symbols [0, i], which
+    # bounds how far back to look for symbols that contain an address.
+    self._sections = {}
+    for section_name, positions in positions_by_section.iteritems():
+      # sort() is stable, so symbols at the same address stay in group order.
+      positions.sort(key=addresses.__getitem__)
+      starts = [addresses[i] for i in positions]
+      # Treat empty symbols as 1 byte so that they can be found.
+      ends = [addresses[i] + max(sizes[i], 1) for i in positions]
+      max_ends = []
+      max_end = None
+      for end in ends:
+        if max_end is None or end > max_end:
+          max_end = end
+        max_ends.append(max_end)
+      self._sections[section_name] = (starts, ends, max_ends, positions)
+
+  def _IterSections(self, section_name):
+    if section_name is None:
+      return self._sections.itervalues()
+    entry = self._sections.get(section_name)
+    return (entry,) if entry else ()
+
+  def FindPositionsAt(self, address, section_name=None):
+    """Returns sorted positions of symbols that contain |address|."""
+    ret = []
+    for starts, ends, max_ends, positions in self._IterSections(section_name):
+      i = bisect.bisect_right(starts, address) - 1
+      while i >= 0 and max_ends[i] > address:
+        if ends[i] > address:
+          ret.append(positions[i])
+        i -= 1
+    ret.sort()
+    return ret
+
+  def PositionsInRange(self, start, end, section_name=None):
+    """Returns sorted positions of symbols with addresses in [start, end)."""
+    ret = []
+    for starts, _, _, positions in self._IterSections(section_name):
+      lo = bisect.bisect_left(starts, start)
+      hi = bisect.bisect_left(starts, end)
+      ret.extend(positions[lo:hi])
+    ret.sort()
+    return ret
+
+
+class SymbolColumns(object):
+  """Holds the fields of raw symbols as parallel arrays.
+
+  Symbol objects are created only when first accessed (and then cached), which
+  keeps SizeInfos loaded from .size files cheap when only part of them is used.
+  Symbols within an alias group are always created together.
+
+  Fields:
+    section_ranges: List of (section_name, start_idx, end_idx). Symbols are
+        grouped by section.
+    addresses, sizes, paddings, flags, path_indices, component_indices:
+        array.arrays with one entry per symbol. |sizes| include padding once
+        it has been calculated.
+    num_aliases: array.array where the first symbol of an alias group holds
+        the group's size, and all other entries are 0.
+    alias_starts: array.array holding the index of the first symbol of each
+        symbol's alias group (or the symbol's own index).
+    full_names: Sequence of full_names, as stored in the .size file.
+    path_tuples: List of (object_path, source_path).
+    components: List of components.
+    postprocess_func: When set, called with each newly created Symbol.
+  """
+  __slots__ = (
+      'section_ranges',
+      '_section_starts',
+      'addresses',
+      'sizes',
+      'paddings',
+      'flags',
+      'num_aliases',
+      'alias_starts',
+      'path_indices',
+      'component_indices',
+      'full_names',
+      'path_tuples',
+      'components',
+      'postprocess_func',
+      '_symbols',
+  )
+
+  def __init__(self, section_names, section_counts, addresses, sizes, flags,
+               num_aliases, path_indices, component_indices, full_names,
+               path_tuples, components):
+    self.section_ranges = []
+    start = 0
+    for section_name, count in zip(section_names, section_counts):
+      self.section_ranges.append((section_name, start, start + count))
+      start += count
+    self._section_starts = [r[1] for r in self.section_ranges]
+    self.addresses = addresses
+    self.sizes = sizes
+    self.paddings = array.array(sizes.typecode, [0]) * len(sizes)
+    self.flags = flags
+    self.num_aliases = num_aliases
+    self.path_indices = path_indices
+    self.component_indices = component_indices
+    self.full_names = full_names
+    self.path_tuples = path_tuples
+    self.components = components
+    self.postprocess_func = None
+    self._symbols = [None] * len(addresses)
+
+    self.alias_starts = array.array('l', xrange(len(addresses)))
+    for _, start, end in self.section_ranges:
+      alias_start = start
+      alias_end = start
+      for i in xrange(start, end):
+        count = num_aliases[i]
+        if count:
+          alias_start = i
+          alias_end = i + count
+        elif i < alias_end:
+          self.alias_starts[i] = alias_start
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def SectionNameAt(self, idx):
+    range_idx = bisect.bisect_right(self._section_starts, idx) - 1
+    return self.section_ranges[range_idx][0]
+
+  def GetSymbol(self, idx):
+    """Returns the Symbol at |idx|, creating it (and its aliases) if needed."""
+    ret = self._symbols[idx]
+    if ret is None:
+      start = self.alias_starts[idx]
+      count = self.num_aliases[start]
+      if count:
+        aliases = [self._CreateSymbol(i) for i in xrange(start, start + count)]
+        for i, symbol in enumerate(aliases):
+          symbol.aliases = aliases
+          self._FinishSymbol(start + i, symbol)
+      else:
+        self._FinishSymbol(idx, self._CreateSymbol(idx))
+      ret = self._symbols[idx]
+    return ret
+
+  def _CreateSymbol(self, idx):
+    full_name = self.full_names[idx]
+    # Use a bit less RAM by using the same instance for this common string.
+    if full_name == STRING_LITERAL_NAME:
+      full_name = STRING_LITERAL_NAME
+    # Skip the constructor to avoid default value checks
+    symbol = Symbol.__new__(Symbol)
+    symbol.section_name = self.SectionNameAt(idx)
+    symbol.full_name = full_name
+    symbol.address = self.addresses[idx]
+    symbol.size = self.sizes[idx]
+    symbol.padding = self.paddings[idx]
+    symbol.object_path, symbol.source_path = (
+        self.path_tuples[self.path_indices[idx]])
+    symbol.component = self.components[self.component_indices[idx]]
+    symbol.flags = self.flags[idx]
+    symbol.aliases = None
+    # Derived
+    symbol.template_name = ''
+    symbol.name = ''
+    return symbol
+
+  def _FinishSymbol(self, idx, symbol):
+    if self.postprocess_func:
+      self.postprocess_func(symbol)
+    self._symbols[idx] = symbol
+
+  def ComputeTotals(self, indices, include_bss):
+    """Returns (size, pss, padding) for the symbols at |indices|.
+
+    Matches the semantics of SymbolGroup.size, .pss, and .padding.
+    """
+    sizes = self.sizes
+    paddings = self.paddings
+    num_aliases = self.num_aliases
+    alias_starts = self.alias_starts
+    size = 0
+    pss = 0
+    padding = 0
+    seen_alias_starts = set()
+    for section_name, start, end in self.section_ranges:
+      lo = bisect.bisect_left(indices, start)
+      hi = bisect.bisect_left(indices, end)
+      counts_towards_size = include_bss or section_name != SECTION_BSS
+      for idx in indices[lo:hi]:
+        alias_start = alias_starts[idx]
+        count = num_aliases[alias_start] or 1
+        if alias_start == idx and count == 1:
+          is_unique = True
+        else:
+          is_unique = alias_start not in seen_alias_starts
+          seen_alias_starts.add(alias_start)
+        if is_unique:
+          padding += paddings[idx]
+        if counts_towards_size:
+          if is_unique:
+            size += sizes[idx]
+          pss += float(sizes[idx]) / count
+    return size, pss, padding
+
+  def PartitionBySection(self, indices, section_names):
+    """Returns (kept, filtered) index arrays for |section_names|."""
+    kept = array.array(indices.typecode)
+    filtered = array.array(indices.typecode)
+    for section_name, start, end in self.section_ranges:
+      lo = bisect.bisect_left(indices, start)
+      hi = bisect.bisect_left(indices, end)
+      target = kept if section_name in section_names else filtered
+      target.extend(indices[lo:hi])
+    return kept, filtered
+
+  def AllSymbols(self):
+    """Returns a ColumnarSymbolGroup for all symbols."""
+    return ColumnarSymbolGroup(
+        _LazySymbolList(self, array.array('l', xrange(len(self)))))
+
+
+class _LazySymbolList(object):
+  """A read-only list of the Symbols at |indices| within SymbolColumns.
+
+  |indices| must be in ascending order.
+  """
+  __slots__ = (
+      'columns',
+      'indices',
+  )
+
+  def __init__(self, columns, indices):
+    self.columns = columns
+    self.indices = indices
+
+  def __len__(self):
+    return len(self.indices)
+
+  def __iter__(self):
+    get_symbol = self.columns.GetSymbol
+    for idx in self.indices:
+      yield get_symbol(idx)
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      return list(self)[key]
+    return self.columns.GetSymbol(self.indices[key])
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __add__(self, other):
+    return list(self) + list(other)
+
+  def index(self, item):
+    return list(self).index(item)
+
+
+class ColumnarSymbolGroup(SymbolGroup):
+  """A SymbolGroup whose symbols are created from SymbolColumns on access.
+
+  Sums, section filters, and path / component filters and groupings are
+  computed directly from the columns, so they do not require creating Symbol
+  objects. Other operations create the symbols they touch, and return plain
+  SymbolGroups.
+  """
+  __slots__ = ()
+
+  @property
+  def columns(self):
+    return self._symbols.columns
+
+  def _CreateTransformed(self, symbols, filtered_symbols=None, full_name=None,
+                         template_name=None, name=None, section_name=None,
+                         is_default_sorted=None):
+    if is_default_sorted is None:
+      is_default_sorted = self.is_default_sorted
+    if section_name is None:
+      section_name = self.section_name
+    cls = ColumnarSymbolGroup
+    if not isinstance(symbols, _LazySymbolList):
+      cls = SymbolGroup
+    return cls(symbols, filtered_symbols=filtered_symbols,
+               full_name=full_name, template_name=template_name,
+               name=name, section_name=section_name,
+               is_default_sorted=is_default_sorted)
+
+  def _LazyList(self, indices):
+    return _LazySymbolList(self.columns, indices)
+
+  def _GetAddressIndex(self):
+    if self._address_index is None:
+      columns = self.columns
+      indices = self._symbols.indices
+      section_names = []
+      for section_name, start, end in columns.section_ranges:
+        count = (bisect.bisect_left(indices, end) -
+                 bisect.bisect_left(indices, start))
+        section_names.extend(itertools.repeat(section_name, count))
+      addresses = columns.addresses
+      sizes = columns.sizes
+      paddings = columns.paddings
+      self._address_index = _AddressIndex(
+          section_names, [addresses[i] for i in indices],
+          [sizes[i] - paddings[i] for i in indices])
+    return self._address_index
+
+  def _CreateTransformedFromPositions(self, positions):
+    indices = self._symbols.indices
+    kept = array.array(indices.typecode, (indices[i] for i in positions))
+    kept_positions = set(positions)
+    filtered = array.array(
+        indices.typecode,
+        (idx for i, idx in enumerate(indices) if i not in kept_positions))
+    return self._CreateTransformed(
+        self._LazyList(kept), filtered_symbols=self._LazyList(filtered))
+
+  def _ComputeTotals(self):
+    if self._size is None:
+      self._size, self._pss, self._padding = (
+          self.columns.ComputeTotals(
+              self._symbols.indices, self.IsBss()))
+
+  @property
+  def size(self):
+    self._ComputeTotals()
+    return self._size
+
+  @property
+  def pss(self):
+    self._ComputeTotals()
+    return self._pss
+
+  @property
+  def padding(self):
+    self._ComputeTotals()
+    return self._padding
+
+  def WhereInSection(self, section):
+    """|section| can be section_name ('.bss'), or section chars ('bdr')."""
+    columns = self.columns
+    if section.startswith('.'):
+      section_names = (section,)
+    else:
+      section_names = [n for n, _, _ in columns.section_ranges
+                       if SECTION_NAME_TO_SECTION[n] in section]
+    kept, filtered = columns.PartitionBySection(
+        self._symbols.indices, section_names)
+    ret = self._CreateTransformed(
+        self._LazyList(kept), filtered_symbols=self._LazyList(filtered))
+    if section.startswith('.'):
+      ret.section_name = section
+    elif section in SECTION_TO_SECTION_NAME:
+      ret.section_name = SECTION_TO_SECTION_NAME[section]
+    return ret
+
+  def _FilterByColumn(self, column, func):
+    """Same as Filter(), but with |func| called once per column value.
+
+    Args:
+      column: Per-symbol array of values (e.g. path indices).
+      func: Maps a value from |column| to whether to keep the symbol.
+    """
+    keep_by_value = {}
+    typecode = self._symbols.indices.typecode
+    kept = array.array(typecode)
+    filtered = array.array(typecode)
+    for idx in self._symbols.indices:
+      value = column[idx]
+      keep = keep_by_value.get(value)
+      if keep is None:
+        keep = bool(func(value))
+        keep_by_value[value] = keep
+      if keep:
+        kept.append(idx)
+      else:
+        filtered.append(idx)
+    return self._CreateTransformed(
+        self._LazyList(kept), filtered_symbols=self._LazyList(filtered))
+
+  def _FilterByPath(self, pattern, func):
+    regex = _CompilePattern(pattern)
+    path_tuples = self.columns.path_tuples
+    return self._FilterByColumn(
+        self.columns.path_indices,
+        lambda i: func(regex, *path_tuples[i]))
+
+  def WhereObjectPathMatches(self, pattern):
+    return self._FilterByPath(
+        pattern, lambda regex, object_path, _: regex.search(object_path))
+
+  def WhereSourcePathMatches(self, pattern):
+    return self._FilterByPath(
+        pattern, lambda regex, _, source_path: regex.search(source_path))
+
+  def WherePathMatches(self, pattern):
+    return self._FilterByPath(
+        pattern, lambda regex, object_path, source_path: (
+            regex.search(source_path) or regex.search(object_path)))
+
+  def WhereComponentMatches(self, pattern):
+    regex = _CompilePattern(pattern)
+    components = self.columns.components
+    return self._FilterByColumn(
+        self.columns.component_indices,
+        lambda i: regex.search(components[i]))
+
+  def _GroupedByColumn(self, column, token_func, min_count):
+    """Same as GroupedBy(), but with tokens computed per column value.
+
+    Args:
+      column: Per-symbol array of values (e.g. path indices).
+      token_func: Maps a value from |column| to a token (or None).
+      min_count: Same as for GroupedBy().
+    """
+    token_by_value = {}
+    indices_by_token = collections.OrderedDict()
+    filtered = array.array(self._symbols.indices.typecode)
+    for idx in self._symbols.indices:
+      value = column[idx]
+      token = token_by_value.get(value, token_by_value)
+      if token is token_by_value:
+        token = token_func(value)
+        token_by_value[value] = token
+      if token is None:
+        filtered.append(idx)
+      else:
+        token_indices = indices_by_token.get(token)
+        if token_indices is None:
+          token_indices = array.array(filtered.typecode)
+          indices_by_token[token] = token_indices
+        token_indices.append(idx)
+
+    after_syms = []
+    filtered_symbols = list(self._LazyList(filtered))
+    include_singles = min_count >= 0
+    min_count = abs(min_count)
+    for token, token_indices in indices_by_token.iteritems():
+      if len(token_indices) >= min_count:
+        after_syms.append(self._CreateTransformed(
+            self._LazyList(token_indices), full_name=token,
+            template_name=token, name=token))
+      else:
+        target_list = after_syms if include_singles else filtered_symbols
+        target_list.extend(self._LazyList(token_indices))
+
+    return self._CreateTransformed(
+        after_syms, filtered_symbols=filtered_symbols)
+
+  @_MemoizedGrouping
+  def GroupedBySectionName(self):
+    indices = self._symbols.indices
+    after_syms = []
+    for section_name, start, end in self.columns.section_ranges:
+      lo = bisect.bisect_left(indices, start)
+      hi = bisect.bisect_left(indices, end)
+      if lo != hi:
+        after_syms.append(self._CreateTransformed(
+            self._LazyList(indices[lo:hi]), full_name=section_name,
+            template_name=section_name, name=section_name))
+    return self._CreateTransformed(after_syms)
+
+  @_MemoizedGrouping
+  def GroupedByComponent(self):
+    columns = self.columns
+    return self._GroupedByColumn(
+        columns.component_indices, lambda i: columns.components[i], 0)
+
+  @_MemoizedGrouping
+  def GroupedByPath(self, depth=0, fallback='{no path}',
+                    fallback_to_object_path=True, min_count=0):
+    columns = self.columns
+    def extract_path(path_idx):
+      object_path, source_path = columns.path_tuples[path_idx]
+      path = source_path
+      if fallback_to_object_path and not path:
+        path = object_path
+      path = path or fallback
+      if path is None:
+        return None
+      # Group by base of foo/bar/{shared}/2
+      shared_idx = path.find('{shared}')
+      if shared_idx != -1:
+        path = path[:shared_idx + 8]
+      return _ExtractPrefixBeforeSeparator(path, os.path.sep, depth)
+    return self._GroupedByColumn(columns.path_indices, extract_path, min_count)
+
+
 class DeltaSymbolGroup(SymbolGroup):
   """A SymbolGroup subclass representing a diff of two other SymbolGroups.
 
@@ -41,13 +41,17 @@ import argparse
 import atexit
 import collections
 import errno
+import hashlib
 import logging
+import marshal
 import os
 import multiprocessing
 import Queue
 import signal
+import sqlite3
 import sys
 import threading
+import time
 import traceback
 
 import bcanalyzer
@@ -63,6 +67,13 @@ _MSG_ANALYZE_STRINGS = 3
 _MSG_GET_SYMBOL_NAMES = 4
 _MSG_GET_STRINGS = 5
 
+# Number of cached results to join into each string extraction job.
+_CACHED_RESULTS_BATCH_SIZE = 50
+# SQLite limits the number of parameters per statement (to 999 by default).
+_CACHE_LOOKUP_CHUNK_SIZE = 900
+# Seconds to wait for other processes holding the cache lock.
+_CACHE_TIMEOUT = 60
+
 _active_pids = None
 
 
@@ -81,6 +92,172 @@ def _MakeToolPrefixAbsolute(tool_prefix):
   return tool_prefix
 
 
+def _RunAndTime(runner, target, **kwargs):
+  """Returns (target, elapsed seconds, return value of runner())."""
+  start_time = time.time()
+  value = runner(target, **kwargs)
+  return target, time.time() - start_time, value
+
+
+def _JoinCachedResults(encoded_dicts):
+  """Joins encoded dicts from the cache into fewer, larger chunks."""
+  return [
+      concurrent.JoinEncodedDictOfLists(
+          encoded_dicts[i:i + _CACHED_RESULTS_BATCH_SIZE])
+      for i in xrange(0, len(encoded_dicts), _CACHED_RESULTS_BATCH_SIZE)
+  ]
+
+
+def _SplitByInput(target, value_by_path):
+  """Splits a runner's |value_by_path| into {input path: {path: value}}.
+
+  Args:
+    target: The runner's target: either a .a path, or a list of .o paths.
+  """
+  if isinstance(target, basestring):
+    # Paths are of the form foo/bar.a(baz.o).
+    return {target: value_by_path}
+  return {p: {p: value_by_path[p]} if p in value_by_path else {}
+          for p in target}
+
+
+class _ObjectFileCache(object):
+  """Stores per-object-file analysis results across runs.
+
+  Entries are keyed by path and the kind of analysis, and are valid only when
+  the object's size and mtime are unchanged. When |use_hash| is set, a hash of
+  the object's contents is compared instead of its mtime, so that objects that
+  are re-written with identical contents still hit. Entries of objects that no
+  longer exist are removed when the cache is opened.
+  """
+
+  def __init__(self, path, output_directory, use_hash=False):
+    self._output_directory = output_directory
+    self._use_hash = use_hash
+    self._fingerprints = {}
+    self._stats_by_kind = collections.defaultdict(lambda: [0, 0, 0.0])
+    # The worker is created on the main thread, but runs jobs on the slave's
+    # worker thread (one at a time).
+    self._conn = sqlite3.connect(path, timeout=_CACHE_TIMEOUT,
+                                 check_same_thread=False)
+    self._conn.text_factory = str
+    with self._conn:
+      self._conn.execute(
+          'CREATE TABLE IF NOT EXISTS objects ('
+          'path TEXT NOT NULL, kind TEXT NOT NULL, mtime REAL, size INTEGER, '
+          'hash TEXT, seconds REAL, data BLOB, PRIMARY KEY (path, kind))')
+    self._Prune()
+
+  def _Prune(self):
+    paths = [row[0] for row in
+             self._conn.execute('SELECT DISTINCT path FROM objects')]
+    missing_paths = [
+        p for p in paths
+        if not os.path.exists(os.path.join(self._output_directory, p))]
+    if not missing_paths:
+      return
+    logging.info('Removing %d deleted objects from object file cache',
+                 len(missing_paths))
+    with self._conn:
+      self._conn.executemany('DELETE FROM objects WHERE path = ?',
+                             ((p,) for p in missing_paths))
+    # Gives the disk space back.
+    self._conn.execute('VACUUM')
+
+  def _Fingerprint(self, path):
+    """Returns (mtime, size, hash) for |path|, or None if it does not exist."""
+    if path in self._fingerprints:
+      return self._fingerprints[path]
+    full_path = os.path.join(self._output_directory, path)
+    try:
+      st = os.stat(full_path)
+    except OSError:
+      ret = None
+    else:
+      digest = None
+      if self._use_hash:
+        md5 = hashlib.md5()
+        with open(full_path, 'rb') as f:
+          for chunk in iter(lambda: f.read(1 << 20), ''):
+            md5.update(chunk)
+        digest = md5.hexdigest()
+      ret = (st.st_mtime, st.st_size, digest)
+    self._fingerprints[path] = ret
+    return ret
+
+  def _IsValid(self, path, mtime, size, digest):
+    fingerprint = self._Fingerprint(path)
+    if fingerprint is None:
+      return False
+    cur_mtime, cur_size, cur_digest = fingerprint
+    if size != cur_size:
+      return False
+    if self._use_hash:
+      return digest == cur_digest
+    return mtime == cur_mtime
+
+  def Lookup(self, kind, paths):
+    """Returns (list of cached data, list of paths that were not cached)."""
+    rows_by_path = {}
+    try:
+      for i in xrange(0, len(paths), _CACHE_LOOKUP_CHUNK_SIZE):
+        chunk = paths[i:i + _CACHE_LOOKUP_CHUNK_SIZE]
+        query = ('SELECT path, mtime, size, hash, seconds, data FROM objects '
+                 'WHERE kind = ? AND path IN (%s)' % ','.join('?' * len(chunk)))
+        for row in self._conn.execute(query, [kind] + chunk):
+          rows_by_path[row[0]] = row[1:]
+    except sqlite3.Error as e:
+      logging.warning('Failed to read object file cache: %s', e)
+
+    hits = []
+    misses = []
+    stats = self._stats_by_kind[kind]
+    for path in paths:
+      row = rows_by_path.get(path)
+      if row and self._IsValid(path, *row[:3]):
+        hits.append(marshal.loads(str(row[4])))
+        stats[2] += row[3]
+      else:
+        misses.append(path)
+    stats[0] += len(hits)
+    stats[1] += len(paths)
+    return hits, misses
+
+  def Store(self, kind, entries):
+    """Stores results.
+
+    Args:
+      entries: An iterable of (path, seconds spent analyzing it, data), where
+          |data| is serializable with marshal.
+    """
+    rows = []
+    for path, seconds, data in entries:
+      fingerprint = self._Fingerprint(path)
+      if fingerprint is None:
+        continue
+      mtime, size, digest = fingerprint
+      rows.append((path, kind, mtime, size, digest, seconds,
+                   buffer(marshal.dumps(data))))
+    try:
+      with self._conn:
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    except sqlite3.Error as e:
+      logging.warning('Failed to write object file cache: %s', e)
+
+  def LogStats(self):
+    for kind, (num_hits, num_total, seconds) in sorted(
+        self._stats_by_kind.iteritems()):
+      if not num_total:
+        continue
+      logging.info('Object file cache (%s): %d/%d hits (%.0f%%), saved %.1fs',
+                   kind, num_hits, num_total,
+                   100.0 * num_hits / max(num_total, 1), seconds)
+
+  def Close(self):
+    self._conn.close()
+
+
 class _PathsByType:
   def __init__(self, arch, obj, bc):
     self.arch = arch
@@ -89,7 +266,8 @@ class _PathsByType:
 
 
 class _BulkObjectFileAnalyzerWorker(object):
-  def __init__(self, tool_prefix, output_directory, track_string_literals=True):
+  def __init__(self, tool_prefix, output_directory, track_string_literals=True,
+               cache_path=None, hash_objects=False):
     self._tool_prefix = _MakeToolPrefixAbsolute(tool_prefix)
     self._output_directory = output_directory
     self._track_string_literals = track_string_literals
@@ -97,6 +275,15 @@ class _BulkObjectFileAnalyzerWorker(object):
     self._paths_by_name = collections.defaultdict(list)
     self._encoded_string_addresses_by_path_chunks = []
     self._encoded_strings_by_path_chunks = []
+    # Reused across AnalyzePaths() calls to avoid fork()ing a pool per batch.
+    self._worker_pool = concurrent.WorkerPool(name='obj_analyzer')
+    self._cache = None
+    if cache_path:
+      try:
+        self._cache = _ObjectFileCache(cache_path, output_directory,
+                                       use_hash=hash_objects)
+      except sqlite3.Error as e:
+        logging.warning('Not using object file cache %s: %s', cache_path, e)
 
   def _ClassifyPaths(self, paths):
     """Classifies |paths| (.o and .a files) by file type into separate lists.
@@ -128,46 +315,99 @@ class _BulkObjectFileAnalyzerWorker(object):
     return [(paths[i:i + size],) for i in xrange(0, len(paths), size)]
 
   def _DoBulkFork(self, runner, batches):
+    """Yields (target, elapsed seconds, result) for each batch."""
     # Order of the jobs doesn't matter since each job owns independent paths,
     # and our output is a dict where paths are the key.
-    return concurrent.BulkForkAndCall(
-        runner, batches, tool_prefix=self._tool_prefix,
-        output_directory=self._output_directory)
+    return self._worker_pool.Map(
+        _RunAndTime, [(runner,) + b for b in batches],
+        tool_prefix=self._tool_prefix, output_directory=self._output_directory)
+
+  def _LookupCache(self, kind, paths):
+    """Returns (list of cached results, list of paths to analyze)."""
+    if not self._cache:
+      return [], paths
+    return self._cache.Lookup(kind, paths)
+
+  def _AddNmResult(self, encoded_syms, encoded_strs):
+    """Adds results of RunNmOnIntermediates(). Names are still mangled."""
+    all_paths_by_name = self._paths_by_name
+    symbol_names_by_path = concurrent.DecodeDictOfLists(encoded_syms)
+    for path, names in symbol_names_by_path.iteritems():
+      for name in names:
+        all_paths_by_name[name].append(path)
+
+    if encoded_strs != concurrent.EMPTY_ENCODED_DICT:
+      self._encoded_string_addresses_by_path_chunks.append(encoded_strs)
+    return symbol_names_by_path
 
   def _RunNm(self, paths_by_type):
     """Calls nm to get symbols and (for non-BC files) string addresses."""
+    cached_arch, arch_paths = self._LookupCache('nm', paths_by_type.arch)
+    cached_obj, obj_paths = self._LookupCache(
+        'nm', paths_by_type.obj + paths_by_type.bc)
     # Downstream functions rely upon .a not being grouped.
-    batches = self._MakeBatches(paths_by_type.arch, None)
+    batches = self._MakeBatches(arch_paths, None)
     # Combine object files and Bitcode files for nm.
     BATCH_SIZE = 50  # Arbitrarily chosen.
-    batches.extend(
-        self._MakeBatches(paths_by_type.obj + paths_by_type.bc, BATCH_SIZE))
+    batches.extend(self._MakeBatches(obj_paths, BATCH_SIZE))
     results = self._DoBulkFork(nm.RunNmOnIntermediates, batches)
 
-    # Names are still mangled.
-    all_paths_by_name = self._paths_by_name
     total_no_symbols = 0
-    for encoded_syms, encoded_strs, num_no_symbols in results:
+    new_cache_entries = []
+    for target, elapsed, result in results:
+      encoded_syms, encoded_strs, num_no_symbols = result
       total_no_symbols += num_no_symbols
-      symbol_names_by_path = concurrent.DecodeDictOfLists(encoded_syms)
-      for path, names in symbol_names_by_path.iteritems():
-        for name in names:
-          all_paths_by_name[name].append(path)
-
-      if encoded_strs != concurrent.EMPTY_ENCODED_DICT:
-        self._encoded_string_addresses_by_path_chunks.append(encoded_strs)
+      symbol_names_by_path = self._AddNmResult(encoded_syms, encoded_strs)
+      if self._cache:
+        syms_by_input = _SplitByInput(target, symbol_names_by_path)
+        strs_by_input = _SplitByInput(
+            target, concurrent.DecodeDictOfLists(encoded_strs))
+        seconds = elapsed / len(syms_by_input)
+        for path, syms in syms_by_input.iteritems():
+          new_cache_entries.append((path, seconds, (
+              concurrent.EncodeDictOfLists(syms),
+              concurrent.EncodeDictOfLists(strs_by_input[path]))))
+
+    cached = cached_arch + cached_obj
+    if cached:
+      for encoded_syms, encoded_strs in cached:
+        encoded_keys = encoded_syms[0]
+        if encoded_keys and not encoded_syms[1]:
+          # A single path with no symbols.
+          total_no_symbols += 1
+      encoded_syms = concurrent.JoinEncodedDictOfLists([c[0] for c in cached])
+      self._AddNmResult(encoded_syms, concurrent.EMPTY_ENCODED_DICT)
+      self._encoded_string_addresses_by_path_chunks.extend(
+          _JoinCachedResults([c[1] for c in cached if c[1][0]]))
+    if new_cache_entries:
+      self._cache.Store('nm', new_cache_entries)
     if total_no_symbols:
       logging.warn('nm found no symbols in %d objects.', total_no_symbols)
 
   def _RunLlvmBcAnalyzer(self, paths_by_type):
     """Calls llvm-bcanalyzer to extract string data (for LLD-LTO)."""
+    cached, bc_paths = self._LookupCache('bcanalyzer', paths_by_type.bc)
     BATCH_SIZE = 50  # Arbitrarily chosen.
-    batches = self._MakeBatches(paths_by_type.bc, BATCH_SIZE)
+    batches = self._MakeBatches(bc_paths, BATCH_SIZE)
     results = self._DoBulkFork(
         bcanalyzer.RunBcAnalyzerOnIntermediates, batches)
-    for encoded_strs in results:
+    new_cache_entries = []
+    for target, elapsed, encoded_strs in results:
       if encoded_strs != concurrent.EMPTY_ENCODED_DICT:
         self._encoded_strings_by_path_chunks.append(encoded_strs);
+      if self._cache:
+        # Values are repr()'ed strings, which are kept as-is.
+        strs_by_input = _SplitByInput(
+            target, concurrent.DecodeDictOfLists(encoded_strs))
+        seconds = elapsed / len(strs_by_input)
+        new_cache_entries.extend(
+            (path, seconds, concurrent.EncodeDictOfLists(strs))
+            for path, strs in strs_by_input.iteritems())
+
+    self._encoded_strings_by_path_chunks.extend(
+        _JoinCachedResults([c for c in cached if c[0]]))
+    if new_cache_entries:
+      self._cache.Store('bcanalyzer', new_cache_entries)
 
   def AnalyzePaths(self, paths):
     logging.debug('worker: AnalyzePaths() started.')
@@ -181,6 +421,9 @@ class _BulkObjectFileAnalyzerWorker(object):
     logging.debug('worker: AnalyzePaths() completed.')
 
   def SortPaths(self):
+    if self._cache:
+      # All AnalyzePaths() calls have completed by now.
+      self._cache.LogStats()
     # Demangle all names, which can result in some merging of lists.
     self._paths_by_name = demangle.DemangleKeysAndMergeLists(
         self._paths_by_name, self._tool_prefix)
@@ -247,7 +490,10 @@ class _BulkObjectFileAnalyzerWorker(object):
     return self._list_of_encoded_elf_string_ranges_by_path
 
   def Close(self):
-    pass
+    self._worker_pool.Close()
+    if self._cache:
+      self._cache.Close()
+      self._cache = None
 
 
 def _TerminateSubprocesses():
@@ -260,10 +506,13 @@ def _TerminateSubprocesses():
 
 class _BulkObjectFileAnalyzerMaster(object):
   """Runs BulkObjectFileAnalyzer in a subprocess."""
-  def __init__(self, tool_prefix, output_directory, track_string_literals=True):
+  def __init__(self, tool_prefix, output_directory, track_string_literals=True,
+               cache_path=None, hash_objects=False):
     self._tool_prefix = tool_prefix
     self._output_directory = output_directory
     self._track_string_literals = track_string_literals
+    self._cache_path = cache_path
+    self._hash_objects = hash_objects
     self._child_pid = None
     self._pipe = None
 
@@ -284,7 +533,8 @@ class _BulkObjectFileAnalyzerMaster(object):
           'obj_analyzer: %(levelname).1s %(relativeCreated)6d %(message)s'))
       worker_analyzer = _BulkObjectFileAnalyzerWorker(
           self._tool_prefix, self._output_directory,
-          track_string_literals=self._track_string_literals)
+          track_string_literals=self._track_string_literals,
+          cache_path=self._cache_path, hash_objects=self._hash_objects)
       slave = _BulkObjectFileAnalyzerSlave(worker_analyzer, child_conn)
       slave.Run()
 
@@ -388,7 +638,8 @@ class _BulkObjectFileAnalyzerSlave(object):
       while True:
         self._HandleMessage(self._pipe.recv())
     except EOFError:
-      pass
+      self._job_queue.put(self._worker_analyzer.Close)
+      self._job_queue.join()
     except EnvironmentError, e:
       # Parent process exited so don't log.
       if e.errno in (errno.EPIPE, errno.ECONNRESET):
@@ -517,6 +517,33 @@ class TreeBuilder {
   }
 }
 
+/**
+ * Returns true if |bytes| starts with the gzip magic number.
+ * @param {Uint8Array} bytes
+ */
+function isGzipped(bytes) {
+  return bytes.length >= 2 && bytes[0] === 0x1f && bytes[1] === 0x8b;
+}
+
+/**
+ * Reports can be written as .ndjson.gz. When they are not served with a
+ * Content-Encoding header, the browser passes the gzipped bytes through as-is,
+ * so sniff the first chunk and decompress while streaming if needed.
+ * @param {ReadableStream} stream
+ * @returns {Promise<ReadableStream>}
+ */
+async function maybeGunzipStream(stream) {
+  if (typeof DecompressionStream !== 'function') return stream;
+  const [peekStream, bodyStream] = stream.tee();
+  const peekReader = peekStream.getReader();
+  const {value} = await peekReader.read();
+  peekReader.cancel();
+  if (value && isGzipped(new Uint8Array(value))) {
+    return bodyStream.pipeThrough(new DecompressionStream('gzip'));
+  }
+  return bodyStream;
+}
+
 /**
  * Wrapper around fetch for requesting the same resource multiple times.
  */
@@ -574,7 +601,7 @@ class DataFetcher {
     // of waiting for the entire data file to download. The file can be >100 MB,
     // so streams ensure slow connections still see some data.
     if (response.body) {
-      const reader = response.body.getReader();
+      const reader = (await maybeGunzipStream(response.body)).getReader();
 
       /** @type {Uint8Array[]} Store received bytes to merge later */
       let buffer = [];
@@ -602,6 +629,12 @@ class DataFetcher {
     } else {
       // In-memory version for browsers without stream support
       result = new Uint8Array(await response.arrayBuffer());
+      if (isGzipped(result) && typeof DecompressionStream === 'function') {
+        const stream = new Blob([result]).stream();
+        result = new Uint8Array(
+          await new Response(await maybeGunzipStream(stream)).arrayBuffer()
+        );
+      }
       yield result;
     }
 
@@ -70,14 +70,17 @@ from __future__ import print_function
 import sys
 
 import argparse
+import contextlib
 import json
 import logging
 import multiprocessing
+from multiprocessing import pool as mp_pool
 import os
 import re
 import shlex
 import shutil
 import subprocess
+import time
 import urllib2
 
 sys.path.append(
@@ -138,6 +141,16 @@ _BUILD_ARGS = None
 # Retry failed merges.
 MERGE_RETRIES = 3
 
+# Maximum number of profdata files combined by a single "llvm-profdata merge"
+# when merging per-target profdata files into the coverage profdata file.
+MERGE_FAN_IN = 8
+
+# Number of bytes copied at once from the output of "llvm-cov export".
+_SUMMARY_COPY_CHUNK_SIZE = 1 << 20
+
+# (stage name, seconds) for each stage that was run, see _TimedStage.
+_STAGE_TIMINGS = []
+
 # Message to guide user to file a bug when everything else fails.
 FILE_BUG_MESSAGE = (
     'If it persists, please file a bug with the command you used, git revision '
@@ -149,6 +162,30 @@ FILE_BUG_MESSAGE = (
 LLVM_PROFILE_FILE_PATH_SUBSTITUTION = '<llvm_profile_file_path>'
 
 
+@contextlib.contextmanager
+def _TimedStage(name):
+  """Logs and records how long the enclosed stage took."""
+  start_time = time.time()
+  try:
+    yield
+  finally:
+    elapsed = time.time() - start_time
+    _STAGE_TIMINGS.append((name, elapsed))
+    logging.info('Stage "%s" took %.1fs.', name, elapsed)
+
+
+def _LogStageTimings():
+  """Logs a summary of the time spent in each stage."""
+  if not _STAGE_TIMINGS:
+    return
+  name_width = max(len(name) for name, _ in _STAGE_TIMINGS)
+  lines = ['%-*s %8.1fs' % (name_width, name, elapsed)
+           for name, elapsed in _STAGE_TIMINGS]
+  lines.append('%-*s %8.1fs' % (name_width, 'Total',
+                                sum(elapsed for _, elapsed in _STAGE_TIMINGS)))
+  logging.info('Stage timings:\n%s', '\n'.join(lines))
+
+
 def _ConfigureLLVMCoverageTools(args):
   """Configures llvm coverage tools."""
   if args.coverage_tools_dir:
@@ -249,7 +286,10 @@ def _GetSummaryFilePath():
       SUMMARY_FILE_NAME)
 
 
-def _CreateCoverageProfileDataForTargets(targets, commands, jobs_count=None):
+def _CreateCoverageProfileDataForTargets(targets,
+                                         commands,
+                                         jobs_count=None,
+                                         test_jobs_count=1):
   """Builds and runs target to generate the coverage profile data.
 
   Args:
@@ -257,16 +297,20 @@ def _CreateCoverageProfileDataForTargets(targets, commands, jobs_count=None):
     commands: A list of commands used to run the targets.
     jobs_count: Number of jobs to run in parallel for building. If None, a
                 default value is derived based on CPUs availability.
+    test_jobs_count: Number of test commands to run in parallel.
 
   Returns:
     A relative path to the generated profdata file.
   """
-  _BuildTargets(targets, jobs_count)
-  target_profdata_file_paths = _GetTargetProfDataPathsByExecutingCommands(
-      targets, commands)
-  coverage_profdata_file_path = (
-      _CreateCoverageProfileDataFromTargetProfDataFiles(
-          target_profdata_file_paths))
+  with _TimedStage('Build targets'):
+    _BuildTargets(targets, jobs_count)
+  with _TimedStage('Run tests and merge profraw files'):
+    target_profdata_file_paths = _GetTargetProfDataPathsByExecutingCommands(
+        targets, commands, test_jobs_count)
+  with _TimedStage('Merge target profdata files'):
+    coverage_profdata_file_path = (
+        _CreateCoverageProfileDataFromTargetProfDataFiles(
+            target_profdata_file_paths))
 
   for target_profdata_file_path in target_profdata_file_paths:
     os.remove(target_profdata_file_path)
@@ -295,12 +339,17 @@ def _BuildTargets(targets, jobs_count):
   logging.debug('Finished building %s.', str(targets))
 
 
-def _GetTargetProfDataPathsByExecutingCommands(targets, commands):
+def _GetTargetProfDataPathsByExecutingCommands(targets, commands, jobs_count=1):
   """Runs commands and returns the relative paths to the profraw data files.
 
+  Up to |jobs_count| commands are run at the same time. The profraw files of
+  each target are merged into a target profdata file as soon as its command
+  finishes, while other commands are still running.
+
   Args:
     targets: A list of targets built with coverage instrumentation.
     commands: A list of commands used to run the targets.
+    jobs_count: Number of commands to run in parallel.
 
   Returns:
     A list of relative paths to the generated profraw data files.
@@ -317,66 +366,103 @@ def _GetTargetProfDataPathsByExecutingCommands(targets, commands):
   if not os.path.exists(_GetLogsDirectoryPath()):
     os.makedirs(_GetLogsDirectoryPath())
 
-  profdata_file_paths = []
-
-  # Run all test targets to generate profraw data files.
-  for target, command in zip(targets, commands):
-    output_file_name = os.extsep.join([target + '_output', 'log'])
-    output_file_path = os.path.join(_GetLogsDirectoryPath(), output_file_name)
-
-    profdata_file_path = None
-    for _ in xrange(MERGE_RETRIES):
-      logging.info('Running command: "%s", the output is redirected to "%s".',
-                   command, output_file_path)
-
-      if _IsIOSCommand(command):
-        # On iOS platform, due to lack of write permissions, profraw files are
-        # generated outside of the OUTPUT_DIR, and the exact paths are contained
-        # in the output of the command execution.
-        output = _ExecuteIOSCommand(command, output_file_path)
-      else:
-        # On other platforms, profraw files are generated inside the OUTPUT_DIR.
-        output = _ExecuteCommand(target, command, output_file_path)
-
-      profraw_file_paths = []
-      if _IsIOS():
-        profraw_file_paths = [_GetProfrawDataFileByParsingOutput(output)]
-      else:
-        for file_or_dir in os.listdir(report_root_dir):
-          if file_or_dir.endswith(PROFRAW_FILE_EXTENSION):
-            profraw_file_paths.append(
-                os.path.join(report_root_dir, file_or_dir))
-
-      assert profraw_file_paths, (
-          'Running target "%s" failed to generate any profraw data file, '
-          'please make sure the binary exists, is properly instrumented and '
-          'does not crash. %s' % (target, FILE_BUG_MESSAGE))
-
-      assert isinstance(profraw_file_paths, list), (
-          'Variable \'profraw_file_paths\' is expected to be of type \'list\', '
-          'but it is a %s. %s' % (type(profraw_file_paths), FILE_BUG_MESSAGE))
-
-      try:
-        profdata_file_path = _CreateTargetProfDataFileFromProfRawFiles(
-            target, profraw_file_paths)
-        break
-      except Exception:
-        logging.info('Retrying...')
-      finally:
-        # Remove profraw files now so that they are not used in next iteration.
-        for profraw_file_path in profraw_file_paths:
-          os.remove(profraw_file_path)
-
-    assert profdata_file_path, (
-        'Failed to merge target "%s" profraw files after %d retries. %s' %
-        (target, MERGE_RETRIES, FILE_BUG_MESSAGE))
-    profdata_file_paths.append(profdata_file_path)
+  # On iOS, all commands write their profraw data file to the same location.
+  if _IsIOS() and jobs_count > 1:
+    logging.warning('Running test commands one at a time on iOS.')
+    jobs_count = 1
+
+  # The profraw, profdata and log files of a command are named after its
+  # target, so commands of the same target must not run at the same time.
+  assert jobs_count <= 1 or len(set(targets)) == len(targets), (
+      'Targets must be unique to run test commands in parallel, got %s. '
+      'Please use --test-jobs=1.' % targets)
+
+  if jobs_count <= 1:
+    profdata_file_paths = [
+        _RunCommandAndCreateTargetProfDataFile(target, command)
+        for target, command in zip(targets, commands)
+    ]
+  else:
+    pool = mp_pool.ThreadPool(min(jobs_count, len(targets)))
+    try:
+      profdata_file_paths = pool.map(
+          lambda args: _RunCommandAndCreateTargetProfDataFile(*args),
+          zip(targets, commands))
+    finally:
+      pool.close()
+      pool.join()
 
   logging.debug('Finished executing the test commands.')
 
   return profdata_file_paths
 
 
+def _RunCommandAndCreateTargetProfDataFile(target, command):
+  """Runs the command of a target and merges its profraw data files.
+
+  Returns:
+    A relative path to the target profdata file.
+  """
+  report_root_dir = coverage_utils.GetCoverageReportRootDirPath(OUTPUT_DIR)
+  output_file_name = os.extsep.join([target + '_output', 'log'])
+  output_file_path = os.path.join(_GetLogsDirectoryPath(), output_file_name)
+
+  profdata_file_path = None
+  for _ in xrange(MERGE_RETRIES):
+    logging.info('Running command: "%s", the output is redirected to "%s".',
+                 command, output_file_path)
+
+    start_time = time.time()
+    if _IsIOSCommand(command):
+      # On iOS platform, due to lack of write permissions, profraw files are
+      # generated outside of the OUTPUT_DIR, and the exact paths are contained
+      # in the output of the command execution.
+      output = _ExecuteIOSCommand(command, output_file_path)
+    else:
+      # On other platforms, profraw files are generated inside the OUTPUT_DIR.
+      output = _ExecuteCommand(target, command, output_file_path)
+    run_time = time.time() - start_time
+
+    profraw_file_paths = []
+    if _IsIOS():
+      profraw_file_paths = [_GetProfrawDataFileByParsingOutput(output)]
+    else:
+      # Only pick up the files of this target, other commands may be running.
+      profraw_file_prefix = target + os.extsep
+      for file_or_dir in os.listdir(report_root_dir):
+        if (file_or_dir.startswith(profraw_file_prefix) and
+            file_or_dir.endswith(PROFRAW_FILE_EXTENSION)):
+          profraw_file_paths.append(os.path.join(report_root_dir, file_or_dir))
+
+    assert profraw_file_paths, (
+        'Running target "%s" failed to generate any profraw data file, '
+        'please make sure the binary exists, is properly instrumented and '
+        'does not crash. %s' % (target, FILE_BUG_MESSAGE))
+
+    assert isinstance(profraw_file_paths, list), (
+        'Variable \'profraw_file_paths\' is expected to be of type \'list\', '
+        'but it is a %s. %s' % (type(profraw_file_paths), FILE_BUG_MESSAGE))
+
+    start_time = time.time()
+    try:
+      profdata_file_path = _CreateTargetProfDataFileFromProfRawFiles(
+          target, profraw_file_paths)
+      logging.info('Target "%s" ran in %.1fs, merged in %.1fs.', target,
+                   run_time, time.time() - start_time)
+      break
+    except Exception:
+      logging.info('Retrying...')
+    finally:
+      # Remove profraw files now so that they are not used in next iteration.
+      for profraw_file_path in profraw_file_paths:
+        os.remove(profraw_file_path)
+
+  assert profdata_file_path, (
+      'Failed to merge target "%s" profraw files after %d retries. %s' %
+      (target, MERGE_RETRIES, FILE_BUG_MESSAGE))
+  return profdata_file_path
+
+
 def _GetEnvironmentVars(profraw_file_path):
   """Return environment vars for subprocess, given a profraw file path."""
   env = os.environ.copy()
@@ -496,13 +582,35 @@ def _GetProfrawDataFileByParsingOutput(output):
                  'Please refer to base/test/test_support_ios.mm for example.')
 
 
-def _CreateCoverageProfileDataFromTargetProfDataFiles(profdata_file_paths):
+def _MergeProfileDataFiles(input_file_paths, output_file_path):
+  """Merges profraw or profdata files into a profdata file.
+
+  Raises:
+    CalledProcessError: An error occurred merging the files.
+  """
+  subprocess_cmd = [
+      LLVM_PROFDATA_PATH, 'merge', '-o', output_file_path, '-sparse=true'
+  ]
+  subprocess_cmd.extend(input_file_paths)
+
+  output = subprocess.check_output(subprocess_cmd)
+  logging.debug('Merge output: %s', output)
+
+
+def _CreateCoverageProfileDataFromTargetProfDataFiles(profdata_file_paths,
+                                                      jobs_count=None):
   """Returns a relative path to coverage profdata file by merging target
   profdata files.
 
+  The files are merged as a balanced tree: groups of up to MERGE_FAN_IN files
+  are merged in parallel into intermediate files, level after level, which
+  spreads the work over |jobs_count| processes instead of a single merge.
+
   Args:
     profdata_file_paths: A list of relative paths to the profdata data files
                          that are to be merged.
+    jobs_count: Number of merges to run in parallel. If None, the number of
+                CPUs is used.
 
   Returns:
     A relative path to the merged coverage profdata file.
@@ -513,19 +621,43 @@ def _CreateCoverageProfileDataFromTargetProfDataFiles(profdata_file_paths):
   logging.info('Creating the coverage profile data file.')
   logging.debug('Merging target profraw files to create target profdata file.')
   profdata_file_path = _GetProfdataFilePath()
+  report_root_dir = coverage_utils.GetCoverageReportRootDirPath(OUTPUT_DIR)
+  pool = mp_pool.ThreadPool(jobs_count or multiprocessing.cpu_count())
+  intermediate_file_paths = []
   try:
-    subprocess_cmd = [
-        LLVM_PROFDATA_PATH, 'merge', '-o', profdata_file_path, '-sparse=true'
-    ]
-    subprocess_cmd.extend(profdata_file_paths)
-
-    output = subprocess.check_output(subprocess_cmd)
-    logging.debug('Merge output: %s', output)
+    input_file_paths = profdata_file_paths
+    level = 0
+    while len(input_file_paths) > MERGE_FAN_IN:
+      merges = []
+      next_input_file_paths = []
+      for i in xrange(0, len(input_file_paths), MERGE_FAN_IN):
+        group = input_file_paths[i:i + MERGE_FAN_IN]
+        if len(group) == 1:
+          next_input_file_paths.append(group[0])
+          continue
+        output_file_path = os.path.join(
+            report_root_dir, 'merge.%d.%d.profdata' % (level, len(merges)))
+        merges.append((group, output_file_path))
+        next_input_file_paths.append(output_file_path)
+      logging.debug('Merging %d profdata files into %d files.',
+                    len(input_file_paths), len(next_input_file_paths))
+      intermediate_file_paths.extend(path for _, path in merges)
+      pool.map(lambda args: _MergeProfileDataFiles(*args), merges)
+      input_file_paths = next_input_file_paths
+      level += 1
+
+    _MergeProfileDataFiles(input_file_paths, profdata_file_path)
   except subprocess.CalledProcessError as error:
     logging.error(
         'Failed to merge target profdata files to create coverage profdata. %s',
         FILE_BUG_MESSAGE)
     raise error
+  finally:
+    pool.close()
+    pool.join()
+    for intermediate_file_path in intermediate_file_paths:
+      if os.path.exists(intermediate_file_path):
+        os.remove(intermediate_file_path)
 
   logging.debug('Finished merging target profdata files.')
   logging.info('Code coverage profile data is created as: "%s".',
@@ -552,13 +684,7 @@ def _CreateTargetProfDataFileFromProfRawFiles(target, profraw_file_paths):
   profdata_file_path = os.path.join(OUTPUT_DIR, '%s.profdata' % target)
 
   try:
-    subprocess_cmd = [
-        LLVM_PROFDATA_PATH, 'merge', '-o', profdata_file_path, '-sparse=true'
-    ]
-    subprocess_cmd.extend(profraw_file_paths)
-
-    output = subprocess.check_output(subprocess_cmd)
-    logging.debug('Merge output: %s', output)
+    _MergeProfileDataFiles(profraw_file_paths, profdata_file_path)
   except subprocess.CalledProcessError as error:
     logging.error(
         'Failed to merge target profraw files to create target profdata.')
@@ -570,9 +696,29 @@ def _CreateTargetProfDataFileFromProfRawFiles(target, profraw_file_paths):
   return profdata_file_path
 
 
+class _TeeReader(object):
+  """Wraps a file object, copying everything read from it into another one."""
+
+  def __init__(self, stream, copy_file):
+    self._stream = stream
+    self._copy_file = copy_file
+
+  def read(self, size=-1):
+    data = self._stream.read(size)
+    self._copy_file.write(data)
+    return data
+
+
 def _GeneratePerFileCoverageSummary(binary_paths, profdata_file_path, filters,
                                     ignore_filename_regex):
-  """Generates per file coverage summary using "llvm-cov export" command."""
+  """Generates per file coverage summary using "llvm-cov export" command.
+
+  The output of the command is written to the summary file as it is parsed, so
+  that it is never held in memory as a whole.
+
+  Returns:
+    A dict of file path to coverage_utils.CoverageSummary.
+  """
   # llvm-cov export [options] -instr-profile PROFILE BIN [-object BIN,...]
   # [[-object BIN]] [SOURCES].
   # NOTE: For object files, the first one is specified as a positional argument,
@@ -590,13 +736,27 @@ def _GeneratePerFileCoverageSummary(binary_paths, profdata_file_path, filters,
   if ignore_filename_regex:
     subprocess_cmd.append('-ignore-filename-regex=%s' % ignore_filename_regex)
 
-  export_output = subprocess.check_output(subprocess_cmd)
-
   # Write output on the disk to be used by code coverage bot.
-  with open(_GetSummaryFilePath(), 'w') as f:
-    f.write(export_output)
-
-  return export_output
+  with open(_GetSummaryFilePath(), 'wb') as summary_file:
+    process = subprocess.Popen(subprocess_cmd, stdout=subprocess.PIPE)
+    try:
+      export_output = _TeeReader(process.stdout, summary_file)
+      per_file_coverage_summary = coverage_utils.GetPerFileCoverageSummary(
+          export_output, os.path.join(SRC_ROOT_PATH, ''))
+      # Copy anything following the parsed JSON, e.g. a trailing newline.
+      while export_output.read(_SUMMARY_COPY_CHUNK_SIZE):
+        pass
+    except Exception:
+      process.kill()
+      raise
+    finally:
+      process.stdout.close()
+      returncode = process.wait()
+
+  if returncode:
+    raise subprocess.CalledProcessError(returncode, subprocess_cmd)
+
+  return per_file_coverage_summary
 
 
 def _AddArchArgumentForIOSIfNeeded(cmd_list, num_archs):
@@ -907,6 +1067,14 @@ def _ParseCommandArguments():
       'will be derived based on CPUs and goma availability. Please refer to '
       '\'autoninja -h\' for more details.')
 
+  arg_parser.add_argument(
+      '--test-jobs',
+      type=int,
+      default=1,
+      help='Run N test commands in parallel. The profraw files of each target '
+      'are merged as soon as its command finishes. Defaults to 1, as test '
+      'launchers usually run tests in parallel already.')
+
   arg_parser.add_argument(
       '-v',
       '--verbose',
@@ -977,7 +1145,7 @@ def Main():
   if args.web_tests:
     commands = [_GetCommandForWebTests(args.web_tests)]
     profdata_file_path = _CreateCoverageProfileDataForTargets(
-        args.targets, commands, args.jobs)
+        args.targets, commands, args.jobs, args.test_jobs)
     binary_paths = [_GetBinaryPathForWebTests()]
   elif args.command:
     for i in range(len(args.command)):
@@ -989,7 +1157,7 @@ def Main():
     # create a list of binary paths from parsing commands.
     _VerifyTargetExecutablesAreInBuildDirectory(args.command)
     profdata_file_path = _CreateCoverageProfileDataForTargets(
-        args.targets, args.command, args.jobs)
+        args.targets, args.command, args.jobs, args.test_jobs)
     binary_paths = [_GetBinaryPath(command) for command in args.command]
   else:
     # An input prof-data file is already provided. Just calculate binary paths.
@@ -1006,12 +1174,14 @@ def Main():
 
   logging.info('Generating code coverage report in html (this can take a while '
                'depending on size of target!).')
-  per_file_summary_data = _GeneratePerFileCoverageSummary(
-      binary_paths, profdata_file_path, absolute_filter_paths,
-      args.ignore_filename_regex)
-  _GeneratePerFileLineByLineCoverageInHtml(binary_paths, profdata_file_path,
-                                           absolute_filter_paths,
-                                           args.ignore_filename_regex)
+  with _TimedStage('Export coverage summary'):
+    per_file_coverage_summary = _GeneratePerFileCoverageSummary(
+        binary_paths, profdata_file_path, absolute_filter_paths,
+        args.ignore_filename_regex)
+  with _TimedStage('Generate line-by-line html'):
+    _GeneratePerFileLineByLineCoverageInHtml(binary_paths, profdata_file_path,
+                                             absolute_filter_paths,
+                                             args.ignore_filename_regex)
   component_mappings = None
   if not args.no_component_view:
     component_mappings = json.load(urllib2.urlopen(COMPONENT_MAPPING_URL))
@@ -1020,12 +1190,15 @@ def Main():
   processor = coverage_utils.CoverageReportPostProcessor(
       OUTPUT_DIR,
       SRC_ROOT_PATH,
-      per_file_summary_data,
+      per_file_coverage_summary,
       no_component_view=args.no_component_view,
       no_file_view=args.no_file_view,
       component_mappings=component_mappings)
 
-  processor.PrepareHtmlReport()
+  with _TimedStage('Post-process html report'):
+    processor.PrepareHtmlReport()
+
+  _LogStageTimings()
 
 
 if __name__ == '__main__':
@@ -4,11 +4,15 @@
 # found in the LICENSE file.
 """Tests for code coverage tools."""
 
+import io
+import json
 import os
 import re
 import shutil
+import struct
 import subprocess
 import sys
+import tempfile
 import unittest
 
 # Appends third_party/ so that coverage_utils can import jinja2 from
@@ -18,7 +22,13 @@ sys.path.append(
     os.path.join(
         os.path.dirname(__file__), os.path.pardir, os.path.pardir,
         'third_party'))
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), os.path.pardir, os.path.pardir,
+        'third_party', 'pymock'))
+import coverage
 import coverage_utils
+import mock
 
 
 def _RecursiveDirectoryListing(dirpath):
@@ -36,6 +46,31 @@ def _ReadFile(filepath):
     return f.read()
 
 
+def _MinimalElf(section_names, is_64bit=True, shnum=None):
+  """Returns the contents of an ELF file with a section name table only."""
+  names = b'\0' + b''.join(name + b'\0' for name in section_names)
+  if is_64bit:
+    header_size, section_header_size = 64, 64
+    header_format = '<HHIQQQIHHHHHH'
+    section_format = '<IIQQQQIIQQ'
+  else:
+    header_size, section_header_size = 52, 40
+    header_format = '<HHIIIIIHHHHHH'
+    section_format = '<IIIIIIIIII'
+  shoff = header_size + len(names)
+  if shnum is None:
+    shnum = 2
+  header = (
+      b'\x7fELF' + (b'\x02' if is_64bit else b'\x01') + b'\x01\x01' +
+      b'\0' * 9 + struct.pack(header_format, 3, 62, 1, 0, 0, shoff, 0,
+                              header_size, 0, 0, section_header_size, shnum, 1))
+  section_headers = (
+      b'\0' * section_header_size +
+      struct.pack(section_format, 1, 3, 0, 0, header_size, len(names), 0, 0,
+                  1, 0))
+  return header + names + section_headers
+
+
 class CoverageTest(unittest.TestCase):
 
   def setUp(self):
@@ -297,5 +332,342 @@ class CoverageTest(unittest.TestCase):
                      report_3_file_view_data)
 
 
+class CoverageReportPostProcessorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.src_dir = os.path.join(self.tmp_dir, 'src')
+    self.output_dir = os.path.join(self.tmp_dir, 'report')
+    self.report_root_dir = coverage_utils.GetCoverageReportRootDirPath(
+        self.output_dir)
+    os.makedirs(os.path.join(self.src_dir, 'a'))
+    os.makedirs(os.path.join(self.src_dir, 'c'))
+    for path in ['a/x.cc', 'c/z.cc', 'README.md']:
+      with open(os.path.join(self.src_dir, path), 'w') as f:
+        f.write('\n')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def _PostProcess(self, lines_covered, incremental=True, no_file_view=False):
+    """Fakes the output of llvm-cov and post-processes it."""
+    default_report_dir = os.path.join(self.output_dir, 'coverage')
+    files = []
+    for path, covered in sorted(lines_covered.items()):
+      file_path = os.path.join(self.src_dir, path)
+      html_path = default_report_dir + file_path + '.html'
+      if not os.path.exists(os.path.dirname(html_path)):
+        os.makedirs(os.path.dirname(html_path))
+      with open(html_path, 'w') as f:
+        f.write(path)
+      files.append({
+          'filename': file_path,
+          'summary': {
+              'regions': {'count': 10, 'covered': covered},
+              'functions': {'count': 10, 'covered': covered},
+              'lines': {'count': 10, 'covered': covered},
+          }
+      })
+    with open(os.path.join(self.output_dir, 'style.css'), 'w') as f:
+      f.write('')
+
+    processor = coverage_utils.CoverageReportPostProcessor(
+        self.output_dir,
+        self.src_dir,
+        json.dumps({'data': [{'files': files}]}),
+        no_component_view=True,
+        no_file_view=no_file_view,
+        incremental=incremental)
+    processor.PrepareHtmlReport()
+
+  def _DirectoryReportPath(self, path):
+    return (self.report_root_dir + os.path.join(self.src_dir, path) +
+            os.sep + coverage_utils.DIRECTORY_COVERAGE_HTML_REPORT_NAME)
+
+  def test_incremental_post_processing(self):
+    self._PostProcess({'a/x.cc': 5, 'c/z.cc': 5})
+    root_report = _ReadFile(self._DirectoryReportPath(''))
+    self.assertIn('>a/<', root_report)
+    self.assertIn('>c/<', root_report)
+    self.assertNotIn('README.md', root_report)
+
+    # Reports whose contents did not change are not written again.
+    for path in ['', 'a', 'c']:
+      with open(self._DirectoryReportPath(path), 'w') as f:
+        f.write('previous run')
+    self._PostProcess({'a/x.cc': 5, 'c/z.cc': 7})
+    self.assertEqual('previous run', _ReadFile(self._DirectoryReportPath('a')))
+    self.assertNotEqual('previous run',
+                        _ReadFile(self._DirectoryReportPath('c')))
+    self.assertNotEqual('previous run',
+                        _ReadFile(self._DirectoryReportPath('')))
+
+    # Reports of files and directories without coverage data are removed.
+    self._PostProcess({'c/z.cc': 7})
+    self.assertFalse(os.path.exists(self._DirectoryReportPath('a')))
+    self.assertFalse(
+        os.path.exists(self.report_root_dir +
+                       os.path.join(self.src_dir, 'a', 'x.cc.html')))
+    self.assertTrue(
+        os.path.exists(self.report_root_dir +
+                       os.path.join(self.src_dir, 'c', 'z.cc.html')))
+
+  def test_summarized_file_missing_on_disk(self):
+    self._PostProcess({'a/x.cc': 5, 'a/gone.cc': 5},
+                      incremental=False,
+                      no_file_view=True)
+    directory_report = _ReadFile(self._DirectoryReportPath('a'))
+    self.assertIn('>x.cc<', directory_report)
+    self.assertNotIn('gone.cc', directory_report)
+
+  def test_parse_summary_incrementally(self):
+    files = [{
+        'filename': os.path.join(self.src_dir, 'a', 'x%d.cc' % i),
+        'summary': {
+            'regions': {'count': i, 'covered': 1},
+            'functions': {'count': i, 'covered': 1},
+            'lines': {'count': i, 'covered': 1},
+        }
+    } for i in range(20)]
+    summary = {
+        'data': [{
+            'files': files,
+            'totals': {'lines': {'count': 1000000, 'covered': 0}}
+        }],
+        'type': 'llvm.coverage.json.export',
+        'version': '2.0.0',
+    }
+    orig_chunk_size = coverage_utils._JSON_STREAM_CHUNK_SIZE
+    coverage_utils._JSON_STREAM_CHUNK_SIZE = 7
+    try:
+      per_file_coverage_summary = coverage_utils.GetPerFileCoverageSummary(
+          io.BytesIO(json.dumps(summary, indent=1).encode('utf-8')),
+          os.path.join(self.src_dir, ''))
+    finally:
+      coverage_utils._JSON_STREAM_CHUNK_SIZE = orig_chunk_size
+
+    # Files without executable lines are skipped.
+    self.assertEqual(19, len(per_file_coverage_summary))
+    lines_summary = per_file_coverage_summary[files[19]['filename']].Get()[
+        'lines']
+    self.assertEqual({'total': 19, 'covered': 1}, lines_summary)
+
+
+class CoverageProfDataTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.report_root_dir = coverage_utils.GetCoverageReportRootDirPath(
+        self.tmp_dir)
+    os.makedirs(self.report_root_dir)
+    self.merges = []
+    self.fail_merges_into = None
+
+    def merge_profile_data_files(input_file_paths, output_file_path):
+      self.merges.append((list(input_file_paths), output_file_path))
+      if output_file_path == self.fail_merges_into:
+        raise subprocess.CalledProcessError(1, 'llvm-profdata')
+      with open(output_file_path, 'w') as f:
+        f.write('')
+
+    patches = [
+        mock.patch.object(coverage, 'OUTPUT_DIR', self.tmp_dir),
+        mock.patch.object(coverage, 'MERGE_FAN_IN', 3),
+        mock.patch.object(coverage, '_MergeProfileDataFiles',
+                          side_effect=merge_profile_data_files),
+        mock.patch.object(coverage, '_IsIOS', return_value=False),
+        mock.patch.object(coverage, '_IsIOSCommand', return_value=False),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def _Intermediate(self, level, index):
+    return os.path.join(self.report_root_dir,
+                        'merge.%d.%d.profdata' % (level, index))
+
+  def test_merge_tree(self):
+    inputs = ['t%d.profdata' % i for i in range(10)]
+    profdata_file_path = (
+        coverage._CreateCoverageProfileDataFromTargetProfDataFiles(inputs, 2))
+
+    self.assertEqual(os.path.join(self.report_root_dir, 'coverage.profdata'),
+                     profdata_file_path)
+    # Groups of MERGE_FAN_IN files are merged level by level, and a single
+    # leftover file is passed through to the next level unmerged.
+    self.assertEqual(
+        sorted([
+            (inputs[0:3], self._Intermediate(0, 0)),
+            (inputs[3:6], self._Intermediate(0, 1)),
+            (inputs[6:9], self._Intermediate(0, 2)),
+            ([self._Intermediate(0, 0),
+              self._Intermediate(0, 1),
+              self._Intermediate(0, 2)], self._Intermediate(1, 0)),
+        ]), sorted(self.merges[:-1]))
+    self.assertEqual(([self._Intermediate(1, 0), inputs[9]],
+                      profdata_file_path), self.merges[-1])
+    self.assertEqual(['coverage.profdata'], os.listdir(self.report_root_dir))
+
+  def test_merge_tree_without_intermediate_files(self):
+    inputs = ['t%d.profdata' % i for i in range(3)]
+    coverage._CreateCoverageProfileDataFromTargetProfDataFiles(inputs, 2)
+    self.assertEqual([(inputs, coverage._GetProfdataFilePath())], self.merges)
+
+  def test_merge_tree_failure_removes_intermediate_files(self):
+    self.fail_merges_into = coverage._GetProfdataFilePath()
+    inputs = ['t%d.profdata' % i for i in range(7)]
+    with self.assertRaises(subprocess.CalledProcessError):
+      coverage._CreateCoverageProfileDataFromTargetProfDataFiles(inputs, 2)
+    self.assertEqual(3, len(self.merges))
+    self.assertEqual([], os.listdir(self.report_root_dir))
+
+    # Also when an intermediate merge fails.
+    self.merges = []
+    self.fail_merges_into = self._Intermediate(0, 1)
+    with self.assertRaises(subprocess.CalledProcessError):
+      coverage._CreateCoverageProfileDataFromTargetProfDataFiles(inputs, 2)
+    self.assertEqual([], os.listdir(self.report_root_dir))
+
+  def _ExecuteCommand(self, target, command, output_file_path):
+    del command, output_file_path
+    for i in range(2):
+      with open(
+          os.path.join(self.report_root_dir, '%s.%d.profraw' % (target, i)),
+          'w') as f:
+        f.write('')
+    return ''
+
+  def test_parallel_test_commands(self):
+    # Written by a command which is still running.
+    other_profraw_file_path = os.path.join(self.report_root_dir,
+                                           'other.0.profraw')
+
+    def execute_command(target, command, output_file_path):
+      with open(other_profraw_file_path, 'w') as f:
+        f.write('')
+      return self._ExecuteCommand(target, command, output_file_path)
+
+    with mock.patch.object(
+        coverage, '_ExecuteCommand', side_effect=execute_command):
+      profdata_file_paths = (
+          coverage._GetTargetProfDataPathsByExecutingCommands(
+              ['a', 'b'], ['run a', 'run b'], 2))
+
+    self.assertEqual([
+        os.path.join(self.tmp_dir, 'a.profdata'),
+        os.path.join(self.tmp_dir, 'b.profdata')
+    ], profdata_file_paths)
+    self.assertEqual(
+        sorted([
+            ([
+                os.path.join(self.report_root_dir, 'a.%d.profraw' % i)
+                for i in range(2)
+            ], profdata_file_paths[0]),
+            ([
+                os.path.join(self.report_root_dir, 'b.%d.profraw' % i)
+                for i in range(2)
+            ], profdata_file_paths[1]),
+        ]), sorted((sorted(inputs), output) for inputs, output in self.merges))
+    self.assertTrue(os.path.exists(other_profraw_file_path))
+
+  def test_parallel_test_commands_need_unique_targets(self):
+    with mock.patch.object(coverage, '_ExecuteCommand') as execute_command:
+      with self.assertRaises(AssertionError):
+        coverage._GetTargetProfDataPathsByExecutingCommands(
+            ['a', 'a'], ['run a', 'run a --flag'], 2)
+      self.assertFalse(execute_command.called)
+
+  def test_ios_test_commands_run_serially(self):
+    with mock.patch.object(coverage, '_IsIOS', return_value=True), \
+        mock.patch.object(coverage.mp_pool, 'ThreadPool') as thread_pool, \
+        mock.patch.object(coverage, '_RunCommandAndCreateTargetProfDataFile',
+                          side_effect=lambda target, _: target + '.profdata'):
+      profdata_file_paths = (
+          coverage._GetTargetProfDataPathsByExecutingCommands(
+              ['a', 'b'], ['run a', 'run b'], 4))
+    self.assertFalse(thread_pool.called)
+    self.assertEqual(['a.profdata', 'b.profdata'], profdata_file_paths)
+
+
+class SharedLibrariesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.build_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.build_dir)
+
+  def _WriteLibrary(self, name, contents):
+    path = os.path.join(self.build_dir, name)
+    with open(path, 'wb') as f:
+      f.write(contents)
+    return path
+
+  def test_elf_with_coverage_sections(self):
+    for is_64bit in (True, False):
+      path = self._WriteLibrary(
+          'libfoo.so',
+          _MinimalElf([b'.shstrtab', b'__llvm_covmap'], is_64bit=is_64bit))
+      self.assertTrue(coverage_utils._HasCoverageSections(path))
+
+  def test_elf_without_coverage_sections(self):
+    for is_64bit in (True, False):
+      # The name of the section only appears outside of the name table.
+      path = self._WriteLibrary(
+          'libfoo.so',
+          _MinimalElf([b'.shstrtab'], is_64bit=is_64bit) + b'__llvm_covmap')
+      self.assertFalse(coverage_utils._HasCoverageSections(path))
+
+  def test_non_elf_fallback(self):
+    path = self._WriteLibrary('libfoo.dylib', b'\xcf\xfa\xed\xfe__llvm_covmap')
+    self.assertTrue(coverage_utils._HasCoverageSections(path))
+    path = self._WriteLibrary('libfoo.dylib', b'\xcf\xfa\xed\xfe__text')
+    self.assertFalse(coverage_utils._HasCoverageSections(path))
+    path = self._WriteLibrary('libfoo.dylib', b'')
+    self.assertFalse(coverage_utils._HasCoverageSections(path))
+
+  def test_no_section_headers_fallback(self):
+    path = self._WriteLibrary(
+        'libfoo.so', _MinimalElf([b'.shstrtab', b'__llvm_covmap'], shnum=0))
+    self.assertTrue(coverage_utils._HasCoverageSections(path))
+    path = self._WriteLibrary('libfoo.so',
+                              _MinimalElf([b'.shstrtab'], shnum=0))
+    self.assertFalse(coverage_utils._HasCoverageSections(path))
+
+  def test_shared_libraries_cache(self):
+    instrumented_path = self._WriteLibrary(
+        'libfoo.so', _MinimalElf([b'.shstrtab', b'__llvm_covmap']))
+    other_path = self._WriteLibrary('libbar.so', _MinimalElf([b'.shstrtab']))
+    ldd_output = ''.join('\t%s => %s (0x00007f0000000000)\n' %
+                         (os.path.basename(path), path)
+                         for path in (instrumented_path, other_path))
+
+    def get_shared_libraries():
+      with mock.patch.object(coverage_utils.sys, 'platform', 'linux2'), \
+          mock.patch.object(coverage_utils.subprocess, 'check_output',
+                            return_value=ldd_output), \
+          mock.patch.object(coverage_utils, '_HasCoverageSections',
+                            wraps=coverage_utils._HasCoverageSections) as probe:
+        shared_libraries = coverage_utils.GetSharedLibraries(['binary'],
+                                                             self.build_dir)
+      return shared_libraries, sorted(
+          call[0][0] for call in probe.call_args_list)
+
+    self.assertEqual(([instrumented_path], sorted([instrumented_path,
+                                                   other_path])),
+                     get_shared_libraries())
+    # Unchanged libraries are not inspected again.
+    self.assertEqual(([instrumented_path], []), get_shared_libraries())
+
+    # Libraries whose size changed are.
+    self._WriteLibrary('libbar.so',
+                       _MinimalElf([b'.shstrtab', b'__llvm_covmap']))
+    self.assertEqual(([instrumented_path, other_path], [other_path]),
+                     get_shared_libraries())
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -5,14 +5,21 @@
 # The script intentionally does not have a shebang, as it is Py2/Py3 compatible.
 
 import argparse
+import codecs
 from collections import defaultdict
 import functools
+import hashlib
+import io
 import jinja2
 import json
 import logging
+import mmap
+from multiprocessing import pool as mp_pool
+import multiprocessing
 import os
 import re
 import shutil
+import struct
 import subprocess
 import sys
 
@@ -25,6 +32,60 @@ DIRECTORY_VIEW_INDEX_FILE = os.extsep.join(['directory_view_index', 'html'])
 FILE_VIEW_INDEX_FILE = os.extsep.join(['file_view_index', 'html'])
 INDEX_HTML_FILE = os.extsep.join(['index', 'html'])
 
+# Name of the file recording the inputs of generated reports, which is used to
+# only regenerate the reports that changed when post-processing incrementally.
+REPORT_MANIFEST_FILE = os.extsep.join(['report_manifest', 'json'])
+
+# Bump whenever the meaning of the manifest contents changes.
+_REPORT_MANIFEST_VERSION = 1
+
+# Prefix of the names of the sections holding coverage mapping data.
+_LLVM_COV_SECTION_PREFIX = b'__llvm_cov'
+
+# Name of the file, in the build dir, which caches whether shared libraries are
+# instrumented for coverage, keyed by path and mtime.
+SHARED_LIBRARIES_CACHE_FILE = os.extsep.join(
+    ['coverage_shared_libraries_cache', 'json'])
+
+# Number of bytes read at once when parsing "llvm-cov export" output.
+_JSON_STREAM_CHUNK_SIZE = 1 << 20
+
+# Caches the templates loaded by _GetHtmlTemplates, don't use this variable
+# directly, call _GetHtmlTemplates instead.
+_HTML_TEMPLATES = None
+
+
+def _GetHtmlTemplates():
+  """Loads the html templates and style overrides once for all reports.
+
+  Returns:
+    A tuple (header template, table template, footer template, style overrides,
+    fingerprint), where fingerprint is a hash of the sources of all of these.
+  """
+  global _HTML_TEMPLATES
+  if _HTML_TEMPLATES is not None:
+    return _HTML_TEMPLATES
+
+  source_dir = os.path.dirname(os.path.realpath(__file__))
+  template_dir = os.path.join(source_dir, 'html_templates')
+
+  jinja_env = jinja2.Environment(
+      loader=jinja2.FileSystemLoader(template_dir), trim_blocks=True)
+  template_names = ['header.html', 'table.html', 'footer.html']
+  templates = [jinja_env.get_template(name) for name in template_names]
+
+  with open(os.path.join(source_dir, 'static', 'css', 'style.css')) as f:
+    style_overrides = f.read()
+
+  fingerprint = hashlib.sha1(style_overrides.encode('utf-8'))
+  for name in template_names:
+    with open(os.path.join(template_dir, name), 'rb') as f:
+      fingerprint.update(f.read())
+
+  _HTML_TEMPLATES = tuple(templates) + (style_overrides,
+                                        fingerprint.hexdigest())
+  return _HTML_TEMPLATES
+
 
 class CoverageSummary(object):
   """Encapsulates coverage summary representation."""
@@ -64,6 +125,131 @@ class CoverageSummary(object):
           'covered']
 
 
+class _JsonStreamReader(object):
+  """Reads JSON values one at a time from a file object.
+
+  Only the part of the input that has not been consumed yet is buffered, so
+  memory use is bounded by the size of the largest value read at once.
+  """
+
+  def __init__(self, stream):
+    self._stream = stream
+    self._buffer = u''
+    self._pos = 0
+    self._eof = False
+    self._decoder = json.JSONDecoder()
+    self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+
+  def _Fill(self):
+    """Reads more input, returns False at the end of the stream."""
+    chunk = self._stream.read(_JSON_STREAM_CHUNK_SIZE)
+    if not chunk:
+      self._eof = True
+      return False
+    if not isinstance(chunk, type(u'')):
+      chunk = self._utf8_decoder.decode(chunk)
+    self._buffer = self._buffer[self._pos:] + chunk
+    self._pos = 0
+    return True
+
+  def _Peek(self):
+    """Returns the next non-whitespace character, or '' at the end."""
+    while True:
+      while (self._pos < len(self._buffer) and
+             self._buffer[self._pos] in ' \t\r\n'):
+        self._pos += 1
+      if self._pos < len(self._buffer):
+        return self._buffer[self._pos]
+      if not self._Fill():
+        return ''
+
+  def _Next(self, expected):
+    c = self._Peek()
+    assert c in expected, 'Expected one of "%s" in JSON, got "%s".' % (
+        expected, c)
+    self._pos += 1
+    return c
+
+  def ReadValue(self):
+    """Reads the next value entirely."""
+    self._Peek()
+    while True:
+      try:
+        value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        # A number at the end of the buffer may continue in the next chunk.
+        if end < len(self._buffer) or self._eof or not self._Fill():
+          self._pos = end
+          return value
+      except ValueError:
+        # The value is incomplete, unless the input is exhausted. Buffer twice
+        # as much before retrying, so that large values are not re-parsed for
+        # every chunk.
+        min_size = 2 * (len(self._buffer) - self._pos)
+        if self._eof or not self._Fill():
+          raise
+        while len(self._buffer) - self._pos < min_size and self._Fill():
+          pass
+
+  def IterObject(self):
+    """Reads the start of an object and yields its keys.
+
+    The caller must read (or iterate into) the value of each key it gets.
+    """
+    self._Next('{')
+    if self._Peek() == '}':
+      self._pos += 1
+      return
+    while True:
+      key = self.ReadValue()
+      self._Next(':')
+      yield key
+      if self._Next(',}') == '}':
+        return
+
+  def IterArray(self):
+    """Reads the start of an array and yields the index of each item.
+
+    The caller must read (or iterate into) each item.
+    """
+    self._Next('[')
+    if self._Peek() == ']':
+      self._pos += 1
+      return
+    index = 0
+    while True:
+      yield index
+      index += 1
+      if self._Next(',]') == ']':
+        return
+
+
+def IterCoverageSummaryFileEntries(summary_stream):
+  """Yields the per-file entries of "llvm-cov export" JSON output.
+
+  The output is parsed incrementally, so that the whole export, which can be
+  hundreds of MB, is never held in memory.
+
+  Args:
+    summary_stream: A file object with the JSON output of "llvm-cov export".
+
+  Yields:
+    Dictionaries with the "filename" and "summary" of each file.
+  """
+  reader = _JsonStreamReader(summary_stream)
+  for key in reader.IterObject():
+    if key != 'data':
+      reader.ReadValue()
+      continue
+    for index in reader.IterArray():
+      assert index == 0, 'Expected a single export object in coverage data.'
+      for export_key in reader.IterObject():
+        if export_key != 'files':
+          reader.ReadValue()
+          continue
+        for _ in reader.IterArray():
+          yield reader.ReadValue()
+
+
 class CoverageReportHtmlGenerator(object):
   """Encapsulates coverage html report generation.
 
@@ -94,17 +280,8 @@ class CoverageReportHtmlGenerator(object):
     self._table_entries = []
     self._total_entry = {}
 
-    source_dir = os.path.dirname(os.path.realpath(__file__))
-    template_dir = os.path.join(source_dir, 'html_templates')
-
-    jinja_env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_dir), trim_blocks=True)
-    self._header_template = jinja_env.get_template('header.html')
-    self._table_template = jinja_env.get_template('table.html')
-    self._footer_template = jinja_env.get_template('footer.html')
-
-    self._style_overrides = open(
-        os.path.join(source_dir, 'static', 'css', 'style.css')).read()
+    (self._header_template, self._table_template, self._footer_template,
+     self._style_overrides, self._templates_fingerprint) = _GetHtmlTemplates()
 
   def AddLinkToAnotherReport(self, html_report_path, name, summary):
     """Adds a link to another html report in this report.
@@ -175,12 +352,8 @@ class CoverageReportHtmlGenerator(object):
 
     assert False, 'Invalid coverage percentage: "%d".' % percentage
 
-  def WriteHtmlCoverageReport(self, no_component_view, no_file_view):
-    """Writes html coverage report.
-
-    In the report, sub-directories are displayed before files and within each
-    category, entries are sorted alphabetically.
-    """
+  def _SortTableEntries(self):
+    """Sorts sub-directories before files, then alphabetically."""
 
     def EntryCmp(left, right):
       """Compare function for table entries."""
@@ -192,6 +365,32 @@ class CoverageReportHtmlGenerator(object):
     self._table_entries = sorted(
         self._table_entries, key=functools.cmp_to_key(EntryCmp))
 
+  def GetOutputPath(self):
+    """Returns the path to the html report that will be generated."""
+    return self._output_path
+
+  def GetInputsHash(self, no_component_view, no_file_view):
+    """Returns a hash of everything the html report is generated from.
+
+    Two reports with the same hash have the same contents.
+    """
+    self._SortTableEntries()
+    inputs = [
+        self._templates_fingerprint, self._table_entry_type,
+        no_component_view, no_file_view, self._table_entries,
+        self._total_entry
+    ]
+    return hashlib.sha1(
+        json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+  def WriteHtmlCoverageReport(self, no_component_view, no_file_view):
+    """Writes html coverage report.
+
+    In the report, sub-directories are displayed before files and within each
+    category, entries are sorted alphabetically.
+    """
+    self._SortTableEntries()
+
     css_path = os.path.join(self._output_dir, os.extsep.join(['style', 'css']))
 
     directory_view_path = GetDirectoryViewPath(self._output_dir)
@@ -228,6 +427,76 @@ class CoverageReportHtmlGenerator(object):
       html_file.write(html_header + html_table + html_footer)
 
 
+class ReportManifest(object):
+  """Records the inputs of generated html reports across runs.
+
+  The manifest holds the per-file coverage summaries and a hash of the inputs of
+  each generated report, keyed by report path relative to the report root dir.
+  A report whose inputs hash matches the previous run does not need to be
+  generated again.
+  """
+
+  def __init__(self, report_root_dir):
+    """Loads the manifest left by the previous run, if any."""
+    self._report_root_dir = report_root_dir
+    self._path = os.path.join(report_root_dir, REPORT_MANIFEST_FILE)
+    self._previous_pages = {}
+    self._previous_files = {}
+    self._pages = {}
+    self._files = {}
+
+    if not os.path.exists(self._path):
+      return
+    try:
+      with open(self._path) as f:
+        manifest = json.load(f)
+    except ValueError as e:
+      logging.warning('Ignoring corrupt report manifest "%s": %s.', self._path,
+                      e)
+      return
+    if manifest.get('version') != _REPORT_MANIFEST_VERSION:
+      return
+    self._previous_pages = manifest['pages']
+    self._previous_files = manifest['files']
+
+  def IsUpToDate(self, report_path, inputs_hash):
+    """Records the inputs of a report and returns whether it is unchanged."""
+    relative_path = os.path.relpath(report_path, self._report_root_dir)
+    self._pages[relative_path] = inputs_hash
+    return (self._previous_pages.get(relative_path) == inputs_hash and
+            os.path.exists(report_path))
+
+  def SetFileSummaries(self, per_file_coverage_summary):
+    """Records the per-file summaries and returns the paths of removed files."""
+    self._files = {
+        path: summary.Get()
+        for path, summary in per_file_coverage_summary.items()
+    }
+    changed_count = sum(1 for path, summary in self._files.items()
+                        if self._previous_files.get(path) != summary)
+    logging.debug('Coverage of %d out of %d files changed since the last run.',
+                  changed_count, len(self._files))
+    return [path for path in self._previous_files if path not in self._files]
+
+  def RemoveStaleReports(self):
+    """Removes the reports of the previous run that were not generated again."""
+    for relative_path in self._previous_pages:
+      if relative_path in self._pages:
+        continue
+      report_path = os.path.join(self._report_root_dir, relative_path)
+      if os.path.exists(report_path):
+        os.remove(report_path)
+
+  def Save(self):
+    manifest = {
+        'version': _REPORT_MANIFEST_VERSION,
+        'pages': self._pages,
+        'files': self._files,
+    }
+    with open(self._path, 'w') as f:
+      json.dump(manifest, f, sort_keys=True)
+
+
 class CoverageReportPostProcessor(object):
   """Post processing of code coverage reports produced by llvm-cov."""
 
@@ -238,17 +507,30 @@ class CoverageReportPostProcessor(object):
                no_component_view,
                no_file_view,
                component_mappings={},
-               path_equivalence=None):
-    """Initializes CoverageReportPostProcessor object."""
+               path_equivalence=None,
+               incremental=False):
+    """Initializes CoverageReportPostProcessor object.
+
+    |summary_data| is the output of "llvm-cov export -summary-only", either as
+    a string or as a file object which is parsed incrementally. It can also be
+    the dict returned by GetPerFileCoverageSummary() for that output.
+
+    When |incremental| is True, the html reports left in |output_dir| by a
+    previous run are updated in place, and only the reports whose contents
+    changed are generated again, see ReportManifest.
+    """
     # Caller provided parameters.
     self.output_dir = output_dir
     self.src_root_dir = os.path.normpath(GetFullPath(src_root_dir))
     if not self.src_root_dir.endswith(os.sep):
       self.src_root_dir += os.sep
-    self.summary_data = json.loads(summary_data)
-    assert len(self.summary_data['data']) == 1
+    self.summary_data = summary_data
     self.no_component_view = no_component_view
     self.no_file_view = no_file_view
+    self.incremental = incremental
+
+    # Set by PrepareHtmlReport when post-processing incrementally.
+    self.report_manifest = None
 
     # Mapping from components to directories
     self.component_to_directories = None
@@ -302,6 +584,17 @@ class CoverageReportPostProcessor(object):
       if not found_parent_directory:
         self.component_to_directories[component].append(directory)
 
+  def _WriteHtmlReport(self, html_generator):
+    """Writes a html report, unless it is unchanged since the previous run."""
+    if self.report_manifest is not None:
+      inputs_hash = html_generator.GetInputsHash(self.no_component_view,
+                                                 self.no_file_view)
+      if self.report_manifest.IsUpToDate(html_generator.GetOutputPath(),
+                                         inputs_hash):
+        return
+    html_generator.WriteHtmlCoverageReport(self.no_component_view,
+                                           self.no_file_view)
+
   def _MapToLocal(self, path):
     """Maps a path from the coverage data to a local path."""
     if not self.path_map:
@@ -368,8 +661,7 @@ class CoverageReportPostProcessor(object):
     # Do not create a totals row for the component view as the value is
     # incorrect due to failure to account for UNKNOWN component and some paths
     # belonging to multiple components.
-    html_generator.WriteHtmlCoverageReport(self.no_component_view,
-                                           self.no_file_view)
+    self._WriteHtmlReport(html_generator)
     logging.debug('Finished generating component view html index file.')
 
   def GenerateCoverageInHtmlForComponent(self, component_name,
@@ -399,8 +691,7 @@ class CoverageReportPostProcessor(object):
 
     html_generator.CreateTotalsEntry(
         per_component_coverage_summary[component_name])
-    html_generator.WriteHtmlCoverageReport(self.no_component_view,
-                                           self.no_file_view)
+    self._WriteHtmlReport(html_generator)
 
   def GetCoverageHtmlReportPathForComponent(self, component_name):
     """Given a component, returns the corresponding html report path."""
@@ -448,57 +739,67 @@ class CoverageReportPostProcessor(object):
           per_file_coverage_summary[file_path])
 
     html_generator.CreateTotalsEntry(totals_coverage_summary)
-    html_generator.WriteHtmlCoverageReport(self.no_component_view,
-                                           self.no_file_view)
+    self._WriteHtmlReport(html_generator)
     logging.debug('Finished generating file view html index file.')
 
   def GeneratePerFileCoverageSummary(self):
     """Generate per file coverage summary using coverage data in JSON format."""
-    files_coverage_data = self.summary_data['data'][0]['files']
-
-    per_file_coverage_summary = {}
-    for file_coverage_data in files_coverage_data:
-      file_path = file_coverage_data['filename']
-      assert file_path.startswith(self.src_root_dir), (
-          'File path "%s" in coverage summary is outside source checkout.' %
-          file_path)
+    if isinstance(self.summary_data, dict):
+      return self.summary_data
 
-      summary = file_coverage_data['summary']
-      if summary['lines']['count'] == 0:
-        continue
-
-      per_file_coverage_summary[file_path] = CoverageSummary(
-          regions_total=summary['regions']['count'],
-          regions_covered=summary['regions']['covered'],
-          functions_total=summary['functions']['count'],
-          functions_covered=summary['functions']['covered'],
-          lines_total=summary['lines']['count'],
-          lines_covered=summary['lines']['covered'])
+    summary_stream = self.summary_data
+    if isinstance(summary_stream, type(u'')):
+      summary_stream = io.StringIO(summary_stream)
+    elif isinstance(summary_stream, bytes):
+      summary_stream = io.BytesIO(summary_stream)
 
-    logging.debug('Finished generating per-file code coverage summary.')
-    return per_file_coverage_summary
+    return GetPerFileCoverageSummary(summary_stream, self.src_root_dir)
 
   def GeneratePerDirectoryCoverageInHtml(self, per_directory_coverage_summary,
                                          per_file_coverage_summary):
     """Generates per directory coverage breakdown in html."""
     logging.debug('Writing per-directory coverage html reports.')
+    # The entries of each directory are derived from the summaries rather than
+    # by listing the directory, as only files with coverage data are reported.
+    # Like the listing did, entries missing on disk are skipped, e.g. deleted
+    # generated sources.
+    directory_entries = defaultdict(list)
+    for paths, exists in ((per_file_coverage_summary, os.path.isfile),
+                          (per_directory_coverage_summary, os.path.isdir)):
+      for path in paths:
+        parent_dir = os.path.dirname(path)
+        if (parent_dir != path and parent_dir in per_directory_coverage_summary
+            and exists(self._MapToLocal(path))):
+          directory_entries[parent_dir].append(path)
+
     for dir_path in per_directory_coverage_summary:
       self.GenerateCoverageInHtmlForDirectory(
-          dir_path, per_directory_coverage_summary, per_file_coverage_summary)
+          dir_path, per_directory_coverage_summary, per_file_coverage_summary,
+          directory_entries[dir_path])
 
     logging.debug('Finished writing per-directory coverage html reports.')
 
-  def GenerateCoverageInHtmlForDirectory(self, dir_path,
+  def GenerateCoverageInHtmlForDirectory(self,
+                                         dir_path,
                                          per_directory_coverage_summary,
-                                         per_file_coverage_summary):
-    """Generates coverage html report for a single directory."""
+                                         per_file_coverage_summary,
+                                         entry_paths=None):
+    """Generates coverage html report for a single directory.
+
+    |entry_paths| are the paths of the files and sub-directories of |dir_path|.
+    If None, they are obtained by listing the directory.
+    """
     html_generator = CoverageReportHtmlGenerator(
         self.output_dir, self.GetCoverageHtmlReportPathForDirectory(dir_path),
         'Path')
 
-    for entry_name in os.listdir(self._MapToLocal(dir_path)):
-      entry_path = os.path.normpath(os.path.join(dir_path, entry_name))
+    if entry_paths is None:
+      entry_paths = [
+          os.path.normpath(os.path.join(dir_path, entry_name))
+          for entry_name in os.listdir(self._MapToLocal(dir_path))
+      ]
 
+    for entry_path in entry_paths:
       if entry_path in per_file_coverage_summary:
         entry_html_report_path = self.GetCoverageHtmlReportPathForFile(
             entry_path)
@@ -517,8 +818,7 @@ class CoverageReportPostProcessor(object):
                                             entry_coverage_summary)
 
     html_generator.CreateTotalsEntry(per_directory_coverage_summary[dir_path])
-    html_generator.WriteHtmlCoverageReport(self.no_component_view,
-                                           self.no_file_view)
+    self._WriteHtmlReport(html_generator)
 
   def GenerateDirectoryViewHtmlIndexFile(self):
     """Generates the html index file for directory view.
@@ -549,7 +849,12 @@ class CoverageReportPostProcessor(object):
     if not os.path.exists(self.report_root_dir):
       os.mkdir(self.report_root_dir)
 
-    MergeTwoDirectories(default_report_subdir_path, self.report_root_dir)
+    # Incremental runs keep the reports of the previous run that are in the
+    # same directories as the newly generated files.
+    MergeTwoDirectories(
+        default_report_subdir_path,
+        self.report_root_dir,
+        recursive=self.incremental)
 
   def OverwriteHtmlReportsIndexFile(self):
     """Overwrites the root index file to redirect to the default view."""
@@ -569,6 +874,17 @@ class CoverageReportPostProcessor(object):
 
     per_file_coverage_summary = self.GeneratePerFileCoverageSummary()
 
+    if self.incremental:
+      self.report_manifest = ReportManifest(self.report_root_dir)
+      removed_file_paths = self.report_manifest.SetFileSummaries(
+          per_file_coverage_summary)
+      for file_path in removed_file_paths:
+        # The report of a removed file can only be left by a previous run.
+        html_report_path = self.report_root_dir + os.extsep.join(
+            [GetFullPath(file_path), 'html'])
+        if os.path.exists(html_report_path):
+          os.remove(html_report_path)
+
     if not self.no_file_view:
       self.GenerateFileViewHtmlIndexFile(per_file_coverage_summary,
                                          self.file_view_path)
@@ -594,11 +910,51 @@ class CoverageReportPostProcessor(object):
     self.OverwriteHtmlReportsIndexFile()
     self.CleanUpOutputDir()
 
+    if self.report_manifest is not None:
+      self.report_manifest.RemoveStaleReports()
+      self.report_manifest.Save()
+
     html_index_file_path = 'file://' + GetFullPath(self.html_index_path)
     logging.info('Index file for html report is generated as: "%s".',
                  html_index_file_path)
 
 
+def GetPerFileCoverageSummary(summary_stream, src_root_dir):
+  """Returns per file coverage summaries from "llvm-cov export" output.
+
+  Files without any executable lines are skipped.
+
+  Args:
+    summary_stream: A file object with the JSON output of "llvm-cov export".
+    src_root_dir: Absolute path to the root of the checkout, ending with a
+                  separator. All files are expected to be under it.
+
+  Returns:
+    A dict of file path to CoverageSummary.
+  """
+  per_file_coverage_summary = {}
+  for file_coverage_data in IterCoverageSummaryFileEntries(summary_stream):
+    file_path = file_coverage_data['filename']
+    assert file_path.startswith(src_root_dir), (
+        'File path "%s" in coverage summary is outside source checkout.' %
+        file_path)
+
+    summary = file_coverage_data['summary']
+    if summary['lines']['count'] == 0:
+      continue
+
+    per_file_coverage_summary[file_path] = CoverageSummary(
+        regions_total=summary['regions']['count'],
+        regions_covered=summary['regions']['covered'],
+        functions_total=summary['functions']['count'],
+        functions_covered=summary['functions']['covered'],
+        lines_total=summary['lines']['count'],
+        lines_covered=summary['lines']['covered'])
+
+  logging.debug('Finished generating per-file code coverage summary.')
+  return per_file_coverage_summary
+
+
 def ConfigureLogging(verbose=False, log_file=None):
   """Configures logging settings for later use."""
   log_level = logging.DEBUG if verbose else logging.INFO
@@ -666,10 +1022,72 @@ def GetRelativePathToDirectoryOfFile(target_path, base_path):
   return os.path.relpath(target_path, base_dir)
 
 
+def _HasCoverageSections(binary_path):
+  """Returns whether a binary is instrumented for code coverage.
+
+  For ELF files, only the section headers and the section name table are read,
+  through an mmap. Other files are searched for the name of the sections.
+  """
+  with open(binary_path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return False
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+  try:
+    if data[:4] != b'\x7fELF':
+      return data.find(_LLVM_COV_SECTION_PREFIX) != -1
+
+    endian = '<' if data[5:6] == b'\x01' else '>'
+    if data[4:5] == b'\x02':
+      header_format = endian + 'Q10xHHH'
+      header_offset = 0x28
+      section_format = endian + '24xQQ'
+    else:
+      header_format = endian + 'I10xHHH'
+      header_offset = 0x20
+      section_format = endian + '16xII'
+    shoff, shentsize, shnum, shstrndx = struct.unpack_from(
+        header_format, data, header_offset)
+    if shnum == 0 or shstrndx >= 0xff00:
+      # Extended section numbering, not worth handling.
+      return data.find(_LLVM_COV_SECTION_PREFIX) != -1
+
+    names_offset, names_size = struct.unpack_from(
+        section_format, data, shoff + shstrndx * shentsize)
+    section_names = data[names_offset:names_offset + names_size]
+    return b'\0' + _LLVM_COV_SECTION_PREFIX in section_names
+  finally:
+    data.close()
+
+
+def _LoadSharedLibrariesCache(cache_path):
+  """Returns the cache of instrumented libraries, see _SaveSharedLibrariesCache.
+  """
+  if not os.path.exists(cache_path):
+    return {}
+  try:
+    with open(cache_path) as f:
+      return json.load(f)
+  except ValueError as e:
+    logging.warning('Ignoring corrupt shared libraries cache "%s": %s.',
+                    cache_path, e)
+    return {}
+
+
+def _SaveSharedLibrariesCache(cache_path, cache):
+  """Saves a dict of library path to [mtime, size, is instrumented]."""
+  try:
+    with open(cache_path, 'w') as f:
+      json.dump(cache, f, sort_keys=True)
+  except IOError as e:
+    logging.warning('Failed to write shared libraries cache "%s": %s.',
+                    cache_path, e)
+
+
 def GetSharedLibraries(binary_paths, build_dir):
   """Returns list of shared libraries used by specified binaries."""
   logging.info('Finding shared libraries for targets (if any).')
-  shared_libraries = []
+  shared_library_paths = []
   cmd = []
   shared_library_re = None
 
@@ -698,18 +1116,42 @@ def GetSharedLibraries(binary_paths, build_dir):
       # otool outputs "@rpath" macro instead of the dirname of the given binary.
       shared_library_path = shared_library_path.replace('@rpath', build_dir)
 
-    if shared_library_path in shared_libraries:
+    if shared_library_path in shared_library_paths:
       continue
 
     assert os.path.exists(shared_library_path), ('Shared library "%s" used by '
                                                  'the given target(s) does not '
                                                  'exist.' % shared_library_path)
-    with open(shared_library_path, 'rb') as f:
-      data = f.read()
-
-    # Do not add non-instrumented libraries. Otherwise, llvm-cov errors outs.
-    if b'__llvm_cov' in data:
-      shared_libraries.append(shared_library_path)
+    shared_library_paths.append(shared_library_path)
+
+  # Only libraries that changed since the previous run are inspected.
+  cache_path = os.path.join(build_dir, SHARED_LIBRARIES_CACHE_FILE)
+  cache = _LoadSharedLibrariesCache(cache_path)
+  stale_paths = []
+  for path in shared_library_paths:
+    stat = os.stat(path)
+    cache_key = [stat.st_mtime, stat.st_size]
+    if cache.get(path, [None, None, None])[:2] != cache_key:
+      cache[path] = cache_key + [None]
+      stale_paths.append(path)
+
+  if stale_paths:
+    logging.debug('Inspecting %d shared libraries.', len(stale_paths))
+    pool = mp_pool.ThreadPool(
+        min(multiprocessing.cpu_count(), len(stale_paths)))
+    try:
+      for path, instrumented in zip(
+          stale_paths, pool.map(_HasCoverageSections, stale_paths)):
+        cache[path][2] = instrumented
+    finally:
+      pool.close()
+      pool.join()
+    _SaveSharedLibrariesCache(cache_path, cache)
+
+  # Do not add non-instrumented libraries. Otherwise, llvm-cov errors outs.
+  shared_libraries = [
+      path for path in shared_library_paths if cache[path][2]
+  ]
 
   logging.debug('Found shared libraries (%d): %s.', len(shared_libraries),
                 shared_libraries)
@@ -717,13 +1159,24 @@ def GetSharedLibraries(binary_paths, build_dir):
   return shared_libraries
 
 
-def MergeTwoDirectories(src_dir_path, dst_dir_path):
-  """Merge src_dir_path directory into dst_path directory."""
+def MergeTwoDirectories(src_dir_path, dst_dir_path, recursive=False):
+  """Merge src_dir_path directory into dst_path directory.
+
+  Entries of src_dir_path replace the ones of dst_dir_path with the same name.
+  If recursive is True, sub-directories present in both are merged instead, so
+  that files only present in dst_dir_path are kept.
+  """
   for filename in os.listdir(src_dir_path):
+    src_path = os.path.join(src_dir_path, filename)
     dst_path = os.path.join(dst_dir_path, filename)
-    if os.path.exists(dst_path):
+    if recursive and os.path.isdir(src_path) and os.path.isdir(dst_path):
+      MergeTwoDirectories(src_path, dst_path, recursive=True)
+      continue
+    if os.path.isdir(dst_path):
       shutil.rmtree(dst_path)
-    os.rename(os.path.join(src_dir_path, filename), dst_path)
+    elif os.path.exists(dst_path):
+      os.remove(dst_path)
+    os.rename(src_path, dst_path)
   shutil.rmtree(src_dir_path)
 
 
@@ -762,17 +1215,16 @@ def _CmdSharedLibraries(args):
 
 def _CmdPostProcess(args):
   """Handles 'post_process' command."""
-  with open(args.summary_file) as f:
-    summary_data = f.read()
-
-  processor = CoverageReportPostProcessor(
-      args.output_dir,
-      args.src_root_dir,
-      summary_data,
-      no_component_view=True,
-      no_file_view=False,
-      path_equivalence=args.path_equivalence)
-  processor.PrepareHtmlReport()
+  with open(args.summary_file, 'rb') as summary_file:
+    processor = CoverageReportPostProcessor(
+        args.output_dir,
+        args.src_root_dir,
+        summary_file,
+        no_component_view=True,
+        no_file_view=False,
+        path_equivalence=args.path_equivalence,
+        incremental=args.incremental)
+    processor.PrepareHtmlReport()
 
 
 def Main():
@@ -808,6 +1260,11 @@ def Main():
       '-path-equivalence',
       help='Map the paths in the coverage data to local '
       'source files path (=<from>,<to>)')
+  post_processing_parser.add_argument(
+      '-incremental',
+      action='store_true',
+      help='Update the reports left in the output dir by a previous run, only '
+      'regenerating the ones whose contents changed.')
 
   args = parser.parse_args()
   ConfigureLogging(args.verbose)
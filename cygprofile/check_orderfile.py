@@ -66,6 +66,10 @@ def main():
   parser.add_option('--threshold', action='store', dest='threshold',
                     default=20, type=int,
                     help='The maximum allowed number of out-of-order symbols.')
+  parser.add_option('--symbol-cache-dir', action='store',
+                    dest='symbol_cache_dir', default=None,
+                    help=('Directory in which to cache symbol tables across '
+                          'runs. Disabled by default.'))
   options, argv = parser.parse_args(sys.argv)
   if len(argv) != 3:
     parser.print_help()
@@ -73,6 +77,7 @@ def main():
   (binary_filename, orderfile_filename) = argv[1:]
 
   symbol_extractor.SetArchitecture(options.arch)
+  symbol_extractor.SetCacheDirectory(options.symbol_cache_dir)
   symbol_infos = symbol_extractor.SymbolInfosFromBinary(binary_filename)
 
   if not _VerifySymbolOrder([sym.strip() for sym in file(orderfile_filename)],
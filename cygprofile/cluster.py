@@ -7,6 +7,7 @@
 See the Clustering class for a detailed description.
 """
 
+import array
 import collections
 import itertools
 import logging
@@ -66,20 +67,6 @@ class Clustering(object):
   FAR_DISTANCE = 1000
   MAX_CLUSTER_SIZE = 4096  # 4k pages on android.
 
-  class _Cluster(object):
-    def __init__(self, syms, size):
-      assert len(set(syms)) == len(syms), 'Duplicated symbols in cluster'
-      self._syms = syms
-      self._size = size
-
-    @property
-    def syms(self):
-      return self._syms
-
-    @property
-    def binary_size(self):
-      return self._size
-
   @classmethod
   def ClusteredSymbolLists(cls, sym_lists, size_map):
     c = cls()
@@ -88,87 +75,172 @@ class Clustering(object):
 
   def __init__(self):
     self._num_lists = None
-    self._neighbors = None
-    self._cluster_map = {}
+    # Symbols are referred to by ids. When added through AddSymbolLists(), ids
+    # follow the sort order of the symbols.
+    self._symbols = []
+    self._symbol_ids = {}
+    # Coalesced neighbors, as parallel arrays of symbol ids and distances.
+    self._neighbor_srcs = array.array('l')
+    self._neighbor_dsts = array.array('l')
+    self._neighbor_dists = array.array('d')
     self._symbol_size = lambda _: 0  # Maps a symbol to a size.
+    # Union-find of clusters, indexed by symbol id. Symbols within a cluster
+    # form a linked list (via |_next|), whose ends are stored on the root.
+    self._parent = array.array('l')
+    self._next = array.array('l')
+    self._head = array.array('l')
+    self._tail = array.array('l')
+    self._count = array.array('l')
+    self._size = array.array('l')
+
+  def _SymbolId(self, s):
+    sym_id = self._symbol_ids.get(s)
+    if sym_id is None:
+      sym_id = len(self._symbols)
+      self._symbols.append(s)
+      self._symbol_ids[s] = sym_id
+      self._parent.append(sym_id)
+      self._next.append(-1)
+      self._head.append(sym_id)
+      self._tail.append(sym_id)
+      self._count.append(1)
+      self._size.append(0)
+    return sym_id
+
+  def _Find(self, sym_id):
+    parent = self._parent
+    while parent[sym_id] != sym_id:
+      # Path halving.
+      parent[sym_id] = parent[parent[sym_id]]
+      sym_id = parent[sym_id]
+    return sym_id
+
+  def _Union(self, root_a, root_b):
+    """Combines two clusters, with symbols of |root_a| coming first.
 
-  def _MakeCluster(self, syms):
-    c = self._Cluster(syms, sum(self._symbol_size(s) for s in syms))
-    for s in syms:
-      self._cluster_map[s] = c
-    return c
+    Returns:
+      The root of the combined cluster.
+    """
+    self._next[self._tail[root_a]] = self._head[root_b]
+    head = self._head[root_a]
+    tail = self._tail[root_b]
+    if self._count[root_a] < self._count[root_b]:
+      root_a, root_b = root_b, root_a
+    self._parent[root_b] = root_a
+    self._head[root_a] = head
+    self._tail[root_a] = tail
+    self._count[root_a] += self._count[root_b]
+    self._size[root_a] += self._size[root_b]
+    return root_a
+
+  def _ClusterSymbols(self, root):
+    ret = []
+    sym_id = self._head[root]
+    while sym_id != -1:
+      ret.append(self._symbols[sym_id])
+      sym_id = self._next[sym_id]
+    return ret
 
   def ClusterOf(self, s):
-    if isinstance(s, self._Cluster):
-      assert self._cluster_map[s.syms[0]] == s
-      return s
-    if s in self._cluster_map:
-      return self._cluster_map[s]
-    return self._MakeCluster([s])
+    """Returns the list of symbols in the cluster that contains |s|."""
+    return self._ClusterSymbols(self._Find(self._SymbolId(s)))
 
   def Combine(self, a, b):
     """Combine clusters.
 
     Args:
-      a, b: Clusters or str. The canonical cluster (ClusterOf) will be
-        used to do the combining.
+      a, b: Symbols whose clusters should be combined, with the symbols of a's
+        cluster coming first.
 
     Returns:
-      A merged cluster from a and b, or None if a and b are in the same cluster.
+      Whether the clusters were combined (False if a and b are in the same
+      cluster).
     """
-    canonical_a = self.ClusterOf(a)
-    canonical_b = self.ClusterOf(b)
-    if canonical_a == canonical_b:
-      return None
-    return self._MakeCluster(canonical_a._syms + canonical_b._syms)
+    root_a = self._Find(self._SymbolId(a))
+    root_b = self._Find(self._SymbolId(b))
+    if root_a == root_b:
+      return False
+    self._Union(root_a, root_b)
+    return True
 
   def AddSymbolLists(self, sym_lists):
     self._num_lists = len(sym_lists)
-    self._neighbors = self._CoalesceNeighbors(
-        self._ConstructNeighbors(sym_lists))
-
-  def _ConstructNeighbors(self, sym_lists):
-    neighbors = []
-    for sym_list in sym_lists:
-      for i, s in enumerate(sym_list):
-        for j in xrange(i + 1, min(i + self.NEIGHBOR_DISTANCE, len(sym_list))):
-          if s == sym_list[j]:
+    for s in sorted(set(itertools.chain.from_iterable(sym_lists))):
+      self._SymbolId(s)
+    id_lists = [[self._symbol_ids[s] for s in sym_list]
+                for sym_list in sym_lists]
+    self._CoalesceNeighbors(*self._ConstructNeighbors(id_lists))
+
+  def _ConstructNeighbors(self, id_lists):
+    """Sums the distances of each (src, dst) pair of neighbors.
+
+    Returns:
+      A tuple of (dist_sums, counts), dicts keyed by
+      |src_id * num_symbols + dst_id|.
+    """
+    num_symbols = len(self._symbols)
+    dist_sums = collections.defaultdict(int)
+    counts = collections.defaultdict(int)
+    num_neighbors = 0
+    for id_list in id_lists:
+      for i, s in enumerate(id_list):
+        key_base = s * num_symbols
+        for j in xrange(i + 1, min(i + self.NEIGHBOR_DISTANCE, len(id_list))):
+          t = id_list[j]
+          if s == t:
             # Free functions that are static inline seem to be the only
             # source of these duplicates.
             continue
-          neighbors.append(Neighbor(s, sym_list[j], j - i))
-    logging.info('Constructed %s symbol neighbors', len(neighbors))
-    return neighbors
-
-  def _CoalesceNeighbors(self, neighbors):
-    pairs = collections.defaultdict(list)
-    for n in neighbors:
-      pairs[(n.src, n.dst)].append(n.dist)
-    coalesced = []
-    logging.info('Will coalesce over %s neighbor pairs', len(pairs))
+          dist_sums[key_base + t] += j - i
+          counts[key_base + t] += 1
+          num_neighbors += 1
+    logging.info('Constructed %s symbol neighbors', num_neighbors)
+    return dist_sums, counts
+
+  def _CoalesceNeighbors(self, dist_sums, counts):
+    num_symbols = len(self._symbols)
+    srcs = []
+    dsts = []
+    dists = []
+    logging.info('Will coalesce over %s neighbor pairs', len(dist_sums))
     count = 0
-    for (s, t) in pairs:
+    for key, dist_sum in dist_sums.iteritems():
+      s, t = divmod(key, num_symbols)
       assert s != t, '{} != {}'.format(s, t)
-      if (t, s) in pairs and t < s:
+      reverse_key = t * num_symbols + s
+      reverse_dist_sum = dist_sums.get(reverse_key)
+      if reverse_dist_sum is not None and t < s:
         # Only process each unordered pair once.
         continue
       count += 1
       if not (count % 1e6):
         logging.info('tick')
-      distances = []
-      if (s, t) in pairs:
-        distances.extend(pairs[(s, t)])
-      if (t, s) in pairs:
-        distances.extend(-d for d in pairs[(t, s)])
-      if distances:
-        num_missing = self._num_lists - len(distances)
-        avg_distance = (float(sum(distances)) +
-                        self.FAR_DISTANCE * num_missing) / self._num_lists
-        if avg_distance > 0:
-          coalesced.append(Neighbor(s, t, avg_distance))
-        else:
-          coalesced.append(Neighbor(t, s, avg_distance))
-    return coalesced
+      num_distances = counts[key]
+      if reverse_dist_sum is not None:
+        dist_sum -= reverse_dist_sum
+        num_distances += counts[reverse_key]
+      num_missing = self._num_lists - num_distances
+      avg_distance = (float(dist_sum) +
+                      self.FAR_DISTANCE * num_missing) / self._num_lists
+      if avg_distance <= 0:
+        s, t = t, s
+      srcs.append(s)
+      dsts.append(t)
+      dists.append(avg_distance)
+
+    # Neighbors are processed by ClusterToList() in reverse of this order.
+    order = sorted(xrange(len(srcs)),
+                   key=lambda i: (-dists[i], srcs[i], dsts[i]))
+    self._neighbor_srcs = array.array('l', (srcs[i] for i in order))
+    self._neighbor_dsts = array.array('l', (dsts[i] for i in order))
+    self._neighbor_dists = array.array('d', (dists[i] for i in order))
+
+  def _IterNeighbors(self):
+    """Yields the coalesced neighbors (sorted by decreasing priority)."""
+    symbols = self._symbols
+    for i in xrange(len(self._neighbor_srcs) - 1, -1, -1):
+      yield Neighbor(symbols[self._neighbor_srcs[i]],
+                     symbols[self._neighbor_dsts[i]], self._neighbor_dists[i])
 
   def ClusterToList(self, size_map=None):
     """Merge the clusters with the smallest distances.
@@ -183,39 +255,52 @@ class Clustering(object):
     """
     if size_map:
       self._symbol_size = lambda s: size_map[s]
-    if not self._num_lists or not self._neighbors:
+    if not self._num_lists or not self._neighbor_srcs:
       # Some sort of trivial set of symbol lists, such as all being
       # length 1. Return an empty ordering.
       return []
-    logging.info('Sorting %s neighbors', len(self._neighbors))
-    self._neighbors.sort(key=lambda n: (-n.dist, n.src, n.dst))
-    logging.info('Clustering...')
+    symbols = self._symbols
+    size = self._size
+    # Only symbols that are part of a neighbor pair end up in the ordering. Ties
+    # between clusters are broken by the order in which symbols are first seen.
+    seen = bytearray(len(symbols))
+    seen_ids = []
+
+    logging.info('Clustering %s neighbors...', len(self._neighbor_srcs))
+    find = self._Find
     count = 0
-    while self._neighbors:
+    for i in xrange(len(self._neighbor_srcs) - 1, -1, -1):
       count += 1
       if not (count % 1e6):
         logging.info('tock')
-      neighbor = self._neighbors.pop()
-      src = self.ClusterOf(neighbor.src)
-      dst = self.ClusterOf(neighbor.dst)
-      if (src == dst or
-          src.binary_size + dst.binary_size > self.MAX_CLUSTER_SIZE):
+      for sym_id in (self._neighbor_srcs[i], self._neighbor_dsts[i]):
+        if not seen[sym_id]:
+          seen[sym_id] = 1
+          seen_ids.append(sym_id)
+          size[sym_id] = self._symbol_size(symbols[sym_id])
+      src = find(self._neighbor_srcs[i])
+      dst = find(self._neighbor_dsts[i])
+      if src == dst or size[src] + size[dst] > self.MAX_CLUSTER_SIZE:
         continue
-      self.Combine(src, dst)
+      self._Union(src, dst)
+
+    roots = []
+    for sym_id in seen_ids:
+      if self._parent[sym_id] == sym_id:
+        roots.append(sym_id)
     if size_map:
-      clusters_by_size = sorted(list(set(self._cluster_map.values())),
-                                key=lambda c: -c.binary_size)
+      roots.sort(key=lambda r: -self._size[r])
     else:
-      clusters_by_size = sorted(list(set(self._cluster_map.values())),
-                                key=lambda c: -len(c.syms))
-    logging.info('Produced %s clusters', len(clusters_by_size))
-    logging.info('Top sizes: %s', ['{}/{}'.format(len(c.syms), c.binary_size)
-                                   for c in clusters_by_size[:4]])
-    logging.info('Bottom sizes: %s', ['{}/{}'.format(len(c.syms), c.binary_size)
-                                      for c in clusters_by_size[-4:]])
+      roots.sort(key=lambda r: -self._count[r])
+    logging.info('Produced %s clusters', len(roots))
+    logging.info('Top sizes: %s', ['{}/{}'.format(self._count[r], self._size[r])
+                                   for r in roots[:4]])
+    logging.info('Bottom sizes: %s', ['{}/{}'.format(self._count[r],
+                                                     self._size[r])
+                                      for r in roots[-4:]])
     ordered_syms = []
-    for c in clusters_by_size:
-      ordered_syms.extend(c.syms)
+    for r in roots:
+      ordered_syms.extend(self._ClusterSymbols(r))
     assert len(ordered_syms) == len(set(ordered_syms)), 'Duplicated symbols!'
     return ordered_syms
 
@@ -18,27 +18,30 @@ from test_utils import (ProfileFile,
 class ClusteringTestCase(unittest.TestCase):
   def testClusterOf(self):
     clstr = cluster.Clustering()
-    c = clstr.ClusterOf('a')
-    self.assertEqual(['a'], c.syms)
-    c = clstr._MakeCluster(['a', 'b', 'c'])
-    self.assertEqual(c, clstr.ClusterOf('a'))
-    self.assertEqual(c, clstr.ClusterOf('b'))
-    self.assertEqual(c, clstr.ClusterOf('c'))
+    self.assertEqual(['a'], clstr.ClusterOf('a'))
+    self.assertTrue(clstr.Combine('a', 'b'))
+    self.assertTrue(clstr.Combine('a', 'c'))
+    self.assertEqual(['a', 'b', 'c'], clstr.ClusterOf('a'))
+    self.assertEqual(['a', 'b', 'c'], clstr.ClusterOf('b'))
+    self.assertEqual(['a', 'b', 'c'], clstr.ClusterOf('c'))
 
   def testClusterCombine(self):
     clstr = cluster.Clustering()
-    x = clstr._MakeCluster(['a', 'b'])
-    self.assertEqual(x, clstr.ClusterOf('a'))
-    self.assertEqual(x, clstr.ClusterOf('b'))
-
-    y = clstr._MakeCluster(['c'])
-    self.assertEqual(y, clstr.ClusterOf('c'))
-
-    z = clstr.Combine(y, x)
-    self.assertEqual(['c', 'a', 'b'], z.syms)
-    self.assertEqual(z, clstr.ClusterOf('a'))
-    self.assertEqual(z, clstr.ClusterOf('b'))
-    self.assertEqual(z, clstr.ClusterOf('c'))
+    self.assertTrue(clstr.Combine('a', 'b'))
+    self.assertEqual(['a', 'b'], clstr.ClusterOf('a'))
+    self.assertEqual(['a', 'b'], clstr.ClusterOf('b'))
+    self.assertEqual(['c'], clstr.ClusterOf('c'))
+
+    self.assertTrue(clstr.Combine('c', 'a'))
+    self.assertEqual(['c', 'a', 'b'], clstr.ClusterOf('a'))
+    self.assertEqual(['c', 'a', 'b'], clstr.ClusterOf('b'))
+    self.assertEqual(['c', 'a', 'b'], clstr.ClusterOf('c'))
+    self.assertFalse(clstr.Combine('b', 'c'))
+
+    # Symbols are appended after a larger cluster's symbols.
+    self.assertTrue(clstr.Combine('c', 'd'))
+    self.assertTrue(clstr.Combine('e', 'a'))
+    self.assertEqual(['e', 'c', 'a', 'b', 'd'], clstr.ClusterOf('d'))
 
   def testClusteringDistances(self):
     c = cluster.Clustering()
@@ -46,7 +49,7 @@ class ClusteringTestCase(unittest.TestCase):
     c.AddSymbolLists([list('abcd'), list('acbe'), list('bacf'),
                       list('badf'), list('baef')])
     distances = {}
-    for n in c._neighbors:
+    for n in c._IterNeighbors():
       self.assertFalse((n.src, n.dst) in distances)
       distances[(n.src, n.dst)] = n.dist
     self.assertEqual(13, len(distances))
@@ -245,6 +245,9 @@ def _CreateArgumentParser():
                       help='Path to the unstripped instrumented library')
   parser.add_argument('--output', type=str, required=True,
                       help='Output filename')
+  parser.add_argument('--symbol-cache-dir', type=str, default=None,
+                      help=('Directory in which to cache symbol tables across '
+                            'runs. Disabled by default.'))
   return parser
 
 
@@ -253,6 +256,7 @@ def main():
   args = parser.parse_args()
 
   symbol_extractor.SetArchitecture(args.target_arch)
+  symbol_extractor.SetCacheDirectory(args.symbol_cache_dir)
 
   offsets = _ReadReachedOffsets(args.reached_offsets)
   assert offsets
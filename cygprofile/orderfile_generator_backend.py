@@ -616,6 +616,7 @@ class OrderfileGenerator(object):
                                                       options.netrc)
     assert os.path.isdir(constants.DIR_SOURCE_ROOT), 'No src directory found'
     symbol_extractor.SetArchitecture(options.arch)
+    symbol_extractor.SetCacheDirectory(options.symbol_cache_dir)
 
   @staticmethod
   def _RemoveBlanks(src_file, dest_file):
@@ -1012,6 +1013,9 @@ def CreateArgumentParser():
                             'checkout; performs no other action'))
   parser.add_argument('--new-commit-flow', action='store_true',
                       help='Use the new two-step commit flow.')
+  parser.add_argument('--symbol-cache-dir', default=None, type=str,
+                      help=('Directory in which to cache symbol tables across '
+                            'runs. Disabled by default.'))
 
   profile_android_startup.AddProfileCollectionArguments(parser)
   return parser
@@ -249,6 +249,9 @@ def _CreateArgumentParser():
   parser.add_argument('--native-library', required=True,
                       help='Path to the native library')
   parser.add_argument('--output-file', required=True, help='Output filename')
+  parser.add_argument('--symbol-cache-dir', default=None,
+                      help=('Directory in which to cache symbol tables across '
+                            'runs. Disabled by default.'))
   return parser
 
 
@@ -256,6 +259,7 @@ def main():
   parser = _CreateArgumentParser()
   options = parser.parse_args()
   symbol_extractor.SetArchitecture(options.target_arch)
+  symbol_extractor.SetCacheDirectory(options.symbol_cache_dir)
   GeneratePatchedOrderfile(options.unpatched_orderfile, options.native_library,
                            options.output_file)
   return 0
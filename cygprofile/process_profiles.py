@@ -6,12 +6,22 @@
 """Lists all the reached symbols from an instrumentation dump."""
 
 import argparse
+import array
+import bisect
 import collections
+import heapq
+import itertools
 import logging
+import multiprocessing
 import operator
 import os
 import sys
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 _SRC_PATH = os.path.abspath(os.path.join(
     os.path.dirname(__file__), os.pardir, os.pardir))
 path = os.path.join(_SRC_PATH, 'tools', 'cygprofile')
@@ -31,6 +41,86 @@ def _Median(items):
             sorted_items[len(sorted_items)/2]) / 2
 
 
+def _ReadOffsetsFile(filename):
+  """Returns the offsets from a dump file, as an array of ints."""
+  with open(filename) as f:
+    return array.array('l', (int(x) for x in f))
+
+
+class _DumpOffsetIndex(object):
+  """Maps halfwords of .text to the symbols that contain them.
+
+  The halfwords covered by symbols are stored as sorted, disjoint ranges, so
+  that memory use is proportional to the number of symbols rather than to the
+  size of .text. Where symbols overlap, a halfword maps to the symbol that
+  starts first.
+  """
+  def __init__(self, symbol_infos, start_of_text):
+    """Builds the index.
+
+    Args:
+      symbol_infos: ([symbol_extractor.SymbolInfo]) Symbols of the binary.
+      start_of_text: (int) Offset of the start of text symbol.
+    """
+    max_offset = max(s.offset + s.size for s in symbol_infos)
+    # Number of halfwords in .text.
+    self.length = (max_offset - start_of_text) / 2
+    self._starts = array.array('l')
+    self._ends = array.array('l')
+    self._symbol_infos = []
+    self._numpy_arrays = None
+    covered_end = 0
+    # sorted() is stable, so that the first of several symbols at the same
+    # offset is used.
+    for sym in sorted(symbol_infos, key=lambda s: s.offset):
+      offset = sym.offset - start_of_text
+      assert offset >= 0, ('Unexpected symbol before the start of text. '
+                           'Has the linker script broken?')
+      # The low bit of offset may be set to indicate a thumb instruction. The
+      # actual offset is still halfword aligned and so the low bit may be
+      # safely ignored in the division by two below.
+      start = max(offset / 2, covered_end)
+      end = (offset + sym.size) / 2
+      # There may be overlapping symbols, for example fancy implementations
+      # for __ltsf2 and __gtsf2 (merging common tail code). In this case, keep
+      # the one that started first.
+      if start < end:
+        self._starts.append(start)
+        self._ends.append(end)
+        self._symbol_infos.append(sym)
+        covered_end = end
+
+  def Lookup(self, halfword):
+    """Returns the symbol containing |halfword|, or None."""
+    i = bisect.bisect_right(self._starts, halfword) - 1
+    if i >= 0 and halfword < self._ends[i]:
+      return self._symbol_infos[i]
+    return None
+
+  def LookupAll(self, halfwords):
+    """Returns the symbol (or None) containing each of |halfwords|."""
+    if numpy is None:
+      return [self.Lookup(h) for h in halfwords]
+    if self._numpy_arrays is None:
+      self._numpy_arrays = (numpy.array(self._starts, dtype=numpy.int64),
+                            numpy.array(self._ends, dtype=numpy.int64))
+    starts, ends = self._numpy_arrays
+    halfwords = numpy.array(halfwords, dtype=numpy.int64)
+    positions = numpy.searchsorted(starts, halfwords, side='right') - 1
+    found = (positions >= 0) & (halfwords < ends[positions])
+    symbol_infos = self._symbol_infos
+    return [symbol_infos[i] if f else None
+            for i, f in itertools.izip(positions.tolist(), found.tolist())]
+
+  def ToList(self):
+    """Returns a list with the symbol (or None) for each halfword of .text."""
+    ret = [None] * self.length
+    for start, end, sym in itertools.izip(self._starts, self._ends,
+                                          self._symbol_infos):
+      ret[start:end] = [sym] * (end - start)
+    return ret
+
+
 class SymbolOffsetProcessor(object):
   """Utility for processing symbols in binaries.
 
@@ -58,7 +148,7 @@ class SymbolOffsetProcessor(object):
     self._name_to_symbol = None
     self._offset_to_primary = None
     self._offset_to_symbols = None
-    self._offset_to_symbol_info = None
+    self._dump_offset_index = None
 
   def SymbolInfos(self):
     """The symbols associated with this processor's binary.
@@ -69,9 +159,10 @@ class SymbolOffsetProcessor(object):
       [symbol_extractor.SymbolInfo]
     """
     if self._symbol_infos is None:
-      self._symbol_infos = symbol_extractor.SymbolInfosFromBinary(
-          self._binary_filename)
-      self._symbol_infos.sort(key=lambda s: s.offset)
+      table = symbol_extractor.SymbolTableFromBinary(self._binary_filename)
+      self._symbol_infos = sorted(table.symbol_infos, key=lambda s: s.offset)
+      if self._offset_to_symbols is None:
+        self._offset_to_symbols = table.ByOffset()
       logging.info('%d symbols from %s',
                    len(self._symbol_infos), self._binary_filename)
     return self._symbol_infos
@@ -232,48 +323,39 @@ class SymbolOffsetProcessor(object):
       get: (lambda item) As described above.
       update: (lambda item, int) As described above.
     """
-    dump_offset_to_symbol_info = self.GetDumpOffsetToSymbolInfo()
-    for i in items:
-      dump_offset = get(i)
-      idx = dump_offset / 2
-      assert dump_offset >= 0 and idx < len(dump_offset_to_symbol_info), (
+    items = list(items)
+    dump_offsets = [get(i) for i in items]
+    index = self._GetDumpOffsetIndex()
+    if dump_offsets:
+      assert min(dump_offsets) >= 0 and max(dump_offsets) / 2 < index.length, (
           'Dump offset out of binary range')
-      symbol_info = dump_offset_to_symbol_info[idx]
+    symbol_infos = index.LookupAll([o / 2 for o in dump_offsets])
+    for i, dump_offset, symbol_info in itertools.izip(items, dump_offsets,
+                                                      symbol_infos):
       assert symbol_info, ('A return address (offset = 0x{:08x}) does not map '
           'to any symbol'.format(dump_offset))
       update(i, symbol_info.offset)
 
+  def _GetDumpOffsetIndex(self):
+    if self._dump_offset_index is None:
+      start_syms = [s for s in self.SymbolInfos()
+                    if s.name == cygprofile_utils.START_OF_TEXT_SYMBOL]
+      assert len(start_syms) == 1, 'Can\'t find unique start of text symbol'
+      self._dump_offset_index = _DumpOffsetIndex(self.SymbolInfos(),
+                                                 start_syms[0].offset)
+    return self._dump_offset_index
+
   def GetDumpOffsetToSymbolInfo(self):
-    """Computes an array mapping each word in .text to a symbol.
+    """Computes an array mapping each halfword in .text to a symbol.
+
+    This is expensive for large binaries. Lookups of dump offsets use a compact
+    index instead.
 
     Returns:
-      [symbol_extractor.SymbolInfo or None] For every 4 bytes of the .text
+      [symbol_extractor.SymbolInfo or None] For every 2 bytes of the .text
         section, maps it to a symbol, or None.
     """
-    if self._offset_to_symbol_info is None:
-      start_syms = [s for s in self.SymbolInfos()
-                    if s.name == cygprofile_utils.START_OF_TEXT_SYMBOL]
-      assert len(start_syms) == 1, 'Can\'t find unique start of text symbol'
-      start_of_text = start_syms[0].offset
-      max_offset = max(s.offset + s.size for s in self.SymbolInfos())
-      text_length_halfwords = (max_offset - start_of_text) / 2
-      self._offset_to_symbol_info = [None] * text_length_halfwords
-      for sym in self.SymbolInfos():
-        offset = sym.offset - start_of_text
-        assert offset >= 0, ('Unexpected symbol before the start of text. '
-                             'Has the linker script broken?')
-        # The low bit of offset may be set to indicate a thumb instruction. The
-        # actual offset is still halfword aligned and so the low bit may be
-        # safely ignored in the division by two below.
-        for i in range(offset / 2, (offset + sym.size) / 2):
-          assert i < text_length_halfwords
-          other_symbol = self._offset_to_symbol_info[i]
-          # There may be overlapping symbols, for example fancy
-          # implementations for __ltsf2 and __gtsf2 (merging common tail
-          # code). In this case, keep the one that started first.
-          if other_symbol is None or other_symbol.offset > sym.offset:
-            self._offset_to_symbol_info[i] = sym
-    return self._offset_to_symbol_info
+    return self._GetDumpOffsetIndex().ToList()
 
 
 class ProfileManager(object):
@@ -374,14 +456,17 @@ class ProfileManager(object):
       return abs(ProfileManager._Timestamp(filename) -
                  run_group_ts) < self.RUN_GROUP_THRESHOLD_NS
 
-  def __init__(self, filenames):
+  def __init__(self, filenames, jobs=1):
     """Initialize a ProfileManager.
 
     Args:
       filenames ([str]): List of filenames describe the profile set.
+      jobs (int): Number of processes to read dump files with.
     """
     self._filenames = sorted(filenames, key=self._Timestamp)
     self._run_groups = None
+    self._jobs = jobs
+    self._offsets_by_filename = None
 
   def GetPhases(self):
     """Return the set of phases of all orderfiles.
@@ -410,23 +495,30 @@ class ProfileManager(object):
     """Merges offsets across run groups and annotates each one.
 
     Returns:
-      [AnnotatedOffset]
+      [AnnotatedOffset] Sorted by offset.
     """
-    offset_map = {}  # offset int -> AnnotatedOffset
+    # K-way merge of the sorted dumps, where each offset is tagged with the
+    # (phase, process) of its dump.
+    tagged_dumps = []
     for g in self._GetRunGroups():
       for f in g:
-        phase = self._Phase(f)
-        process = self._ProcessName(f)
-        for offset in self._ReadOffsets(f):
-          offset_map.setdefault(offset, self.AnnotatedOffset(offset)).Increment(
-              phase, process)
-    return offset_map.values()
+        key = (self._Phase(f), self._ProcessName(f))
+        tagged_dumps.append(itertools.izip(sorted(self._GetOffsets(f)),
+                                           itertools.repeat(key)))
+    annotated_offsets = []
+    for offset, tagged_offsets in itertools.groupby(
+        heapq.merge(*tagged_dumps), key=operator.itemgetter(0)):
+      annotated_offset = self.AnnotatedOffset(offset)
+      for _, (phase, process) in tagged_offsets:
+        annotated_offset.Increment(phase, process)
+      annotated_offsets.append(annotated_offset)
+    return annotated_offsets
 
   def GetProcessOffsetLists(self):
     """Returns all symbol offsets lists, grouped by process."""
     offsets_by_process = collections.defaultdict(list)
     for f in self._filenames:
-      offsets_by_process[self._ProcessName(f)].append(self._ReadOffsets(f))
+      offsets_by_process[self._ProcessName(f)].append(self._GetOffsets(f))
     return offsets_by_process
 
   def GetRunGroupOffsets(self, phase=None):
@@ -441,7 +533,7 @@ class ProfileManager(object):
     return [self._GetOffsetsForGroup(g) for g in self._GetRunGroups(phase)]
 
   def _GetOffsetsForGroup(self, filenames):
-    dumps = [self._ReadOffsets(f) for f in filenames]
+    dumps = [self._GetOffsets(f) for f in filenames]
     seen_offsets = set()
     result = []
     for dump in dumps:
@@ -477,7 +569,30 @@ class ProfileManager(object):
     return int(filename.split('_')[-1])
 
   def _ReadOffsets(self, filename):
-    return [int(x.strip()) for x in open(filename)]
+    return _ReadOffsetsFile(filename)
+
+  def _GetOffsets(self, filename):
+    """Returns the offsets of a dump file.
+
+    All dump files are read on first use (in parallel when |jobs| > 1).
+    """
+    if self._offsets_by_filename is None:
+      if self._jobs > 1 and len(self._filenames) > 1:
+        pool = multiprocessing.Pool(min(self._jobs, len(self._filenames)))
+        try:
+          all_offsets = pool.map(_ReadOffsetsFile, self._filenames)
+          pool.close()
+        except:
+          pool.terminate()
+          raise
+        finally:
+          pool.join()
+      else:
+        all_offsets = [self._ReadOffsets(f) for f in self._filenames]
+      self._offsets_by_filename = dict(zip(self._filenames, all_offsets))
+      logging.info('Read %d offsets from %d dump files',
+                   sum(len(o) for o in all_offsets), len(all_offsets))
+    return self._offsets_by_filename[filename]
 
   def _ComputeRunGroups(self):
     self._run_groups = []
@@ -543,6 +658,9 @@ def CreateArgumentParser():
   parser.add_argument('--library-name', default='libchrome.so',
                       help=('Chrome shared library name (usually libchrome.so '
                             'or libmonochrome.so'))
+  parser.add_argument('--jobs', type=int, default=1,
+                      help=('Number of processes to read dump files with. '
+                            'Only worth it for many large dumps.'))
   return parser
 
 
@@ -552,7 +670,7 @@ def main():
   args = parser.parse_args()
   logging.info('Merging dumps')
   dump_files = args.dumps.split(',')
-  profile_manager = ProfileManager(dump_files)
+  profile_manager = ProfileManager(dump_files, jobs=args.jobs)
   profile_manager.SortByTimestamp()
   dumps = profile_manager.GetMergedOffsets()
 
@@ -6,6 +6,9 @@
 """Tests for process_profiles.py."""
 
 import collections
+import os
+import shutil
+import tempfile
 import unittest
 
 import process_profiles
@@ -65,6 +68,20 @@ class ProcessProfilesTestCase(unittest.TestCase):
     reached = processor.GetReachedOffsetsFromDump(dump)
     self.assertListEqual([self.symbol_3.offset, self.symbol_1.offset], reached)
 
+  def testGetReachedOffsetsFromDumpOverlappingSymbols(self):
+    symbol_0 = SimpleTestSymbol(self.START_SYMBOL, 0, 0)
+    symbol_1 = SimpleTestSymbol('1', 8, 16)
+    symbol_2 = SimpleTestSymbol('2', 16, 16)
+    symbol_3 = SimpleTestSymbol('3', 12, 4)
+    processor = TestSymbolOffsetProcessor(
+        [symbol_0, symbol_2, symbol_3, symbol_1])
+    dump = [30, 14, 22, 8]
+    self.assertListEqual([symbol_2.offset, symbol_1.offset],
+                         processor.GetReachedOffsetsFromDump(dump))
+    self.assertRaises(AssertionError, processor.GetReachedOffsetsFromDump, [4])
+    self.assertRaises(AssertionError, processor.GetReachedOffsetsFromDump,
+                      [32])
+
   def testSymbolNameToPrimary(self):
     symbol_infos = [SimpleTestSymbol('1', 8, 16),
                     SimpleTestSymbol('AnAlias', 8, 16),
@@ -173,6 +190,27 @@ class ProcessProfilesTestCase(unittest.TestCase):
     self.assertListEqual([8, 10], mgr.GetMergedOffsets(1))
     self.assertListEqual([], mgr.GetMergedOffsets(2))
 
+  def testReadDumpFilesInParallel(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      contents = {ProfileFile(30, 0): [1, 3, 5, 7],
+                  ProfileFile(40, 1): [8, 10],
+                  ProfileFile(50, 0): [13, 3]}
+      files = []
+      for name, offsets in contents.iteritems():
+        filename = os.path.join(tmp_dir, os.path.basename(name))
+        with open(filename, 'w') as f:
+          f.write(''.join('%d\n' % o for o in offsets))
+        files.append(filename)
+      mgr = process_profiles.ProfileManager(files, jobs=2)
+      self.assertListEqual([1, 3, 5, 7, 8, 10, 13], mgr.GetMergedOffsets())
+      self.assertListEqual([1, 3, 5, 7, 13], mgr.GetMergedOffsets(0))
+      self.assertListEqual(
+          [1, 3, 5, 7, 8, 10, 13],
+          [o.Offset() for o in mgr.GetAnnotatedOffsets()])
+    finally:
+      shutil.rmtree(tmp_dir)
+
   def testRunGroupOffsets(self):
     mgr = TestProfileManager({
         ProfileFile(30, 0): [1, 2, 3, 4],
@@ -4,12 +4,19 @@
 
 """Utilities to get and manipulate symbols from a binary."""
 
+import array
 import collections
+import hashlib
 import logging
+import marshal
 import os
 import re
+import stat
+import struct
 import subprocess
 import sys
+import tempfile
+import zlib
 
 import cygprofile_utils
 
@@ -24,9 +31,21 @@ _MAX_WARNINGS_TO_PRINT = 200
 SymbolInfo = collections.namedtuple('SymbolInfo', ('name', 'offset', 'size',
                                                    'section'))
 
+# Bump whenever the layout of cache entries changes.
+_CACHE_VERSION = 2
+_CACHE_READ_SIZE = 1 << 20
+# Entries beyond this count are evicted, least recently used first.
+_CACHE_MAX_ENTRIES = 32
+_CACHE_SUFFIX = '.symbols'
+
 # Unfortunate global variable :-/
 _arch = 'arm'
 
+# Directory of the on-disk symbol table cache, or None if disabled (the
+# default). It can be shared by all the scripts in this directory, as entries
+# are keyed by binary content.
+_cache_dir = None
+
 
 def SetArchitecture(arch):
   """Set the architecture for binaries to be symbolized."""
@@ -34,6 +53,20 @@ def SetArchitecture(arch):
   _arch = arch
 
 
+def SetCacheDirectory(path):
+  """Sets the directory of the on-disk symbol table cache (None disables it).
+
+  The directory is created with mode 0700 if needed. Entries are only trusted
+  when the directory is owned by the current user and not writable by others,
+  since they are loaded with marshal.
+
+  Must be called before fork()ing worker processes in order for them to use the
+  same cache.
+  """
+  global _cache_dir
+  _cache_dir = path
+
+
 # Regular expression to match lines printed by 'objdump -t -w'. An example of
 # such line looks like this:
 # 018db2de l     F .text  00000060              .hidden _ZN8SkBitmapC2ERKS_
@@ -184,23 +217,250 @@ def _SymbolInfosFromStream(objdump_lines):
   return symbol_infos
 
 
+def _SymbolInfosFromObjdump(binary_filename):
+  """Runs objdump and parses the symbols of a binary from its output."""
+  command = (host_paths.ToolPath('objdump', _arch), '-t', '-w', binary_filename)
+  p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE)
+  try:
+    result = _SymbolInfosFromStream(p.stdout)
+    return result
+  finally:
+    p.stdout.close()
+    p.wait()
+
+
+def _GroupInOrder(symbol_infos, order, key):
+  """Groups symbol_infos by key, given the indices of symbols sorted by key."""
+  groups = {}
+  group = None
+  prev_key = None
+  for i in order:
+    symbol_info = symbol_infos[i]
+    k = key(symbol_info)
+    if group is None or k != prev_key:
+      group = []
+      groups[k] = group
+      prev_key = k
+    group.append(symbol_info)
+  return groups
+
+
+class SymbolTable(object):
+  """The symbols of a binary, along with a precomputed index on them.
+
+  The index is stored as a list of symbol indices, stably sorted by offset. It
+  is computed once per binary and saved in the cache.
+  """
+
+  def __init__(self, symbol_infos, offset_order=None):
+    self.symbol_infos = symbol_infos
+    if offset_order is None:
+      offset_order = sorted(xrange(len(symbol_infos)),
+                            key=lambda i: symbol_infos[i].offset)
+    self._offset_order = offset_order
+
+  def ByOffset(self):
+    """Same as GroupSymbolInfosByOffset(self.symbol_infos)."""
+    return _GroupInOrder(self.symbol_infos, self._offset_order,
+                         lambda s: s.offset)
+
+  def Serialize(self):
+    """Returns the table in a compact binary form."""
+    sections = sorted(set(s.section for s in self.symbol_infos))
+    section_to_index = {name: i for i, name in enumerate(sections)}
+    data = (
+        _CACHE_VERSION,
+        [s.name for s in self.symbol_infos],
+        array.array('L', (s.offset for s in self.symbol_infos)).tostring(),
+        array.array('L', (s.size for s in self.symbol_infos)).tostring(),
+        sections,
+        array.array('l', (section_to_index[s.section]
+                          for s in self.symbol_infos)).tostring(),
+        array.array('l', self._offset_order).tostring())
+    return zlib.compress(marshal.dumps(data), 1)
+
+  @staticmethod
+  def Deserialize(data):
+    """Inverse of Serialize(). Returns None for entries of other versions."""
+    data = marshal.loads(zlib.decompress(data))
+    if data[0] != _CACHE_VERSION:
+      return None
+    _, names, offsets, sizes, sections, section_indices, offset_order = data
+    def load(typecode, s):
+      ret = array.array(typecode)
+      ret.fromstring(s)
+      return ret
+    symbol_infos = [
+        SymbolInfo(name=name, offset=offset, size=size, section=sections[i])
+        for name, offset, size, i in zip(
+            names, load('L', offsets), load('L', sizes),
+            load('l', section_indices))]
+    return SymbolTable(symbol_infos, load('l', offset_order).tolist())
+
+
+def _ReadBuildId(binary_filename):
+  """Returns the GNU build-id of an ELF file as hex, or None if it has none."""
+  with open(binary_filename, 'rb') as f:
+    ident = f.read(16)
+    if len(ident) < 16 or ident[:4] != '\x7fELF':
+      return None
+    endian = '<' if ident[5] == '\x01' else '>'
+    if ident[4] == '\x02':
+      header_format = endian + 'Q10xHH'
+      section_format = endian + 'II16xQQ'
+      f.seek(0x28)
+    else:
+      header_format = endian + 'I10xHH'
+      section_format = endian + 'II8xII'
+      f.seek(0x20)
+    shoff, shentsize, shnum = struct.unpack(
+        header_format, f.read(struct.calcsize(header_format)))
+    f.seek(shoff)
+    section_headers = f.read(shentsize * shnum)
+    for i in xrange(0, len(section_headers) - shentsize + 1, shentsize):
+      _, sh_type, sh_offset, sh_size = struct.unpack_from(
+          section_format, section_headers, i)
+      if sh_type != 7:  # SHT_NOTE
+        continue
+      f.seek(sh_offset)
+      notes = f.read(sh_size)
+      pos = 0
+      while pos + 12 <= len(notes):
+        namesz, descsz, note_type = struct.unpack_from(endian + 'III', notes,
+                                                       pos)
+        name_start = pos + 12
+        desc_start = name_start + ((namesz + 3) & ~3)
+        if note_type == 3 and notes[name_start:name_start + namesz] == 'GNU\0':
+          return notes[desc_start:desc_start + descsz].encode('hex')
+        pos = desc_start + ((descsz + 3) & ~3)
+  return None
+
+
+def _CacheKey(binary_filename):
+  """Returns the key of a binary in the cache.
+
+  The GNU build-id is used when present, as it avoids reading the whole binary.
+  The file size is part of the key, since stripping a binary keeps its build-id.
+  """
+  size = os.path.getsize(binary_filename)
+  content_id = _ReadBuildId(binary_filename)
+  if content_id is None:
+    content_hash = hashlib.sha1()
+    with open(binary_filename, 'rb') as f:
+      for block in iter(lambda: f.read(_CACHE_READ_SIZE), ''):
+        content_hash.update(block)
+    content_id = 'sha1-' + content_hash.hexdigest()
+  return hashlib.sha1('%d:%s:%s:%d' % (
+      _CACHE_VERSION, _arch, content_id, size)).hexdigest()
+
+
+def _PrepareCacheDirectory():
+  """Creates the cache directory if needed and checks that it can be trusted.
+
+  Returns:
+    True if entries of the cache directory can be read and written.
+  """
+  try:
+    os.makedirs(_cache_dir, 0700)
+  except OSError:
+    # Already exists, or created concurrently by another process.
+    pass
+  try:
+    st = os.lstat(_cache_dir)
+  except OSError as e:
+    logging.warning('Symbol cache directory %s is unusable: %s', _cache_dir, e)
+    return False
+  if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+      st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+    logging.warning('Not using symbol cache directory %s: it must be a '
+                    'directory owned by the current user and not writable by '
+                    'others', _cache_dir)
+    return False
+  return True
+
+
+def _ReadCachedTable(cache_path):
+  try:
+    with open(cache_path, 'rb') as f:
+      table = SymbolTable.Deserialize(f.read())
+    # Marks the entry as recently used, for eviction.
+    os.utime(cache_path, None)
+    return table
+  except (IOError, OSError):
+    return None
+  except (ValueError, EOFError, TypeError, IndexError, zlib.error) as e:
+    logging.warning('Ignoring corrupt symbol cache entry %s: %s', cache_path, e)
+    return None
+
+
+def _EvictCachedTables():
+  """Removes the least recently used entries beyond _CACHE_MAX_ENTRIES."""
+  entries = []
+  for name in os.listdir(_cache_dir):
+    if not name.endswith(_CACHE_SUFFIX):
+      continue
+    path = os.path.join(_cache_dir, name)
+    try:
+      entries.append((os.path.getmtime(path), path))
+    except OSError:
+      # Evicted concurrently by another process.
+      pass
+  entries.sort(reverse=True)
+  for _, path in entries[_CACHE_MAX_ENTRIES:]:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+def _WriteCachedTable(cache_path, table):
+  try:
+    # Written to a temporary file first so that concurrent readers never see
+    # partial entries.
+    fd, tmp_path = tempfile.mkstemp(dir=_cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(table.Serialize())
+    os.rename(tmp_path, cache_path)
+    _EvictCachedTables()
+  except (IOError, OSError) as e:
+    logging.warning('Failed to write symbol cache entry %s: %s', cache_path, e)
+
+
+def SymbolTableFromBinary(binary_filename):
+  """Gets the symbols of a binary, from the cache if possible.
+
+  Args:
+    binary_filename: path to the binary.
+
+  Returns:
+    A SymbolTable.
+  """
+  cache_path = None
+  if _cache_dir and _PrepareCacheDirectory():
+    cache_path = os.path.join(_cache_dir,
+                              _CacheKey(binary_filename) + _CACHE_SUFFIX)
+    table = _ReadCachedTable(cache_path)
+    if table is not None:
+      logging.debug('Read symbols of %s from %s', binary_filename, cache_path)
+      return table
+  table = SymbolTable(_SymbolInfosFromObjdump(binary_filename))
+  if cache_path:
+    _WriteCachedTable(cache_path, table)
+  return table
+
+
 def SymbolInfosFromBinary(binary_filename):
   """Runs objdump to get all the symbols from a binary.
 
+  Results can be cached on disk, see SetCacheDirectory().
+
   Args:
     binary_filename: path to the binary.
 
   Returns:
     A list of SymbolInfo from the binary.
   """
-  command = (host_paths.ToolPath('objdump', _arch), '-t', '-w', binary_filename)
-  p = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE)
-  try:
-    result = _SymbolInfosFromStream(p.stdout)
-    return result
-  finally:
-    p.stdout.close()
-    p.wait()
+  return SymbolTableFromBinary(binary_filename).symbol_infos
 
 
 _LLVM_NM_LINE_RE = re.compile(
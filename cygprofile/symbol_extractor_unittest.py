@@ -3,6 +3,10 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
+import shutil
+import struct
+import tempfile
 import unittest
 
 import symbol_extractor
@@ -199,5 +203,118 @@ class TestSymbolInfoMappings(unittest.TestCase):
       self.assertIn(name, name_to_symbol_info)
       self.assertEquals(self.symbol_infos[i], name_to_symbol_info[name])
 
+def _MinimalElfWithBuildId(build_id):
+  """Returns the contents of a 64-bit ELF file with a single note section."""
+  note = struct.pack('<III', 4, len(build_id), 3) + 'GNU\0' + build_id
+  section_headers_offset = 64 + len(note)
+  header = ('\x7fELF\x02\x01\x01' + '\0' * 9 +
+            struct.pack('<HHIQQQIHHHHHH', 3, 183, 1, 0, 0,
+                        section_headers_offset, 0, 64, 0, 0, 64, 2, 0))
+  section_headers = ('\0' * 64 +
+                     struct.pack('<IIQQQQIIQQ', 0, 7, 0, 0, 64, len(note),
+                                 0, 0, 4, 0))
+  return header + note + section_headers
+
+
+class TestSymbolTableCache(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._orig_symbol_infos_from_objdump = (
+        symbol_extractor._SymbolInfosFromObjdump)
+    self._orig_cache_dir = symbol_extractor._cache_dir
+    self._objdump_calls = []
+    self.symbol_infos = [
+        symbol_extractor.SymbolInfo('second', 0x64, 20, '.text'),
+        symbol_extractor.SymbolInfo('first', 0x42, 42, '.text'),
+        symbol_extractor.SymbolInfo('alias', 0x42, 42, '.text.hot'),
+        symbol_extractor.SymbolInfo('second', 0x80, 4, '.text')]
+
+    def symbol_infos_from_objdump(binary_filename):
+      self._objdump_calls.append(binary_filename)
+      return list(self.symbol_infos)
+
+    symbol_extractor._SymbolInfosFromObjdump = symbol_infos_from_objdump
+    symbol_extractor.SetCacheDirectory(os.path.join(self._tmp_dir, 'cache'))
+
+  def tearDown(self):
+    symbol_extractor._SymbolInfosFromObjdump = (
+        self._orig_symbol_infos_from_objdump)
+    symbol_extractor.SetCacheDirectory(self._orig_cache_dir)
+    shutil.rmtree(self._tmp_dir)
+
+  def _WriteBinary(self, contents):
+    path = os.path.join(self._tmp_dir, 'libfoo.so')
+    with open(path, 'wb') as f:
+      f.write(contents)
+    return path
+
+  def testBuildId(self):
+    path = self._WriteBinary(_MinimalElfWithBuildId('\x12\x34\xab'))
+    self.assertEquals('1234ab', symbol_extractor._ReadBuildId(path))
+    path = self._WriteBinary('not an ELF file')
+    self.assertIsNone(symbol_extractor._ReadBuildId(path))
+
+  def testCache(self):
+    path = self._WriteBinary('binary contents')
+    self.assertEquals(self.symbol_infos,
+                      symbol_extractor.SymbolInfosFromBinary(path))
+    table = symbol_extractor.SymbolTableFromBinary(path)
+    self.assertEquals(1, len(self._objdump_calls))
+    self.assertEquals(self.symbol_infos, table.symbol_infos)
+    self.assertEquals(
+        symbol_extractor.GroupSymbolInfosByOffset(self.symbol_infos),
+        table.ByOffset())
+
+    # Changing the binary invalidates its entry.
+    self._WriteBinary('other binary contents')
+    symbol_extractor.SymbolInfosFromBinary(path)
+    self.assertEquals(2, len(self._objdump_calls))
+
+  def testCacheDisabled(self):
+    self.assertIsNone(self._orig_cache_dir)
+    symbol_extractor.SetCacheDirectory(None)
+    path = self._WriteBinary('binary contents')
+    symbol_extractor.SymbolInfosFromBinary(path)
+    symbol_extractor.SymbolInfosFromBinary(path)
+    self.assertEquals(2, len(self._objdump_calls))
+
+  def testCacheDirectoryPermissions(self):
+    path = self._WriteBinary('binary contents')
+    symbol_extractor.SymbolInfosFromBinary(path)
+    cache_dir = os.path.join(self._tmp_dir, 'cache')
+    self.assertEquals(0700, os.stat(cache_dir).st_mode & 0777)
+
+    # Entries of a directory writable by others are not trusted.
+    os.chmod(cache_dir, 0777)
+    symbol_extractor.SymbolInfosFromBinary(path)
+    self.assertEquals(2, len(self._objdump_calls))
+    os.chmod(cache_dir, 0700)
+    symbol_extractor.SymbolInfosFromBinary(path)
+    self.assertEquals(2, len(self._objdump_calls))
+
+  def testCacheEviction(self):
+    orig_max_entries = symbol_extractor._CACHE_MAX_ENTRIES
+    symbol_extractor._CACHE_MAX_ENTRIES = 2
+    try:
+      cache_dir = os.path.join(self._tmp_dir, 'cache')
+      path = self._WriteBinary('binary 0')
+      symbol_extractor.SymbolInfosFromBinary(path)
+      for i in xrange(1, 4):
+        # Makes entries distinguishable by their modification time.
+        for name in os.listdir(cache_dir):
+          entry = os.path.join(cache_dir, name)
+          mtime = os.path.getmtime(entry) - 10
+          os.utime(entry, (mtime, mtime))
+        self._WriteBinary('binary %d' % i)
+        symbol_extractor.SymbolInfosFromBinary(path)
+      self.assertEquals(2, len(os.listdir(cache_dir)))
+      # The most recent entry is kept.
+      symbol_extractor.SymbolInfosFromBinary(path)
+      self.assertEquals(4, len(self._objdump_calls))
+    finally:
+      symbol_extractor._CACHE_MAX_ENTRIES = orig_max_entries
+
+
 if __name__ == '__main__':
   unittest.main()
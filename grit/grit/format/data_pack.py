@@ -9,6 +9,7 @@ files.
 
 import collections
 import exceptions
+import mmap
 import os
 import struct
 import sys
@@ -71,6 +72,100 @@ class DataPackContents(object):
     self.sizes = sizes
 
 
+class DataPack(object):
+  """A read-only view of a data pack file, backed by an mmap.
+
+  Only the header and the index tables are read when the file is opened.
+  Resources are slices of the mapping (memoryviews, or buffers on Python 2,
+  where mmap objects do not support memoryview) and are not copied until used.
+  The slices must not be used after Close().
+  """
+
+  def __init__(self, input_file):
+    with open(input_file, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      self._view = memoryview(self._mmap)
+    except TypeError:
+      self._view = None
+
+    data = self._mmap
+    self.version = struct.unpack_from('<I', data, 0)[0]
+    if self.version == 4:
+      resource_count, self.encoding = struct.unpack_from('<IB', data, 4)
+      alias_count = 0
+      header_size = 9
+    elif self.version == 5:
+      self.encoding, resource_count, alias_count = struct.unpack_from(
+          '<BxxxHH', data, 4)
+      header_size = 12
+    else:
+      self.Close()
+      raise WrongFileVersion('Found version: ' + str(self.version))
+
+    # Each entry is a uint16 and a uint32, with an extra entry at the end.
+    kIndexEntrySize = 2 + 4
+    index = struct.unpack_from('<' + 'HI' * (resource_count + 1), data,
+                               header_size)
+    self._ids = index[0::2]
+    self._offsets = index[1::2]
+    self._index_by_id = dict(
+        (resource_id, i) for i, resource_id in enumerate(self._ids[:-1]))
+
+    id_table_size = (resource_count + 1) * kIndexEntrySize
+    kAliasEntrySize = 2 + 2  # uint16, uint16
+    aliases = struct.unpack_from('<' + 'HH' * alias_count, data,
+                                 header_size + id_table_size)
+    # Map of resource_id->canonical_resource_id
+    self.aliases = {}
+    for resource_id, i in zip(aliases[0::2], aliases[1::2]):
+      self.aliases[resource_id] = self._ids[i]
+      self._index_by_id[resource_id] = i
+
+    alias_table_size = kAliasEntrySize * alias_count
+    self.sizes = DataPackSizes(
+        header_size, id_table_size, alias_table_size,
+        len(data) - header_size - id_table_size - alias_table_size)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.Close()
+
+  def Close(self):
+    self._view = None
+    try:
+      self._mmap.close()
+    except BufferError:
+      pass  # Slices are still referenced, the mmap is closed once collected.
+
+  def __len__(self):
+    return len(self._index_by_id)
+
+  def __contains__(self, resource_id):
+    return resource_id in self._index_by_id
+
+  def __getitem__(self, resource_id):
+    i = self._index_by_id[resource_id]
+    start, end = self._offsets[i], self._offsets[i + 1]
+    if self._view is not None:
+      return self._view[start:end]
+    return buffer(self._mmap, start, end - start)
+
+  def keys(self):
+    return self._index_by_id.keys()
+
+  def iteritems(self):
+    """Yields (resource_id, slice) in ascending resource_id order."""
+    for resource_id in sorted(self._index_by_id):
+      yield resource_id, self[resource_id]
+
+  def GetResources(self):
+    """Returns a map of resource_id -> slice, as DataPackContents.resources."""
+    return dict(self.iteritems())
+
+
 def Format(root, lang='en', output_dir='.'):
   """Writes out the data pack file format (platform agnostic resource file)."""
   id_map = root.GetIdMap()
@@ -144,6 +239,16 @@ def ReadDataPackFromString(data):
 
 def WriteDataPackToString(resources, encoding):
   """Returns a string with a map of id=>data in the data pack format."""
+  return ''.join(_DataPackChunks(resources, encoding))
+
+
+def _DataPackChunks(resources, encoding):
+  """Returns the list of chunks of a map of id=>data in the data pack format.
+
+  The header and the tables come first, then the resource data, which is not
+  copied: the chunks are the values of |resources| (strings, buffers or
+  memoryviews).
+  """
   ret = []
 
   # Compute alias map.
@@ -189,15 +294,14 @@ def WriteDataPackToString(resources, encoding):
     ret.append(struct.pack('<HH', resource_id, index))
 
   # Write data.
-  ret.extend(deduped_data)
-  return ''.join(ret)
+  return [''.join(ret)] + deduped_data
 
 
 def WriteDataPack(resources, output_file, encoding):
   """Writes a map of id=>data into output_file as a data pack."""
-  content = WriteDataPackToString(resources, encoding)
   with open(output_file, 'wb') as file:
-    file.write(content)
+    for chunk in _DataPackChunks(resources, encoding):
+      file.write(chunk)
 
 
 def RePack(output_file, input_files, whitelist_file=None,
@@ -217,7 +321,6 @@ def RePack(output_file, input_files, whitelist_file=None,
       KeyError: if there are duplicate keys or resource encoding is
       inconsistent.
   """
-  input_data_packs = [ReadDataPack(filename) for filename in input_files]
   input_info_files = [filename + '.info' for filename in input_files]
   whitelist = None
   if whitelist_file:
@@ -225,10 +328,21 @@ def RePack(output_file, input_files, whitelist_file=None,
     if not lines:
       raise Exception('Whitelist file should not be empty')
     whitelist = set(int(x) for x in lines)
-  inputs = [(p.resources, p.encoding) for p in input_data_packs]
-  resources, encoding = RePackFromDataPackStrings(
-      inputs, whitelist, suppress_removed_key_output)
-  WriteDataPack(resources, output_file, encoding)
+  # The inputs are mapped rather than read: the first pass (combining the
+  # inputs and computing the aliases and the tables) only reads the index
+  # tables and hashes the data, the second one streams the data from the
+  # mappings to the output.
+  input_data_packs = [DataPack(filename) for filename in input_files]
+  try:
+    inputs = [(p.GetResources(), p.encoding) for p in input_data_packs]
+    resources, encoding = RePackFromDataPackStrings(
+        inputs, whitelist, suppress_removed_key_output)
+    del inputs
+    WriteDataPack(resources, output_file, encoding)
+    del resources
+  finally:
+    for data_pack in input_data_packs:
+      data_pack.Close()
   with open(output_file + '.info', 'w') as output_info_file:
     for filename in input_info_files:
       with open(filename, 'r') as info_file:
@@ -7,7 +7,9 @@
 
 
 import os
+import shutil
 import sys
+import tempfile
 if __name__ == '__main__':
   sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
@@ -69,6 +71,60 @@ class FormatDataPackUnittest(unittest.TestCase):
     loaded = data_pack.ReadDataPackFromString(expected_data)
     self.assertDictEqual(expected_data_pack.__dict__, loaded.__dict__)
 
+  def testDataPack(self):
+    input_resources = {
+        1: '',
+        4: 'this is id 4',
+        6: 'this is id 6',
+        10: 'this is id 4',
+    }
+    temp_dir = tempfile.mkdtemp()
+    try:
+      pak_file = os.path.join(temp_dir, 'test.pak')
+      data_pack.WriteDataPack(input_resources, pak_file, data_pack.UTF8)
+      with data_pack.DataPack(pak_file) as pak:
+        self.assertEqual(5, pak.version)
+        self.assertEqual(data_pack.UTF8, pak.encoding)
+        self.assertEqual({10: 4}, pak.aliases)
+        self.assertEqual(data_pack.DataPackSizes(12, 24, 4, 24), pak.sizes)
+        self.assertEqual(4, len(pak))
+        self.assertTrue(6 in pak)
+        self.assertFalse(5 in pak)
+        self.assertEqual(input_resources,
+                         dict((k, bytes(v)) for k, v in pak.iteritems()))
+    finally:
+      shutil.rmtree(temp_dir)
+
+  def testRePack(self):
+    inputs = [{1: 'Never gonna', 4: 'click', 6: 'Never gonna'},
+              {20: 'Never gonna let', 30: 'you down', 32: 'click'}]
+    temp_dir = tempfile.mkdtemp()
+    try:
+      input_files = []
+      for i, resources in enumerate(inputs):
+        input_file = os.path.join(temp_dir, '%d.pak' % i)
+        data_pack.WriteDataPack(resources, input_file, data_pack.UTF8)
+        with open(input_file + '.info', 'w') as f:
+          f.write('info %d\n' % i)
+        input_files.append(input_file)
+      whitelist_file = os.path.join(temp_dir, 'whitelist.txt')
+      with open(whitelist_file, 'w') as f:
+        f.write('1\n6\n20\n32\n')
+
+      output_file = os.path.join(temp_dir, 'out.pak')
+      data_pack.RePack(output_file, input_files, whitelist_file,
+                       suppress_removed_key_output=True)
+      expected = {1: 'Never gonna', 6: 'Never gonna', 20: 'Never gonna let',
+                  32: 'click'}
+      with open(output_file, 'rb') as f:
+        self.assertEqual(
+            data_pack.WriteDataPackToString(expected, data_pack.UTF8),
+            f.read())
+      with open(output_file + '.info') as f:
+        self.assertEqual('info 0\ninfo 1\n', f.read())
+    finally:
+      shutil.rmtree(temp_dir)
+
   def testRePackUnittest(self):
     expected_with_whitelist = {
         1: 'Never gonna', 10: 'give you up', 20: 'Never gonna let',
@@ -9,6 +9,7 @@ SCons build system.
 import codecs
 import filecmp
 import getopt
+import multiprocessing
 import os
 import shutil
 import sys
@@ -45,6 +46,26 @@ _format_modules = {
   'resource_map_source': 'resource_map',
 }
 
+# The RcBuilder whose outputs are being rendered by the worker processes forked
+# by RcBuilder._ProcessOutputsInParallel. Set before forking, so that workers
+# inherit the parsed tree instead of having it pickled.
+_parallel_builder = None
+
+
+def _ProcessOutputInWorker(output_index):
+  '''Renders one output of _parallel_builder in a worker process.
+
+  Returns the (fallback, missing) translations found while rendering, which
+  are otherwise only recorded in the worker's copy of the UberClique.
+  '''
+  builder = _parallel_builder
+  uberclique = builder.res.UberClique()
+  uberclique.fallback_translations_ = {}
+  uberclique.missing_translations_ = {}
+  builder._ProcessOutput(builder.res.GetOutputFiles()[output_index])
+  return uberclique.fallback_translations_, uberclique.missing_translations_
+
+
 def GetFormatter(type):
   modulename = 'grit.format.' + _format_modules[type]
   __import__(modulename)
@@ -130,6 +151,11 @@ Options:
                     generated will depend on a stampfile instead of the first
                     output in the input .grd file.
 
+  --jobs N          Render up to N outputs in parallel, in forked processes
+                    sharing the parsed resource tree. IDs are assigned and
+                    gatherers are run only once, before forking. Defaults to
+                    1 (serial). Ignored where fork() is not available.
+
   --js-minifier     A command to run the Javascript minifier. If not set then
                     Javascript won't be minified. The command should read the
                     original Javascript from standard input, and output the
@@ -160,6 +186,7 @@ are exported to translation interchange files (e.g. XMB files), etc.
     write_only_new = False
     depend_on_stamp = False
     js_minifier = None
+    jobs = 1
     replace_ellipsis = True
     (own_opts, args) = getopt.getopt(args, 'a:p:o:D:E:f:w:t:',
         ('depdir=','depfile=','assert-file-list=',
@@ -168,6 +195,7 @@ are exported to translation interchange files (e.g. XMB files), etc.
          'no-output-all-resource-defines',
          'no-replace-ellipsis',
          'depend-on-stamp',
+         'jobs=',
          'js-minifier=',
          'write-only-new=',
          'whitelist-support'))
@@ -206,6 +234,8 @@ are exported to translation interchange files (e.g. XMB files), etc.
         write_only_new = val != '0'
       elif key == '--depend-on-stamp':
         depend_on_stamp = True
+      elif key == '--jobs':
+        jobs = int(val)
       elif key == '--js-minifier':
         js_minifier = val
       elif key == '--whitelist-support':
@@ -236,6 +266,7 @@ are exported to translation interchange files (e.g. XMB files), etc.
       minifier.SetJsMinifier(js_minifier)
 
     self.write_only_new = write_only_new
+    self.jobs = jobs
 
     self.res = grd_reader.Parse(opts.input,
                                 debug=opts.extra_verbose,
@@ -293,6 +324,9 @@ are exported to translation interchange files (e.g. XMB files), etc.
     # Whether to compare outputs to their old contents before writing.
     self.write_only_new = False
 
+    # Number of outputs to render in parallel.
+    self.jobs = 1
+
   @staticmethod
   def AddWhitelistTags(start_node, whitelist_names):
     # Walk the tree of nodes added attributes for the nodes that shouldn't
@@ -350,6 +384,96 @@ are exported to translation interchange files (e.g. XMB files), etc.
     # TODO(gfeher) modify here to set utf-8 encoding for admx/adml
     return 'utf_16'
 
+  def _SetOutputContext(self, output):
+    # Set the context, for conditional inclusion of resources
+    self.res.SetOutputLanguage(output.GetLanguage())
+    self.res.SetOutputContext(output.GetContext())
+    self.res.SetFallbackToDefaultLayout(output.GetFallbackToDefaultLayout())
+    self.res.SetDefines(self.defines)
+
+  def _ProcessOutput(self, output):
+    self.VerboseOut('Creating %s...' % output.GetOutputFilename())
+
+    self._SetOutputContext(output)
+
+    # Assign IDs only once to ensure that all outputs use the same IDs.
+    if self.res.GetIdMap() is None:
+      self.res.InitializeIds()
+
+    # Make the output directory if it doesn't exist.
+    self.MakeDirectoriesTo(output.GetOutputFilename())
+
+    # Write the results to a temporary file and only overwrite the original
+    # if the file changed.  This avoids unnecessary rebuilds.
+    outfile = self.fo_create(output.GetOutputFilename() + '.tmp', 'wb')
+
+    if output.GetType() != 'data_package':
+      encoding = self._EncodingForOutputType(output.GetType())
+      outfile = util.WrapOutputStream(outfile, encoding)
+
+    # Iterate in-order through entire resource tree, calling formatters on
+    # the entry into a node and on exit out of it.
+    with outfile:
+      self.ProcessNode(self.res, output, outfile)
+
+    # Now copy from the temp file back to the real output, but on Windows,
+    # only if the real output doesn't exist or the contents of the file
+    # changed.  This prevents identical headers from being written and .cc
+    # files from recompiling (which is painful on Windows).
+    if not os.path.exists(output.GetOutputFilename()):
+      os.rename(output.GetOutputFilename() + '.tmp',
+                output.GetOutputFilename())
+    else:
+      # CHROMIUM SPECIFIC CHANGE.
+      # This clashes with gyp + vstudio, which expect the output timestamp
+      # to change on a rebuild, even if nothing has changed, so only do
+      # it when opted in.
+      if not self.write_only_new:
+        write_file = True
+      else:
+        files_match = filecmp.cmp(output.GetOutputFilename(),
+            output.GetOutputFilename() + '.tmp')
+        write_file = not files_match
+      if write_file:
+        shutil.copy2(output.GetOutputFilename() + '.tmp',
+                     output.GetOutputFilename())
+      os.remove(output.GetOutputFilename() + '.tmp')
+
+    self.VerboseOut(' done.\n')
+
+  def _ProcessOutputsInParallel(self, outputs):
+    '''Renders |outputs| in a pool of up to self.jobs forked processes.
+
+    The workers share the parsed tree, the gathered resources and the IDs,
+    which are all computed once by the parent before forking.
+    '''
+    global _parallel_builder
+    # Assign IDs in the context of the first output, as the serial loop does.
+    self._SetOutputContext(outputs[0])
+    if self.res.GetIdMap() is None:
+      self.res.InitializeIds()
+
+    _parallel_builder = self
+    pool = multiprocessing.Pool(min(self.jobs, len(outputs)))
+    try:
+      results = pool.map(_ProcessOutputInWorker, range(len(outputs)),
+                         chunksize=1)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+      _parallel_builder = None
+
+    uberclique = self.res.UberClique()
+    for fallback_translations, missing_translations in results:
+      for translations, merged in (
+          (fallback_translations, uberclique.fallback_translations_),
+          (missing_translations, uberclique.missing_translations_)):
+        for clique_id, langs in translations.iteritems():
+          merged.setdefault(clique_id, {}).update(langs)
+
   def Process(self):
     # Update filenames with those provided by SCons if we're being invoked
     # from SCons.  The list of SCons targets also includes all <structure>
@@ -371,59 +495,12 @@ are exported to translation interchange files (e.g. XMB files), etc.
     if self.whitelist_names:
       self.AddWhitelistTags(self.res, self.whitelist_names)
 
-    for output in self.res.GetOutputFiles():
-      self.VerboseOut('Creating %s...' % output.GetOutputFilename())
-
-      # Set the context, for conditional inclusion of resources
-      self.res.SetOutputLanguage(output.GetLanguage())
-      self.res.SetOutputContext(output.GetContext())
-      self.res.SetFallbackToDefaultLayout(output.GetFallbackToDefaultLayout())
-      self.res.SetDefines(self.defines)
-
-      # Assign IDs only once to ensure that all outputs use the same IDs.
-      if self.res.GetIdMap() is None:
-        self.res.InitializeIds()
-
-      # Make the output directory if it doesn't exist.
-      self.MakeDirectoriesTo(output.GetOutputFilename())
-
-      # Write the results to a temporary file and only overwrite the original
-      # if the file changed.  This avoids unnecessary rebuilds.
-      outfile = self.fo_create(output.GetOutputFilename() + '.tmp', 'wb')
-
-      if output.GetType() != 'data_package':
-        encoding = self._EncodingForOutputType(output.GetType())
-        outfile = util.WrapOutputStream(outfile, encoding)
-
-      # Iterate in-order through entire resource tree, calling formatters on
-      # the entry into a node and on exit out of it.
-      with outfile:
-        self.ProcessNode(self.res, output, outfile)
-
-      # Now copy from the temp file back to the real output, but on Windows,
-      # only if the real output doesn't exist or the contents of the file
-      # changed.  This prevents identical headers from being written and .cc
-      # files from recompiling (which is painful on Windows).
-      if not os.path.exists(output.GetOutputFilename()):
-        os.rename(output.GetOutputFilename() + '.tmp',
-                  output.GetOutputFilename())
-      else:
-        # CHROMIUM SPECIFIC CHANGE.
-        # This clashes with gyp + vstudio, which expect the output timestamp
-        # to change on a rebuild, even if nothing has changed, so only do
-        # it when opted in.
-        if not self.write_only_new:
-          write_file = True
-        else:
-          files_match = filecmp.cmp(output.GetOutputFilename(),
-              output.GetOutputFilename() + '.tmp')
-          write_file = not files_match
-        if write_file:
-          shutil.copy2(output.GetOutputFilename() + '.tmp',
-                       output.GetOutputFilename())
-        os.remove(output.GetOutputFilename() + '.tmp')
-
-      self.VerboseOut(' done.\n')
+    outputs = self.res.GetOutputFiles()
+    if self.jobs > 1 and len(outputs) > 1 and hasattr(os, 'fork'):
+      self._ProcessOutputsInParallel(outputs)
+    else:
+      for output in outputs:
+        self._ProcessOutput(output)
 
     # Print warnings if there are any duplicate shortcuts.
     warnings = shortcuts.GenerateDuplicateShortcutsWarnings(
@@ -7,6 +7,7 @@
 '''
 
 import codecs
+import filecmp
 import os
 import sys
 import tempfile
@@ -287,6 +288,30 @@ class BuildUnittest(unittest.TestCase):
     self.assertTrue(abs(third_mtime - UNCHANGED) < 5)
     output_dir.CleanUp()
 
+  def testParallelOutputs(self):
+    serial_dir = util.TempDir({})
+    parallel_dir = util.TempDir({})
+    class DummyOpts(object):
+      def __init__(self):
+        self.input = util.PathFromRoot('grit/testdata/substitute.grd')
+        self.verbose = False
+        self.extra_verbose = False
+    build.RcBuilder().Run(DummyOpts(), ['-o', serial_dir.GetPath()])
+    builder = build.RcBuilder()
+    builder.Run(DummyOpts(), ['-o', parallel_dir.GetPath(), '--jobs', '3'])
+    self.assertEqual(3, builder.jobs)
+
+    output_files = sorted(os.listdir(serial_dir.GetPath()))
+    self.assertEqual(['en_generated_resources.rc', 'resource.h',
+                      'sv_generated_resources.rc'], output_files)
+    self.assertEqual(output_files, sorted(os.listdir(parallel_dir.GetPath())))
+    for output_file in output_files:
+      self.failUnless(filecmp.cmp(serial_dir.GetPath(output_file),
+                                  parallel_dir.GetPath(output_file),
+                                  shallow=False))
+    serial_dir.CleanUp()
+    parallel_dir.CleanUp()
+
   def testGenerateDepFileWithDependOnStamp(self):
     output_dir = util.TempDir({})
     builder = build.RcBuilder()
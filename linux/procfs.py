@@ -10,13 +10,20 @@
 # always possible to probe the original data.
 
 
+import array
 import collections
+import itertools
 import logging
 import os
 import re
 import struct
 import sys
 
+try:
+  import numpy  # pylint: disable=F0401
+except ImportError:
+  numpy = None
+
 
 class _NullHandler(logging.Handler):
   def emit(self, record):
@@ -509,16 +516,251 @@ class ProcSmaps(object):
     return self._vma_internals
 
 
+class ProcSmapsSampler(object):
+  """Samples a few fields of /proc/pid/smaps repeatedly, returning deltas.
+
+  Only the requested fields are extracted, with a single regex scan of the raw
+  content. When the per-VMA breakdown is not needed, /proc/pid/smaps_rollup is
+  read if the kernel provides it (Linux 4.14+), which is much cheaper for the
+  kernel to generate.
+
+  Each sample returns the changes since the previous one, as a dict of VMA key
+  -> tuple of deltas (in kB, in the order of |fields|). A VMA key is a tuple
+  (begin, end, offset, inode, name); unless |per_vma| is set, a single ROLLUP
+  key is used. VMAs which appeared or disappeared are reported with their full
+  (positive or negative) values, unchanged VMAs are omitted.
+  """
+  ROLLUP = 'rollup'
+
+  def __init__(self, pid, fields=('Rss', 'Pss'), per_vma=False):
+    self._pid = pid
+    self._fields = tuple(fields)
+    self._field_indexes = dict(
+        (field, i) for i, field in enumerate(self._fields))
+    self._per_vma = per_vma
+    self._rollup_available = not per_vma
+    self._values = {}
+    self._pattern = re.compile(
+        r'^([0-9a-f]+)-([0-9a-f]+) \S+ ([0-9a-f]+) \S+ (\d+) *(.*)$|'
+        r'^(%s):\s+(\d+)' % '|'.join(re.escape(field) for field in fields),
+        re.MULTILINE)
+
+  def sample(self):
+    """Returns the deltas since the previous sample, or None on failure."""
+    raw = None
+    if self._rollup_available:
+      raw = self._read('smaps_rollup')
+      # Older kernels lack smaps_rollup, and it lacks some fields (e.g. Size).
+      if raw is None or any('\n%s:' % field not in raw
+                            for field in self._fields):
+        self._rollup_available = False
+        raw = None
+    if raw is None:
+      raw = self._read('smaps')
+      if raw is None:
+        return None
+    values = self.parse(raw, aggregate=not self._per_vma)
+    deltas = self._diff(self._values, values)
+    self._values = values
+    return deltas
+
+  @property
+  def values(self):
+    """The values of the latest sample, as a dict of VMA key -> tuple."""
+    return self._values
+
+  def parse(self, raw, aggregate=False):
+    """Extracts the sampled fields from raw smaps (or smaps_rollup) content.
+
+    Returns:
+      A dict of VMA key -> tuple of values (in kB, in the order of the fields).
+      If |aggregate| is True, the values of all the VMAs are summed up under
+      the ROLLUP key.
+    """
+    result = {}
+    current = None
+    for match in self._pattern.finditer(raw):
+      name = match.group(6)
+      if name is None:
+        if aggregate:
+          current = result.setdefault(self.ROLLUP, [0] * len(self._fields))
+        else:
+          key = (int(match.group(1), 16), int(match.group(2), 16),
+                 int(match.group(3), 16), int(match.group(4)),
+                 match.group(5).rstrip())
+          current = result[key] = [0] * len(self._fields)
+      elif current is not None:
+        current[self._field_indexes[name]] += int(match.group(7))
+    return dict((key, tuple(value)) for key, value in result.iteritems())
+
+  @staticmethod
+  def _diff(before, after):
+    deltas = {}
+    for key, values in after.iteritems():
+      previous = before.get(key)
+      if previous is None:
+        deltas[key] = values
+      elif previous != values:
+        deltas[key] = tuple(a - b for a, b in zip(values, previous))
+    for key, values in before.iteritems():
+      if key not in after:
+        deltas[key] = tuple(-value for value in values)
+    return deltas
+
+  def _read(self, proc_file):
+    try:
+      with open(os.path.join('/proc', str(self._pid), proc_file), 'rb') as f:
+        return f.read()
+    except (IOError, OSError):
+      return None
+
+
+def _uint64_array_typecode():
+  # array('Q') is not available in Python 2, but 'L' is 64-bit on LP64 hosts.
+  for typecode in ('Q', 'L'):
+    try:
+      if array.array(typecode).itemsize == 8:
+        return typecode
+    except ValueError:
+      pass
+  return None
+
+
+_UINT64_TYPECODE = _uint64_array_typecode()
+
+
+class PageFrames(object):
+  """A sorted multiset of page frame numbers (PFNs).
+
+  PFNs are stored in a sorted numpy.uint64 array when NumPy is available, or in
+  a sorted array of 64-bit integers otherwise. It is much more compact than a
+  dict or a set of PFNs, and counting distinct or duplicated page frames is a
+  linear scan of the array.
+  """
+
+  def __init__(self, sorted_pfns):
+    self._pfns = sorted_pfns
+
+  @staticmethod
+  def from_chunks(chunks):
+    """Creates a PageFrames from a list of (unsorted) sequences of PFNs."""
+    if numpy:
+      if not chunks:
+        return PageFrames(numpy.empty(0, dtype=numpy.uint64))
+      pfns = numpy.concatenate(
+          [numpy.asarray(chunk, dtype=numpy.uint64) for chunk in chunks])
+      pfns.sort()
+      return PageFrames(pfns)
+    pfns = []
+    for chunk in chunks:
+      pfns.extend(chunk)
+    pfns.sort()
+    if _UINT64_TYPECODE:
+      pfns = array.array(_UINT64_TYPECODE, pfns)
+    return PageFrames(pfns)
+
+  @staticmethod
+  def merge(page_frames_list):
+    """Returns the union (with multiplicity) of a list of PageFrames."""
+    return PageFrames.from_chunks([page_frames._pfns  # pylint: disable=W0212
+                                   for page_frames in page_frames_list])
+
+  def __len__(self):
+    return len(self._pfns)
+
+  def __iter__(self):
+    if numpy:
+      return iter(self._pfns.tolist())
+    return iter(self._pfns)
+
+  def count_unique(self):
+    """Returns the number of distinct PFNs."""
+    if numpy:
+      if not len(self._pfns):
+        return 0
+      return int(numpy.count_nonzero(numpy.diff(self._pfns))) + 1
+    return sum(1 for _ in itertools.groupby(self._pfns))
+
+  def unique(self):
+    """Returns a PageFrames with a single occurrence of each PFN."""
+    if numpy:
+      return PageFrames(numpy.unique(self._pfns))
+    pfns = [pfn for pfn, _ in itertools.groupby(self._pfns)]
+    if _UINT64_TYPECODE:
+      pfns = array.array(_UINT64_TYPECODE, pfns)
+    return PageFrames(pfns)
+
+  def iteritems(self):
+    """Yields (PFN, number of occurrences) in increasing PFN order."""
+    if numpy:
+      pfns, counts = numpy.unique(self._pfns, return_counts=True)
+      return itertools.izip(pfns.tolist(), counts.tolist())
+    return ((pfn, sum(1 for _ in group))
+            for pfn, group in itertools.groupby(self._pfns))
+
+  @staticmethod
+  def count_sharing(page_frames_by_key):
+    """Counts how many page frames of each key are shared with other keys.
+
+    Args:
+      page_frames_by_key: a dict of any key (e.g. a pid) -> PageFrames.
+
+    Returns:
+      A dict of key -> (unique, shared, proportional), where |unique| is the
+      number of distinct page frames found only in that key, |shared| the
+      number of distinct page frames found also in other keys and
+      |proportional| (a float) the sum of 1/N for each distinct page frame
+      found in N keys, as in PSS.
+    """
+    unique_by_key = dict((key, page_frames.unique())
+                         for key, page_frames in page_frames_by_key.iteritems())
+    # In the union of the distinct page frames of each key, the multiplicity of
+    # a page frame is the number of keys it is found in.
+    all_page_frames = PageFrames.merge(unique_by_key.values())
+    result = {}
+    if numpy:
+      pfns, sharers = numpy.unique(all_page_frames._pfns,
+                                   return_counts=True)
+      for key, page_frames in unique_by_key.iteritems():
+        key_sharers = sharers[numpy.searchsorted(pfns, page_frames._pfns)]
+        unique = int(numpy.count_nonzero(key_sharers == 1))
+        result[key] = (unique, len(page_frames) - unique,
+                       float(numpy.sum(1.0 / key_sharers)))
+      return result
+
+    sharers_by_pfn = dict((pfn, sharers)
+                          for pfn, sharers in all_page_frames.iteritems()
+                          if sharers > 1)
+    for key, page_frames in unique_by_key.iteritems():
+      shared = 0
+      proportional = 0.0
+      for pfn in page_frames:
+        sharers = sharers_by_pfn.get(pfn)
+        if sharers:
+          shared += 1
+          proportional += 1.0 / sharers
+      unique = len(page_frames) - shared
+      result[key] = (unique, shared, proportional + unique)
+    return result
+
+
 class ProcPagemap(object):
   """Reads and stores partial information in /proc/pid/pagemap.
 
   It picks up virtual addresses to read based on ProcMaps (/proc/pid/maps).
   See https://www.kernel.org/doc/Documentation/vm/pagemap.txt for details.
+
+  pagemap is read in large aligned chunks of 64-bit values. Flags are masked in
+  bulk (vectorized if NumPy is available) and the PFNs of present pages are
+  kept in PageFrames, from which the per-VMA and per-process counts are derived.
   """
   _BYTES_PER_PAGEMAP_VALUE = 8
   _BYTES_PER_OS_PAGE = 4096
   _VIRTUAL_TO_PAGEMAP_OFFSET = _BYTES_PER_OS_PAGE / _BYTES_PER_PAGEMAP_VALUE
 
+  # 1MB of pagemap values covers 512MB of virtual address space.
+  _PAGEMAP_CHUNK_BYTES = 1 << 20
+
   _MASK_PRESENT = 1 << 63
   _MASK_SWAPPED = 1 << 62
   _MASK_FILEPAGE_OR_SHAREDANON = 1 << 61
@@ -546,68 +788,112 @@ class ProcPagemap(object):
 
     @property
     def pageframes(self):
+      """A PageFrames with one PFN per present page in the VMA."""
       return self._pageframes
 
-  def __init__(self, vsize, present, swapped, vma_internals, in_process_dup):
+  def __init__(self, vsize, present, swapped, vma_internals, in_process_dup,
+               pageframes=None):
     self._vsize = vsize
     self._present = present
     self._swapped = swapped
     self._vma_internals = vma_internals
     self._in_process_dup = in_process_dup
+    self._pageframes = pageframes
 
   @staticmethod
   def load(pid, maps):
-    total_present = 0
-    total_swapped = 0
-    total_vsize = 0
-    in_process_dup = 0
-    vma_internals = collections.OrderedDict()
-    process_pageframe_set = set()
-
     try:
       pagemap_fd = os.open(
           os.path.join('/proc', str(pid), 'pagemap'), os.O_RDONLY)
     except (IOError, OSError):
       return None
+    try:
+      return ProcPagemap.load_fd(pagemap_fd, maps, pid)
+    finally:
+      try:
+        os.close(pagemap_fd)
+      except OSError:
+        pass
+
+  @staticmethod
+  def load_fd(pagemap_fd, maps, pid=None):
+    """Reads the pagemap values of the VMAs in |maps| from an open pagemap."""
+    total_present = 0
+    total_swapped = 0
+    total_vsize = 0
+    vma_internals = collections.OrderedDict()
+
     for vma in maps:
-      present = 0
-      swapped = 0
-      vsize = 0
-      pageframes = collections.defaultdict(int)
       begin_offset = ProcPagemap._offset(vma.begin)
-      chunk_size = ProcPagemap._offset(vma.end) - begin_offset
-      try:
-        os.lseek(pagemap_fd, begin_offset, os.SEEK_SET)
-        buf = os.read(pagemap_fd, chunk_size)
-      except (IOError, OSError):
-        return None
-      if len(buf) < chunk_size:
-        _LOGGER.warn('Failed to read pagemap at 0x%x in %d.' % (vma.begin, pid))
-      pagemap_values = struct.unpack(
-          '=%dQ' % (len(buf) / ProcPagemap._BYTES_PER_PAGEMAP_VALUE), buf)
-      for pagemap_value in pagemap_values:
-        vsize += ProcPagemap._BYTES_PER_OS_PAGE
-        if pagemap_value & ProcPagemap._MASK_PRESENT:
-          if (pagemap_value & ProcPagemap._MASK_PFN) in process_pageframe_set:
-            in_process_dup += ProcPagemap._BYTES_PER_OS_PAGE
-          else:
-            process_pageframe_set.add(pagemap_value & ProcPagemap._MASK_PFN)
-          if (pagemap_value & ProcPagemap._MASK_PFN) not in pageframes:
-            present += ProcPagemap._BYTES_PER_OS_PAGE
-          pageframes[pagemap_value & ProcPagemap._MASK_PFN] += 1
-        if pagemap_value & ProcPagemap._MASK_SWAPPED:
-          swapped += ProcPagemap._BYTES_PER_OS_PAGE
+      end_offset = ProcPagemap._offset(vma.end)
+      chunk_pfns = []
+      vsize = 0
+      swapped = 0
+      offset = begin_offset
+      while offset < end_offset:
+        # Align the chunks to _PAGEMAP_CHUNK_BYTES in the pagemap file.
+        chunk_end = min(end_offset, (offset / ProcPagemap._PAGEMAP_CHUNK_BYTES +
+                                     1) * ProcPagemap._PAGEMAP_CHUNK_BYTES)
+        try:
+          os.lseek(pagemap_fd, offset, os.SEEK_SET)
+          buf = os.read(pagemap_fd, chunk_end - offset)
+        except (IOError, OSError):
+          return None
+        short_read = len(buf) < chunk_end - offset
+        if short_read:
+          _LOGGER.warn('Failed to read pagemap at 0x%x in %s.' % (
+              vma.begin, pid))
+        pfns, chunk_swapped = ProcPagemap._scan_chunk(buf)
+        chunk_pfns.append(pfns)
+        vsize += (len(buf) / ProcPagemap._BYTES_PER_PAGEMAP_VALUE *
+                  ProcPagemap._BYTES_PER_OS_PAGE)
+        swapped += chunk_swapped * ProcPagemap._BYTES_PER_OS_PAGE
+        if short_read:
+          break
+        offset = chunk_end
+
+      pageframes = PageFrames.from_chunks(chunk_pfns)
+      present = pageframes.count_unique() * ProcPagemap._BYTES_PER_OS_PAGE
       vma_internals[vma] = ProcPagemap.VMA(vsize, present, swapped, pageframes)
       total_present += present
       total_swapped += swapped
       total_vsize += vsize
-    try:
-      os.close(pagemap_fd)
-    except OSError:
-      return None
+
+    # A page frame mapped N times in the process accounts for N-1 duplicates.
+    process_pageframes = PageFrames.merge(
+        [vma.pageframes for vma in vma_internals.itervalues()])
+    in_process_dup = ((len(process_pageframes) -
+                       process_pageframes.count_unique()) *
+                      ProcPagemap._BYTES_PER_OS_PAGE)
 
     return ProcPagemap(total_vsize, total_present, total_swapped,
-                       vma_internals, in_process_dup)
+                       vma_internals, in_process_dup, process_pageframes)
+
+  @staticmethod
+  def _scan_chunk(buf):
+    """Returns (PFNs of the present pages, number of swapped pages) in |buf|."""
+    count = len(buf) / ProcPagemap._BYTES_PER_PAGEMAP_VALUE
+    buf = buf[:count * ProcPagemap._BYTES_PER_PAGEMAP_VALUE]
+    if numpy:
+      values = numpy.frombuffer(buf, dtype=numpy.uint64)
+      present = (values & numpy.uint64(ProcPagemap._MASK_PRESENT)) != 0
+      swapped = int(numpy.count_nonzero(
+          values & numpy.uint64(ProcPagemap._MASK_SWAPPED)))
+      return values[present] & numpy.uint64(ProcPagemap._MASK_PFN), swapped
+
+    if _UINT64_TYPECODE:
+      values = array.array(_UINT64_TYPECODE)
+      values.fromstring(buf)
+    else:
+      values = struct.unpack('=%dQ' % count, buf)
+    # Most of the values are 0 (not present nor swapped). The present and the
+    # swapped flags are the two topmost bits, hence a single comparison
+    # filters out all the other values.
+    flagged = [value for value in values if value >= ProcPagemap._MASK_SWAPPED]
+    pfns = [value & ProcPagemap._MASK_PFN for value in flagged
+            if value & ProcPagemap._MASK_PRESENT]
+    swapped = sum(1 for value in flagged if value & ProcPagemap._MASK_SWAPPED)
+    return pfns, swapped
 
   @staticmethod
   def _offset(virtual_address):
@@ -625,11 +911,75 @@ class ProcPagemap(object):
   def swapped(self):
     return int(self._swapped)
 
+  @property
+  def in_process_dup(self):
+    return int(self._in_process_dup)
+
+  @property
+  def pageframes(self):
+    """A PageFrames with one PFN per present page in the process."""
+    return self._pageframes
+
   @property
   def vma_internals(self):
     return self._vma_internals
 
 
+class ProcPagemapSampler(object):
+  """Samples /proc/pid/pagemap of a process repeatedly.
+
+  /proc/pid/pagemap is kept open between samples, and /proc/pid/maps is parsed
+  again only when its content changed since the previous sample.
+  """
+
+  def __init__(self, pid):
+    self._pid = pid
+    self._pagemap_fd = None
+    self._maps_raw = None
+    self._maps = None
+
+  def sample(self):
+    """Returns a ProcPagemap, or None if the process cannot be read."""
+    try:
+      with open(os.path.join('/proc', str(self._pid), 'maps'), 'r') as maps_f:
+        maps_raw = maps_f.read()
+    except (IOError, OSError):
+      self.close()
+      return None
+    if maps_raw != self._maps_raw:
+      self._maps = ProcMaps.load_file(maps_raw.splitlines())
+      self._maps_raw = maps_raw
+
+    if self._pagemap_fd is None:
+      try:
+        self._pagemap_fd = os.open(
+            os.path.join('/proc', str(self._pid), 'pagemap'), os.O_RDONLY)
+      except (IOError, OSError):
+        return None
+    pagemap = ProcPagemap.load_fd(self._pagemap_fd, self._maps, self._pid)
+    if not pagemap:
+      self.close()
+    return pagemap
+
+  def close(self):
+    if self._pagemap_fd is not None:
+      try:
+        os.close(self._pagemap_fd)
+      except OSError:
+        pass
+      self._pagemap_fd = None
+    self._maps_raw = None
+    self._maps = None
+
+  @property
+  def pid(self):
+    return self._pid
+
+  @property
+  def maps(self):
+    return self._maps
+
+
 class _ProcessMemory(object):
   """Aggregates process memory information from /proc for manual testing."""
   def __init__(self, pid):
@@ -6,13 +6,19 @@
 import cStringIO
 import logging
 import os
+import struct
 import sys
+import tempfile
 import unittest
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, ROOT_DIR)
 
+from procfs import PageFrames
 from procfs import ProcMaps
+from procfs import ProcPagemap
+from procfs import ProcPagemapSampler
+from procfs import ProcSmapsSampler
 
 
 class ProcMapsTest(unittest.TestCase):
@@ -103,6 +109,163 @@ class ProcMapsTest(unittest.TestCase):
                        self._expected_as_dict(selected[index]))
 
 
+class ProcSmapsSamplerTest(unittest.TestCase):
+  _TEST_SMAPS = '\n'.join([
+      '00400000-0040b000 r-xp 00000000 fc:00 2231329    /usr/bin/some',
+      'Size:                 44 kB',
+      'Rss:                  40 kB',
+      'Pss:                  20 kB',
+      'VmFlags: rd ex mr mw me dw',
+      '0237d000-02a9b000 rw-p 00000000 00:00 0          [heap]',
+      'Size:               7288 kB',
+      'Rss:                7000 kB',
+      'Pss:                7000 kB',
+      'VmFlags: rd wr mr mw me ac',
+      '',
+      ])
+
+  _TEST_SMAPS_ROLLUP = '\n'.join([
+      '00400000-02a9b000 ---p 00000000 00:00 0          [rollup]',
+      'Rss:                7040 kB',
+      'Pss:                7020 kB',
+      '',
+      ])
+
+  _SOME = (0x400000, 0x40b000, 0, 2231329, '/usr/bin/some')
+  _HEAP = (0x237d000, 0x2a9b000, 0, 0, '[heap]')
+
+  def _make_sampler(self, contents, **kwargs):
+    sampler = ProcSmapsSampler(0, **kwargs)
+    sampler._read = contents.get  # pylint: disable=W0212
+    return sampler
+
+  def test_per_vma(self):
+    contents = {'smaps': self._TEST_SMAPS}
+    sampler = self._make_sampler(contents, fields=('Pss', 'Size'),
+                                 per_vma=True)
+    self.assertEqual(sampler.sample(),
+                     {self._SOME: (20, 44), self._HEAP: (7000, 7288)})
+    self.assertEqual(sampler.sample(), {})
+
+    contents['smaps'] = (self._TEST_SMAPS.replace('7000 kB', '7100 kB')
+                         .replace('/usr/bin/some', '/usr/bin/other'))
+    other = self._SOME[:4] + ('/usr/bin/other',)
+    self.assertEqual(sampler.sample(), {self._SOME: (-20, -44),
+                                        other: (20, 44),
+                                        self._HEAP: (100, 0)})
+
+  def test_rollup(self):
+    contents = {'smaps': self._TEST_SMAPS,
+                'smaps_rollup': self._TEST_SMAPS_ROLLUP}
+    sampler = self._make_sampler(contents)
+    self.assertEqual(sampler.sample(), {ProcSmapsSampler.ROLLUP: (7040, 7020)})
+    contents['smaps_rollup'] = self._TEST_SMAPS_ROLLUP.replace('7020', '7030')
+    self.assertEqual(sampler.sample(), {ProcSmapsSampler.ROLLUP: (0, 10)})
+
+  def test_rollup_fallback(self):
+    contents = {'smaps': self._TEST_SMAPS}
+    sampler = self._make_sampler(contents)
+    self.assertEqual(sampler.sample(), {ProcSmapsSampler.ROLLUP: (7040, 7020)})
+
+    # smaps_rollup lacks the Size field.
+    contents['smaps_rollup'] = self._TEST_SMAPS_ROLLUP
+    sampler = self._make_sampler(contents, fields=('Size',))
+    self.assertEqual(sampler.sample(), {ProcSmapsSampler.ROLLUP: (7332,)})
+
+
+class ProcPagemapTest(unittest.TestCase):
+  _PRESENT = 1 << 63
+  _SWAPPED = 1 << 62
+
+  _TEST_PROCMAPS = '\n'.join([
+      '00001000-00005000 rw-p 00000000 00:00 0',
+      '00005000-00007000 r--p 00000000 fc:00 12345      /usr/lib/libfoo.so',
+      ])
+
+  # One pagemap value per page, starting at virtual address 0x1000.
+  _TEST_PAGEMAP_VALUES = [
+      _PRESENT | 10,
+      _PRESENT | 11,
+      _PRESENT | 10,  # Duplicate within the same VMA.
+      _SWAPPED | 12345,
+      _PRESENT | 11,  # Duplicate of a page frame of the other VMA.
+      0,
+      ]
+
+  def setUp(self):
+    self._pagemap_fd, self._pagemap_path = tempfile.mkstemp()
+    os.write(self._pagemap_fd, '\0' * 8)  # Virtual address 0x0.
+    os.write(self._pagemap_fd, struct.pack(
+        '=%dQ' % len(self._TEST_PAGEMAP_VALUES), *self._TEST_PAGEMAP_VALUES))
+    self._maps = ProcMaps.load_file(cStringIO.StringIO(self._TEST_PROCMAPS))
+
+  def tearDown(self):
+    os.close(self._pagemap_fd)
+    os.remove(self._pagemap_path)
+
+  def _check_pagemap(self, pagemap):
+    self.assertEqual(pagemap.vsize, 6 * 4096)
+    self.assertEqual(pagemap.present, 3 * 4096)
+    self.assertEqual(pagemap.swapped, 1 * 4096)
+    self.assertEqual(pagemap.in_process_dup, 2 * 4096)
+    self.assertEqual(list(pagemap.pageframes), [10, 10, 11, 11])
+    vmas = pagemap.vma_internals.values()
+    self.assertEqual(vmas[0].vsize, 4 * 4096)
+    self.assertEqual(vmas[0].present, 2 * 4096)
+    self.assertEqual(vmas[0].swapped, 1 * 4096)
+    self.assertEqual(list(vmas[0].pageframes.iteritems()), [(10, 2), (11, 1)])
+    self.assertEqual(vmas[1].present, 1 * 4096)
+    self.assertEqual(list(vmas[1].pageframes.iteritems()), [(11, 1)])
+
+  def test_load_fd(self):
+    self._check_pagemap(ProcPagemap.load_fd(self._pagemap_fd, self._maps))
+
+  def test_load_fd_small_chunks(self):
+    orig_chunk_bytes = ProcPagemap._PAGEMAP_CHUNK_BYTES
+    ProcPagemap._PAGEMAP_CHUNK_BYTES = 16
+    try:
+      self._check_pagemap(ProcPagemap.load_fd(self._pagemap_fd, self._maps))
+    finally:
+      ProcPagemap._PAGEMAP_CHUNK_BYTES = orig_chunk_bytes
+
+
+class PageFramesTest(unittest.TestCase):
+  def test_page_frames(self):
+    pageframes = PageFrames.from_chunks([[5, 3], [], [9, 3, 3]])
+    self.assertEqual(list(pageframes), [3, 3, 3, 5, 9])
+    self.assertEqual(len(pageframes), 5)
+    self.assertEqual(pageframes.count_unique(), 3)
+    self.assertEqual(list(pageframes.unique()), [3, 5, 9])
+    self.assertEqual(list(pageframes.iteritems()), [(3, 3), (5, 1), (9, 1)])
+    merged = PageFrames.merge([pageframes, PageFrames.from_chunks([[4, 9]])])
+    self.assertEqual(list(merged), [3, 3, 3, 4, 5, 9, 9])
+    self.assertEqual(PageFrames.from_chunks([]).count_unique(), 0)
+
+  def test_count_sharing(self):
+    sharing = PageFrames.count_sharing({
+        'a': PageFrames.from_chunks([[1, 2, 3, 3]]),
+        'b': PageFrames.from_chunks([[3, 4]]),
+        'c': PageFrames.from_chunks([[3, 4, 5]]),
+        })
+    self.assertEqual(sharing['a'], (2, 1, 2 + 1 / 3.0))
+    self.assertEqual(sharing['b'], (0, 2, 1 / 3.0 + 1 / 2.0))
+    self.assertEqual(sharing['c'], (1, 2, 1 + 1 / 3.0 + 1 / 2.0))
+
+
+class ProcPagemapSamplerTest(unittest.TestCase):
+  def test_sample(self):
+    sampler = ProcPagemapSampler(os.getpid())
+    try:
+      pagemap = sampler.sample()
+      self.assertTrue(pagemap)
+      self.assertTrue(pagemap.present > 0)
+      self.assertTrue(sampler.sample())
+      self.assertTrue(sampler.maps)
+    finally:
+      sampler.close()
+    self.assertEqual(sampler.maps, None)
+
+
 if __name__ == '__main__':
   logging.basicConfig(
       level=logging.DEBUG if '-v' in sys.argv else logging.ERROR,
@@ -20,6 +20,13 @@ rule-3 will match any allocation in which at least one of the source paths in
 its stack frames matches the regex sk.*allocator.
 rule-4 will match any allocation which satisfies both the conditions.
 
+Classification does not evaluate the rules one by one for each allocation. The
+rule tree is first compiled (see |_CompiledRuleTree|): the regexes of all the
+sibling rules of each level are merged in combined patterns, and the outcome of
+the matching is memoized per symbol, per source path and per unique stack trace.
+Hence classifying a heap dump costs O(unique stack traces), regardless of the
+number of allocations sharing them.
+
 TODO(primiano): introduce more filters after the first prototype with UI, for
 instance, filter by library file name or by allocation size.
 """
@@ -60,9 +67,11 @@ def Classify(nativeheap, rule_tree):
   assert(isinstance(rule_tree, rules.Rule))
 
   res = results.AggreatedResults(rule_tree, _RESULT_KEYS)
+  compiled_rule_tree = _CompiledRuleTree(rule_tree)
   for allocation in nativeheap.allocations:
-    res.AddToMatchingNodes(allocation,
-                           [allocation.size, allocation.resident_size])
+    res.AddToNodesAlongPath(
+        compiled_rule_tree.GetMatchingPath(allocation.stack_trace),
+        [allocation.size, allocation.resident_size])
   return res
 
 
@@ -208,4 +217,151 @@ class _NHeapRule(rules.Rule):
         cur_regex_idx += 1
         cur_regex = self._stacktrace_regexs[cur_regex_idx]
 
-    return False  # Not all the provided regexs have been matched.
\ No newline at end of file
+    return False  # Not all the provided regexs have been matched.
+
+
+class _RegexSet(object):
+  """Matches a string against a list of regexes, memoizing the outcome.
+
+  The regexes are merged into a single alternation, which is used as a
+  pre-filter: in the common case (a string which matches none of them) a single
+  search is performed. Regexes which cannot be safely merged (i.e. containing
+  groups, which could be back-referenced, or inline flags, which would leak into
+  the other alternatives) are always searched individually.
+  """
+
+  def __init__(self, regexs):
+    self._regexs = regexs
+    self._memo = {}  # string -> bitmask of the matching regexes.
+    default_flags = re.compile('').flags
+    self._mergeable_mask = 0
+    self._unmergeable_mask = 0
+    for i, regex in enumerate(regexs):
+      if regex.groups or regex.flags != default_flags:
+        self._unmergeable_mask |= 1 << i
+      else:
+        self._mergeable_mask |= 1 << i
+    self._combined_regex = None
+    if self._mergeable_mask:
+      self._combined_regex = re.compile('|'.join(
+          '(?:%s)' % regexs[i].pattern for i in self._GetIndexes(
+              self._mergeable_mask)))
+
+  def Match(self, string):
+    """Returns the bitmask of the regexes which match (search) |string|."""
+    mask = self._memo.get(string)
+    if mask is not None:
+      return mask
+    candidates = self._unmergeable_mask
+    if self._combined_regex and self._combined_regex.search(string):
+      candidates |= self._mergeable_mask
+    mask = 0
+    for i in self._GetIndexes(candidates):
+      if self._regexs[i].search(string):
+        mask |= 1 << i
+    self._memo[string] = mask
+    return mask
+
+  def _GetIndexes(self, mask):
+    return [i for i in xrange(len(self._regexs)) if mask & (1 << i)]
+
+
+class _CompiledRuleLevel(object):
+  """Matches stack traces against a list of sibling rules.
+
+  The 'source_path' and 'stacktrace' regexes of all the siblings are merged in
+  two |_RegexSet|s, so that each symbol name and source path is matched once
+  per level. The rules themselves are then evaluated on the resulting bitmasks.
+  """
+
+  def __init__(self, rules_list):
+    self.rules = rules_list
+    path_regexs = []
+    stacktrace_regexs = []
+    # For each rule: (path regex bit, [stacktrace regex bits]). A path bit of 0
+    # means no 'source_path' filter. Rules which are not |_NHeapRule|s (i.e.
+    # the *-other catch-all) match everything, hence have no filters.
+    self._rule_bits = []
+    for rule in rules_list:
+      if not isinstance(rule, _NHeapRule):
+        self._rule_bits.append((0, []))
+        continue
+      path_bit = 0
+      if rule._path_regex:
+        path_bit = 1 << len(path_regexs)
+        path_regexs.append(rule._path_regex)
+      stacktrace_bits = []
+      for regex in rule._stacktrace_regexs:
+        stacktrace_bits.append(1 << len(stacktrace_regexs))
+        stacktrace_regexs.append(regex)
+      self._rule_bits.append((path_bit, stacktrace_bits))
+    self._path_regex_set = _RegexSet(path_regexs)
+    self._stacktrace_regex_set = _RegexSet(stacktrace_regexs)
+    self.children = [_CompiledRuleLevel(rule.children) if rule.children
+                     else None for rule in rules_list]
+
+  def GetMatchingRuleIndex(self, trace_key):
+    """Returns the index of the first rule matching |trace_key| (or None).
+
+    Args:
+      trace_key: a tuple of (symbol_name, source_file_path) per stack frame, as
+          built by |_CompiledRuleTree|. Either element can be None.
+    """
+    path_masks = 0
+    symbol_masks = []
+    for symbol_name, source_path in trace_key:
+      if source_path is not None:
+        path_masks |= self._path_regex_set.Match(source_path)
+      if symbol_name is not None:
+        symbol_masks.append(self._stacktrace_regex_set.Match(symbol_name))
+
+    for rule_index, (path_bit, stacktrace_bits) in enumerate(self._rule_bits):
+      if path_bit and not path_masks & path_bit:
+        continue
+      # Match the stacktrace regexs in order, as in |_NHeapRule.Match|.
+      cur_regex_idx = 0
+      for symbol_mask in symbol_masks:
+        if cur_regex_idx == len(stacktrace_bits):
+          break
+        if symbol_mask & stacktrace_bits[cur_regex_idx]:
+          cur_regex_idx += 1
+      if cur_regex_idx == len(stacktrace_bits):
+        return rule_index
+    return None
+
+
+class _CompiledRuleTree(object):
+  """Classifies stack traces against a rule tree, memoizing the results.
+
+  The outcome is equivalent to traversing the rule tree calling |Rule.Match| for
+  each allocation (see |AggreatedResults.AddToMatchingNodes|).
+  """
+
+  def __init__(self, rule_tree):
+    self._root_level = _CompiledRuleLevel([rule_tree])
+    self._paths = {}  # trace_key -> list of rule indexes, one per level.
+
+  def GetMatchingPath(self, stack_trace):
+    """Returns the path of the matching rules, see |AddToNodesAlongPath|."""
+    trace_key = tuple(self._GetFrameKey(frame) for frame in stack_trace.frames)
+    path = self._paths.get(trace_key)
+    if path is None:
+      path = []
+      level = self._root_level
+      while level:
+        rule_index = level.GetMatchingRuleIndex(trace_key)
+        if rule_index is None:
+          break
+        path.append(rule_index)
+        level = level.children[rule_index]
+      self._paths[trace_key] = path
+    return path
+
+  @staticmethod
+  def _GetFrameKey(frame):
+    if not frame.symbol:
+      return (None, None)
+    source_path = None
+    if frame.symbol.source_info:
+      source_path = frame.symbol.source_info[0].source_file_path
+    return (frame.symbol.name, source_path)
@@ -5,6 +5,7 @@
 import unittest
 
 from memory_inspector.classification import native_heap_classifier
+from memory_inspector.classification import results
 from memory_inspector.core import native_heap
 from memory_inspector.core import stacktrace
 from memory_inspector.core import symbol
@@ -75,6 +76,24 @@ _EXPECTED_RESULTS = {
     'Total::Total-other':            [75, 0],  # 3 + 29 + 43.
 }
 
+# Regexes with groups and inline flags cannot be merged with their siblings.
+_UNMERGEABLE_TEST_RULES = """
+[
+{
+  'name': 'backref',
+  'stacktrace': r'(sk)::\\1',
+},
+{
+  'name': 'ignorecase',
+  'stacktrace': r'(?i)CONTENT::RENDERER',
+},
+{
+  'name': 'plain',
+  'stacktrace': r'content::',
+},
+]
+"""
+
 _HEURISTIC_TEST_STACK_TRACES = [
     (10, '/root/base1/foo/bar/file.cc'),  # Contrib: 0.13
     (20, '/root/base1/foo/baz/file.cc'),  # Contrib: 0.26
@@ -119,6 +138,40 @@ class NativeHeapClassifierTest(unittest.TestCase):
     res = native_heap_classifier.Classify(nheap, rule_tree)
     self._CheckResult(res.total, '', _EXPECTED_RESULTS)
 
+  def testCompiledRulesMatchUncompiledRules(self):
+    nheap = native_heap.NativeHeap()
+    mock_addr = 0
+    test_stack_traces = _TEST_STACK_TRACES + [
+        (47, [('sk::sk', '/ignored.c')]),
+        (53, [('sk::content::renderer', '/ignored.c')]),
+        (59, []),
+    ]
+    for test_entry in test_stack_traces * 2:  # Exercise the memoization.
+      mock_strace = stacktrace.Stacktrace()
+      for (mock_btstr, mock_source_path) in test_entry[1]:
+        mock_addr += 4
+        mock_frame = stacktrace.Frame(mock_addr)
+        mock_frame.SetSymbolInfo(symbol.Symbol(mock_btstr, mock_source_path))
+        mock_strace.Add(mock_frame)
+      mock_strace.Add(stacktrace.Frame(mock_addr + 2))  # Not symbolized.
+      nheap.Add(native_heap.Allocation(
+          size=test_entry[0], stack_trace=mock_strace))
+
+    for rules_content in (_TEST_RULES, _UNMERGEABLE_TEST_RULES):
+      rule_tree = native_heap_classifier.LoadRules(rules_content)
+      expected = results.AggreatedResults(rule_tree, ['bytes_allocated'])
+      for allocation in nheap.allocations:
+        expected.AddToMatchingNodes(allocation, [allocation.size])
+      res = native_heap_classifier.Classify(nheap, rule_tree)
+      self._CheckSameValues(res.total, expected.total)
+
+  def _CheckSameValues(self, node, expected_node):
+    self.assertEqual(node.name, expected_node.name)
+    self.assertEqual(node.values[0], expected_node.values[0])
+    self.assertEqual(len(node.children), len(expected_node.children))
+    for child, expected_child in zip(node.children, expected_node.children):
+      self._CheckSameValues(child, expected_child)
+
   def testInferHeuristicRules(self):
     nheap = native_heap.NativeHeap()
     mock_addr = 0
@@ -80,6 +80,26 @@ class AggreatedResults(object):
     AggreatedResults._AddToMatchingNodes(
         trace_record, values, self.total, len(self.keys))
 
+  def AddToNodesAlongPath(self, path, values):
+    """Adds the provided |values| to the nodes selected by |path|.
+
+    This is the counterpart of AddToMatchingNodes for classifiers which can
+    determine upfront which nodes a trace_record would match (e.g., because
+    they memoize the result of the traversal).
+
+    Args:
+      path: a list of child indexes, one per tree level. The first index
+          selects the root (hence it must be 0). An empty list adds nothing.
+      values: as in AddToMatchingNodes.
+    """
+    assert(len(values) == len(self.keys))
+    buckets = [self.total]
+    for child_index in path:
+      bucket = buckets[child_index]
+      for i in xrange(len(self.keys)):
+        bucket.values[i] += values[i]
+      buckets = bucket.children
+
   @staticmethod
   def _AddToMatchingNodes(trace_record, values, bucket, num_keys):
     if not bucket.rule.Match(trace_record):
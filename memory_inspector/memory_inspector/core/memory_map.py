@@ -7,6 +7,9 @@ import bisect
 
 PAGE_SIZE = 4096
 
+# Number of bits set in each byte value, for counting resident pages.
+_POPCOUNT = [bin(i).count('1') for i in xrange(256)]
+
 
 class Map(object):
   """Models the memory map of a given |backends.Process|.
@@ -87,6 +90,58 @@ class MapEntry(object):
       return False
     return (self.resident_pages[arr_idx] & (1 << arr_bit)) != 0
 
+  def GetResidentPagesPrefixSums(self):
+    """Returns [number of resident pages in resident_pages[:i] for each i].
+
+    This can be passed to the Count* methods below, to avoid recomputing it when
+    counting resident pages of many ranges of the same mm."""
+    prefix_sums = [0] * (len(self.resident_pages) + 1)
+    total = 0
+    for i, byte in enumerate(self.resident_pages):
+      total += _POPCOUNT[byte]
+      prefix_sums[i + 1] = total
+    return prefix_sums
+
+  def _CountResidentPagesBefore(self, relative_page_index, prefix_sums):
+    """Counts the resident pages in [0, relative_page_index)."""
+    arr_idx = relative_page_index / 8
+    if arr_idx >= len(self.resident_pages):
+      return prefix_sums[-1]
+    arr_bit = relative_page_index % 8
+    return (prefix_sums[arr_idx] +
+            _POPCOUNT[self.resident_pages[arr_idx] & ((1 << arr_bit) - 1)])
+
+  def CountResidentPages(self, first_page_index, end_page_index,
+                         prefix_sums=None):
+    """Counts the resident pages in [first_page_index, end_page_index)."""
+    if end_page_index <= first_page_index:
+      return 0
+    if prefix_sums is None:
+      prefix_sums = self.GetResidentPagesPrefixSums()
+    return (self._CountResidentPagesBefore(end_page_index, prefix_sums) -
+            self._CountResidentPagesBefore(first_page_index, prefix_sums))
+
+  def CountResidentBytes(self, start_addr, end_addr, prefix_sums=None):
+    """Counts the bytes in [start_addr, end_addr] which lay in resident pages.
+
+    Both addresses are absolute and must belong to the current mm.
+    |prefix_sums| is the optional result of |GetResidentPagesPrefixSums|."""
+    assert(self.Contains(start_addr) and self.Contains(end_addr))
+    assert(start_addr <= end_addr)
+    first_page, first_page_off = self.GetRelativeMMOffset(start_addr)
+    last_page, last_page_off = self.GetRelativeMMOffset(end_addr)
+    if first_page == last_page:
+      if not self.IsPageResident(first_page):
+        return 0
+      return end_addr - start_addr + 1
+    resident_bytes = PAGE_SIZE * self.CountResidentPages(
+        first_page + 1, last_page, prefix_sums)
+    if self.IsPageResident(first_page):
+      resident_bytes += PAGE_SIZE - first_page_off
+    if self.IsPageResident(last_page):
+      resident_bytes += last_page_off + 1
+    return resident_bytes
+
   def Contains(self, abs_addr):
     """Determines whether a given absolute address belongs to the current mm."""
     return abs_addr >= self.start and abs_addr <= self.end
@@ -32,6 +32,18 @@ class MemoryMapTest(unittest.TestCase):
     self.assertFalse(map_entry2.IsPageResident(1))
     self.assertTrue(map_entry2.IsPageResident(2))
 
+    # Test the resident pages / bytes counting logic.
+    self.assertEqual(map_entry2.CountResidentPages(0, 4), 2)
+    self.assertEqual(map_entry2.CountResidentPages(1, 3), 1)
+    self.assertEqual(map_entry2.CountResidentPages(1, 2), 0)
+    self.assertEqual(map_entry2.CountResidentPages(3, 3), 0)
+    self.assertEqual(map_entry2.CountResidentBytes(65536, 65536), 1)
+    self.assertEqual(map_entry2.CountResidentBytes(69632, 69640), 0)
+    # [65540, 73730] = 4092 bytes in page 0 + page 1 (not resident) + 3 bytes
+    # in page 2.
+    self.assertEqual(map_entry2.CountResidentBytes(65540, 73730), 4092 + 3)
+    self.assertEqual(map_entry2.CountResidentBytes(65536, 81919), 2 * 4096)
+
     # Test the lookup logic.
     mmap.Add(map_entry1)
     mmap.Add(map_entry2)
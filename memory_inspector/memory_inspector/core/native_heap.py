@@ -62,38 +62,46 @@ class NativeHeap(object):
     estimates the resident size of an allocation intersecting the mmaps dump.
     """
     assert(isinstance(mmap, memory_map.Map))
-    for alloc in self.allocations:
-      # This function loops over all the memory pages that intersect, partially
-      # or fully, with each allocation. For each of them, the allocation  is
-      # attributed a resident size equal to the size of intersecting range iff
-      # the page is resident.
-      # The tricky part is that, in the general case, an allocation can span
-      # over multiple (contiguous) mmaps. See the chart below for a reference:
-      #
-      # VA space:  |0    |4k   |8k   |12k  |16k  |20k  |24k  |28k  |32k  |
-      # Mmaps:     [   mm 1   ][ mm2 ]           [          map 3        ]
-      # Allocs:      <a1>  <  a2  >                       <      a3      >
-      #
-      # Note: this accounting technique is not fully correct but is generally a
-      # good tradeoff between accuracy and speed of profiling. The OS provides
-      # resident information with the page granularity (typ. 4k). Finer values
-      # would require more fancy techniques based, for instance, on run-time
-      # instrumentation tools like Valgrind or *sanitizer.
-      cur_start = alloc.start
-      mm = None
-      while cur_start < alloc.end:
-        if not mm or not mm.Contains(cur_start):
-          mm = mmap.Lookup(cur_start)
-        if mm:
-          page, page_off = mm.GetRelativeMMOffset(cur_start)
-          if mm.IsPageResident(page):
-            page_end = mm.start + page * PAGE_SIZE + PAGE_SIZE - 1
-            alloc_memory_in_current_page = PAGE_SIZE - page_off
-            if alloc.end < page_end:
-              alloc_memory_in_current_page -= page_end - alloc.end
-            alloc.resident_size += alloc_memory_in_current_page
-        # Move to the next page boundary.
-        cur_start = (cur_start + PAGE_SIZE) & ~(PAGE_SIZE - 1)
+    # Each allocation is attributed, for each memory page that intersects with
+    # it (partially or fully), a resident size equal to the size of the
+    # intersecting range iff the page is resident.
+    # The tricky part is that, in the general case, an allocation can span
+    # over multiple (contiguous) mmaps. See the chart below for a reference:
+    #
+    # VA space:  |0    |4k   |8k   |12k  |16k  |20k  |24k  |28k  |32k  |
+    # Mmaps:     [   mm 1   ][ mm2 ]           [          map 3        ]
+    # Allocs:      <a1>  <  a2  >                       <      a3      >
+    #
+    # Rather than looking up the mmap of every page of every allocation, the
+    # allocations are sorted by start address and swept alongside the (sorted)
+    # mmaps. The resident pages within each intersection are counted using the
+    # resident pages bitmap of the mmap.
+    #
+    # Note: this accounting technique is not fully correct but is generally a
+    # good tradeoff between accuracy and speed of profiling. The OS provides
+    # resident information with the page granularity (typ. 4k). Finer values
+    # would require more fancy techniques based, for instance, on run-time
+    # instrumentation tools like Valgrind or *sanitizer.
+    entries = mmap.entries
+    prefix_sums = {}  # entry index -> |MapEntry.GetResidentPagesPrefixSums|.
+    first_entry_idx = 0
+    for alloc in sorted(self.allocations, key=lambda alloc: alloc.start):
+      alloc_start = alloc.start
+      alloc_end = alloc.end
+      # Allocations are sorted by start, hence mmaps ending before the current
+      # one will not intersect any of the following ones either.
+      while (first_entry_idx < len(entries) and
+             entries[first_entry_idx].end < alloc_start):
+        first_entry_idx += 1
+      entry_idx = first_entry_idx
+      while entry_idx < len(entries) and entries[entry_idx].start <= alloc_end:
+        mm = entries[entry_idx]
+        if entry_idx not in prefix_sums:
+          prefix_sums[entry_idx] = mm.GetResidentPagesPrefixSums()
+        alloc.resident_size += mm.CountResidentBytes(
+            max(alloc_start, mm.start), min(alloc_end, mm.end),
+            prefix_sums[entry_idx])
+        entry_idx += 1
 
 
 class Allocation(object):
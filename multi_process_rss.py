@@ -16,13 +16,22 @@
 #
 # The command line above counts the RSS of 1) process 12345, 2) process 23456
 # and 3) all descendant processes of process 23456.
+#
+# With --interval, it keeps sampling the processes (re-listing descendants at
+# every sample) and prints, for each sample and process, the bytes of its page
+# frames which are unique to it, shared with the other processes and its
+# proportional share (as in PSS) as a tab-separated time series:
+# ./multi-process-rss.py --interval 5 23456r
 
 
+import argparse
 import collections
 import logging
+import multiprocessing.pool
 import os
 import psutil
 import sys
+import time
 
 
 if sys.platform.startswith('linux'):
@@ -53,9 +62,9 @@ def _recursive_get_children(pid):
   return descendant
 
 
-def list_pids(argv):
+def list_pids(args):
   pids = []
-  for arg in argv[1:]:
+  for arg in args:
     try:
       if arg.endswith('r'):
         recursive = True
@@ -98,6 +107,70 @@ def count_pageframes(pids):
   return pageframes
 
 
+def sample_sharing(samplers, pool):
+  """Samples the pagemaps of |samplers| concurrently and accounts sharing.
+
+  Args:
+    samplers: a dict of pid -> procfs.ProcPagemapSampler.
+    pool: a ThreadPool used to read the pagemaps.
+
+  Returns:
+    A tuple (sharing, totals). |sharing| is the dict of pid -> (unique, shared,
+    proportional) returned by procfs.PageFrames.count_sharing. |totals| is a
+    tuple (unique, shared, proportional) for all the processes, without double
+    counts: the distinct shared page frames are counted once.
+  """
+  pids = sorted(samplers)
+  pagemaps = pool.map(lambda pid: samplers[pid].sample(), pids)
+  pageframes_by_pid = {}
+  for pid, pagemap in zip(pids, pagemaps):
+    if not pagemap:
+      _LOGGER.warning('/proc/%d/pagemap not readable.' % pid)
+      continue
+    pageframes_by_pid[pid] = pagemap.pageframes
+  sharing = procfs.PageFrames.count_sharing(pageframes_by_pid)
+  total_unique = sum(unique for unique, _, _ in sharing.itervalues())
+  # The proportional shares of a page frame add up to 1 across processes.
+  total = int(round(sum(proportional
+                        for _, _, proportional in sharing.itervalues())))
+  return sharing, (total_unique, total - total_unique, total)
+
+
+def run_sampling(pid_args, interval, count, jobs):
+  """Prints the per-process sharing of |pid_args| every |interval| seconds."""
+  samplers = {}
+  pool = multiprocessing.pool.ThreadPool(jobs)
+  print '\t'.join(('time', 'pid', 'unique', 'shared', 'proportional'))
+  try:
+    sample_index = 0
+    while not count or sample_index < count:
+      if sample_index:
+        time.sleep(interval)
+      sample_index += 1
+      pids = list_pids(pid_args)
+      for pid in set(samplers) - set(pids):
+        samplers.pop(pid).close()
+      for pid in pids:
+        if pid not in samplers:
+          samplers[pid] = procfs.ProcPagemapSampler(pid)
+
+      timestamp = time.time()
+      sharing, totals = sample_sharing(samplers, pool)
+      rows = [(str(pid), sharing[pid]) for pid in pids if pid in sharing]
+      rows.append(('total', totals))
+      for name, (unique, shared, proportional) in rows:
+        print '%.3f\t%s\t%d\t%d\t%d' % (
+            timestamp, name, unique * 4096, shared * 4096,
+            int(round(proportional * 4096)))
+      sys.stdout.flush()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    pool.close()
+    for sampler in samplers.itervalues():
+      sampler.close()
+
+
 def count_statm(pids):
   resident = 0
   shared = 0
@@ -116,6 +189,21 @@ def count_statm(pids):
 
 
 def main(argv):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('pids', nargs='+', metavar='<pid>|<pid>r',
+                      help='Processes to account. With a trailing r, all the '
+                      'descendants of the process are accounted too.')
+  parser.add_argument('--interval', type=float,
+                      help='Keep sampling every INTERVAL seconds, printing '
+                      'the unique, shared and proportional bytes of each '
+                      'process.')
+  parser.add_argument('--count', type=int, default=0,
+                      help='Number of samples with --interval (default: until '
+                      'interrupted).')
+  parser.add_argument('--jobs', type=int, default=8,
+                      help='Number of processes sampled concurrently.')
+  args = parser.parse_args(argv[1:])
+
   logging_handler = logging.StreamHandler()
   logging_handler.setLevel(logging.WARNING)
   logging_handler.setFormatter(logging.Formatter(
@@ -127,7 +215,10 @@ def main(argv):
   if sys.platform.startswith('linux'):
     logging.getLogger('procfs').setLevel(logging.WARNING)
     logging.getLogger('procfs').addHandler(logging_handler)
-    pids = list_pids(argv)
+    if args.interval:
+      run_sampling(args.pids, args.interval, args.count, args.jobs)
+      return 0
+    pids = list_pids(args.pids)
     pageframes = count_pageframes(pids)
   else:
     _LOGGER.error('%s is not supported.' % sys.platform)